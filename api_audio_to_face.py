@@ -4,15 +4,22 @@
 import pygame
 from flask import Flask, request, jsonify
 from threading import Thread
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 import torch 
 
-from model import load_model
+from model import load_model, model_fingerprint
 
-from utils.api_utils import initialize_directories, process_preprocessing_queue, process_playback_queue, queue_lock
+from utils.api_utils import initialize_directories, create_clip_pipeline, process_playback_queue, playback_backlog_seconds, queue_lock, active_streams, playback_stats, GENERATED_DIR
+from utils.audio_stream import AudioStreamSession
+from utils.result_cache import ResultCache
+from utils.persistence import PersistenceWriter
+from utils.generated_manifest import open_manifest
+from utils.serving import AdmissionController, AdmissionMiddleware, add_health_routes, overloaded_response, run_app
+from extraction.extraction_pool import FeatureExtractionPool
 
 from livelink.animations.default_animation import default_animation_loop, stop_default_animation
-from livelink.connect.livelink_init import create_socket_connection, initialize_py_face
+from livelink.connect.livelink_init import initialize_py_face
+from livelink.sender_process import SenderProcess
 
 config = {
     'sr': 88200,  
@@ -24,45 +31,145 @@ config = {
     'output_dim': 68,      
     'input_dim': 26 + 26 + 26, 
     'frame_size': 256,
+    'batch_size': 8,  # windows decoded per model pass, set to 1 for the chunk by chunk path
+    'backend': 'eager',  # eager, torchscript, compile or onnx (see model_backends.py)
+    'onnx_path': '_out/model.onnx',
+    'precision': 'fp32',  # fp32, int8 (dynamic quantized Linear layers, CPU only) or bf16 (autocast)
+    'lazy_load': False,  # True defers reading the weights until the first inference
+    'result_cache_size': 256,  # audio -> blendshape results kept in memory, 0 disables the cache
+    'result_cache_disk': True,  # also keep results on disk under generated/<audio hash>_<model fingerprint>
+    'shapes_format': 'both',  # generated shapes as both (npz read back, csv for Unreal), npz only (binary, memory-mappable) or csv only, see utils/csv/shapes_store.py
+    'shapes_dtype': 'float32',  # float16 halves the npz files, ~1e-3 precision
+    'persistence_queue_size': 32,  # results waiting to be written to generated/ by the background writer
+    'persistence_policy': 'block',  # when that queue is full: block (wait for the disk) or drop (skip saving the result)
+    'extraction_workers': 2,  # feature extraction processes, 0 extracts on the features stage's threads
+    'pipeline': {  # /audio_to_face stages, each with its worker threads and the clips allowed to wait in front of it (see utils/api_utils.py)
+        'decode': {'workers': 1, 'queue_size': 8},  # requests waiting here, /audio_to_face answers 429 once it is full
+        'features': {'workers': 1, 'queue_size': 4},
+        'inference': {'workers': 1, 'queue_size': 4},
+        'encode': {'workers': 1, 'queue_size': 2},
+        'playback': {'queue_size': 2},  # clips encoded and ready to play the moment the current one ends, one playback thread
+    },
+    'stream_window_frames': 256,  # output frames per window on /audio_to_face_stream, smaller starts the face sooner
+    'stream_features': 'online',  # online: running CMVN over the whole stream, window: each window normalised on its own
+    'stream_read_size': 16384,  # bytes read from a streamed upload at a time
+    'sender_process': True,  # send LiveLink frames and the idle animation from a separate process, clear of the GIL
+    'smoothing': {'filter': 'moving_average', 'window': 2, 'centred': True},  # on the generated frames, see processing/temporal_filters.py (moving_average, ema, one_euro, savgol), None disables
+    'livelink_filter': None,  # filter on the frames as they are encoded for LiveLink, e.g. {'filter': 'one_euro', 'min_cutoff': 1.0, 'beta': 0.5}
+    'server': 'asgi',  # asgi: uvicorn (if installed) in front of the Flask app, views run on executor threads; flask: the development server
+    'serving_threads': 32,  # executor threads for the views, raised if needed to fit every admitted request, see utils/serving.py
+    'serving_max_connections': 128,  # open connections beyond this are answered with 503 by uvicorn
+    'max_queue_wait_s': 30.0,  # /audio_to_face and /audio_to_face_stream answer 429 when the audio queued ahead would play for longer than this
+    'max_concurrent_requests': 4,  # /audio_to_face requests being queued at once
+    'max_waiting_requests': 16,  # requests waiting for one of those slots
+    'max_concurrent_streams': 2,  # chunked uploads to /audio_to_face_stream running at once
 }
 
 model_path = '_out/model.pth'
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model = load_model(model_path, config, device)
 
+persistence_writer = PersistenceWriter(config['persistence_queue_size'], config['persistence_policy']).start()
+fingerprint = model_fingerprint(model_path, config)
+manifest = open_manifest(GENERATED_DIR, fingerprint) # index of generated/, see utils/generated_manifest.py
+
+result_cache = None
+if config['result_cache_size'] > 0:
+    result_cache = ResultCache(fingerprint, config['result_cache_size'], GENERATED_DIR if config['result_cache_disk'] else None,
+                               config['shapes_format'], config['shapes_dtype'], config['frame_rate'], persistence_writer, manifest)
+
+extraction_pool = FeatureExtractionPool(config['extraction_workers']).warm_up() if config['extraction_workers'] > 0 else None
 
 app = Flask(__name__)
 
-py_face = initialize_py_face()
-socket_connection = create_socket_connection()
+py_face = initialize_py_face(config['livelink_filter'])
 
-default_animation_thread = Thread(target=default_animation_loop, args=(py_face,))
-default_animation_thread.start()
+sender = None
+default_animation_thread = None
+if config['sender_process']:
+    sender = SenderProcess(py_face).start() # forked before the serving threads exist
+    sender.set_idle(True)
+else:
+    default_animation_thread = Thread(target=default_animation_loop, args=(py_face,))
+    default_animation_thread.start()
 
-request_queue = Queue()
-preprocessed_data_queue = Queue()
+preprocessed_data_queue = Queue(maxsize=config['pipeline']['playback']['queue_size'])
+pipeline = create_clip_pipeline(preprocessed_data_queue, model, device, config, result_cache, extraction_pool, persistence_writer, manifest)
 
 initialize_directories()
 
+def queued_playback_seconds():
+    return playback_backlog_seconds(pipeline.pending() + preprocessed_data_queue.qsize())
+
+admission = {
+    '/audio_to_face': AdmissionController(config['max_concurrent_requests'], config['max_waiting_requests'], config['max_queue_wait_s'], queued_playback_seconds),
+    '/audio_to_face_stream': AdmissionController(config['max_concurrent_streams'], 0, config['max_queue_wait_s'], queued_playback_seconds),
+}
+app.wsgi_app = AdmissionMiddleware(app.wsgi_app, admission)
+
+playback_queue_thread = Thread(target=process_playback_queue, args=(preprocessed_data_queue, py_face, default_animation_thread, pipeline, sender))
+
+add_health_routes(app, {
+    'pipeline': pipeline.is_running,
+    'playback': playback_queue_thread.is_alive,
+    'extraction_pool': lambda: extraction_pool is None or extraction_pool.is_running(),
+    'persistence_writer': persistence_writer.is_running,
+    'sender': lambda: sender is None or sender.is_running(),
+    'accepting': lambda: queued_playback_seconds() <= config['max_queue_wait_s'] and not pipeline.full(),
+})
+
 @app.route('/audio_to_face', methods=['POST'])
 def play_audio_route():
     audio_bytes = request.data
 
-    with queue_lock:
-        request_queue.put(audio_bytes)
+    try:
+        pipeline.submit(audio_bytes)
+    except Full: # bounded, a burst is turned away instead of growing the queue and everyone's wait
+        return overloaded_response(queued_playback_seconds())
     
     return jsonify({'status': 'queued'})
 
+@app.route('/audio_to_face_stream', methods=['POST'])
+def stream_audio_route():
+    # chunked upload: each window is decoded and queued for playback as soon as its audio has arrived
+    session = AudioStreamSession(model, device, config, preprocessed_data_queue, pipeline.generation)
+    try:
+        while True:
+            chunk = request.stream.read(config['stream_read_size'])
+            if not chunk:
+                break
+            session.feed(chunk)
+    finally:
+        session.finish()
+
+    return jsonify({'status': 'streaming'})
+
+@app.route('/persistence_stats', methods=['GET'])
+def persistence_stats_route():
+    return jsonify(persistence_writer.stats())
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats_route():
+    return jsonify({path: controller.stats() for path, controller in admission.items()})
+
+@app.route('/pipeline_stats', methods=['GET'])
+def pipeline_stats_route():
+    return jsonify(pipeline.stats())
+
+@app.route('/playback_stats', methods=['GET'])
+def playback_stats_route():
+    with queue_lock:
+        return jsonify(dict(playback_stats))
+
 @app.route('/clear_queue', methods=['POST'])
 def clear_queue_route():
     global stop_default_animation, default_animation_thread
 
     with queue_lock:
-        while not request_queue.empty():
-            try:
-                request_queue.get_nowait()
-            except Empty:
-                break
+        for session in list(active_streams):
+            session.cancel()
+
+        pipeline.clear()
 
         while not preprocessed_data_queue.empty():
             try:
@@ -70,26 +177,29 @@ def clear_queue_route():
             except Empty:
                 break
 
+        if sender is not None:
+            sender.clear() # the frames of the clip playing now, already in the shared ring
+
     return jsonify({'status': 'cleared'})
 
 if __name__ == '__main__':
-    preprocessing_queue_thread = Thread(target=process_preprocessing_queue, args=(request_queue, preprocessed_data_queue, model, device, config))
-    preprocessing_queue_thread.start()
-    
-    playback_queue_thread = Thread(target=process_playback_queue, args=(preprocessed_data_queue, py_face, default_animation_thread, request_queue))
+    pipeline.start()
     playback_queue_thread.start()
     
     try:
-        app.run(host='0.0.0.0', port=7777)
+        run_app(app, config, port=7777)
     finally:
         stop_default_animation.set()
         if default_animation_thread:
             default_animation_thread.join()
         pygame.quit()
         
-        with queue_lock:
-            request_queue.put(None)
-        preprocessing_queue_thread.join()
+        pipeline.stop() # lets the clips already queued through to playback
+        if extraction_pool is not None:
+            extraction_pool.shutdown()
+        persistence_writer.stop() # writes whatever is still queued
 
         preprocessed_data_queue.put((None, None))
-        playback_queue_thread.join()
\ No newline at end of file
+        playback_queue_thread.join()
+        if sender is not None:
+            sender.stop()
\ No newline at end of file
@@ -1,13 +1,20 @@
 # This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
 # For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import numpy as np
 import torch
 from processing.audio_processing import process_audio_features
+from processing.inference_scheduler import InferenceScheduler
 from extraction.extract_features import extract_audio_features
-from generate_face_shapes import generate_facial_data_from_bytes
-from model import load_model
+from extraction.extraction_pool import FeatureExtractionPool
+from generate_face_shapes import generate_facial_data_from_features, stream_facial_data_from_features
+from model import load_model, model_fingerprint
+from utils.result_cache import ResultCache
+from utils.persistence import PersistenceWriter
+from utils.generated_manifest import open_manifest, GENERATED_DIR
+from utils.serving import AdmissionController, AdmissionMiddleware, add_health_routes, run_app
+from utils.response_formats import negotiate_format, encode_binary, encode_msgpack, ndjson_lines, split_blocks
 
 config = {
     'sr': 88200,  
@@ -19,31 +26,138 @@ config = {
     'output_dim': 68,      
     'input_dim': 26 + 26 + 26, 
     'frame_size': 256,
+    'batch_size': 8,  # windows decoded per model pass, set to 1 for the chunk by chunk path
+    'backend': 'eager',  # eager, torchscript, compile or onnx (see model_backends.py)
+    'onnx_path': '_out/model.onnx',
+    'precision': 'fp32',  # fp32, int8 (dynamic quantized Linear layers, CPU only) or bf16 (autocast)
+    'lazy_load': False,  # True defers reading the weights until the first inference
+    'result_cache_size': 256,  # audio -> blendshape results kept in memory, 0 disables the cache
+    'result_cache_disk': True,  # also keep results on disk under generated/<audio hash>_<model fingerprint>
+    'shapes_format': 'both',  # generated shapes as both (npz read back, csv for Unreal), npz only (binary, memory-mappable) or csv only, see utils/csv/shapes_store.py
+    'shapes_dtype': 'float32',  # float16 halves the npz files, ~1e-3 precision
+    'persistence_queue_size': 32,  # results waiting to be written to generated/ by the background writer
+    'persistence_policy': 'block',  # when that queue is full: block (wait for the disk) or drop (skip saving the result)
+    'scheduler_max_batch_size': 16,  # windows from concurrent requests run together in one model pass
+    'scheduler_max_wait_ms': 10,  # longest a window waits for others to join its batch
+    'extraction_workers': 2,  # feature extraction processes, 0 extracts on the request thread
+    'server': 'asgi',  # asgi: uvicorn (if installed) in front of the Flask app, views run on executor threads; flask: the development server
+    'serving_threads': 32,  # executor threads for the views, raised if needed to fit every admitted request, see utils/serving.py
+    'serving_max_connections': 128,  # open connections beyond this are answered with 503 by uvicorn
+    'max_concurrent_requests': 8,  # /audio_to_blendshapes requests extracting / inferring at once, their windows share the scheduler's batches
+    'max_waiting_requests': 16,  # requests waiting for one of those slots
+    'max_queue_wait_s': 10.0,  # requests whose estimated wait is longer are answered 429 with Retry-After
 }
 
 model_path = '_out/model.pth'
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model = load_model(model_path, config, device)
 
+extraction_pool = FeatureExtractionPool(config['extraction_workers']).warm_up()
+
 app = Flask(__name__)
 
+scheduler = InferenceScheduler(model, device, config).start()
+
+persistence_writer = PersistenceWriter(config['persistence_queue_size'], config['persistence_policy']).start()
+
+result_cache = None
+if config['result_cache_size'] > 0:
+    fingerprint = model_fingerprint(model_path, config)
+    manifest = open_manifest(GENERATED_DIR, fingerprint) if config['result_cache_disk'] else None
+    result_cache = ResultCache(fingerprint, config['result_cache_size'], GENERATED_DIR if config['result_cache_disk'] else None,
+                               config['shapes_format'], config['shapes_dtype'], config['frame_rate'], persistence_writer, manifest)
+
+def generate_facial_data(audio_bytes):
+    # extraction runs in the pool while this thread waits without the GIL, so other requests keep inferring meanwhile.
+    audio_features = extraction_pool.extract(audio_bytes)
+    return generate_facial_data_from_features(audio_features, model, device, config, scheduler=scheduler)
+
+def stream_facial_data(audio_features, claim=None):
+    # with a ResultClaim the whole result goes into the cache at the end, identical requests meanwhile wait for it
+    blocks = []
+    for block in stream_facial_data_from_features(audio_features, model, device, config, scheduler=scheduler):
+        blocks.append(block)
+        yield block
+    if claim is not None:
+        claim.complete(np.concatenate(blocks) if blocks else np.zeros((0, config['output_dim']), dtype=np.float32))
+
 def preprocess_audio(audio_bytes):
-    return generate_facial_data_from_bytes(audio_bytes, model, device)
+    if result_cache is not None:
+        generated_facial_data, _ = result_cache.get_or_compute(audio_bytes, lambda: generate_facial_data(audio_bytes))
+        return generated_facial_data
+    return generate_facial_data(audio_bytes)
+
+admission = AdmissionController(config['max_concurrent_requests'], config['max_waiting_requests'], config['max_queue_wait_s'])
+app.wsgi_app = AdmissionMiddleware(app.wsgi_app, {'/audio_to_blendshapes': admission})
 
-audio_file_path = 'sample_data/audio.wav'
-extracted_features, _ = extract_audio_features(audio_file_path)
-final_decoded_outputs = process_audio_features(extracted_features, model, device, config)
-print("Initial test output:", final_decoded_outputs)
+add_health_routes(app, {
+    'scheduler': scheduler.is_running,
+    'extraction_pool': extraction_pool.is_running,
+    'persistence_writer': persistence_writer.is_running,
+    'accepting': lambda: not admission.overloaded(),
+})
+
+if not config['lazy_load']: # warm-up inference, skipped for lazy loading so the pod can serve straight away
+    audio_file_path = 'sample_data/audio.wav'
+    extracted_features, _ = extract_audio_features(audio_file_path)
+    final_decoded_outputs = process_audio_features(extracted_features, model, device, config)
+    print("Initial test output:", final_decoded_outputs)
 
 @app.route('/audio_to_blendshapes', methods=['POST'])
 def audio_to_blendshapes_route():
+    # Accept (or ?format=): application/json (default), application/octet-stream (raw float32, ?dtype=float16), application/msgpack, application/x-ndjson (streamed)
+    try:
+        response_format, dtype = negotiate_format(request.headers.get('Accept'), request.args.get('format'), request.args.get('dtype'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 406
+
     audio_bytes = request.data
-    
+
+    if response_format == 'ndjson':
+        claim = result_cache.claim(audio_bytes) if result_cache is not None else None
+        if result_cache is not None and claim is None: # cached, or being computed by another request
+            blocks = split_blocks(preprocess_audio(audio_bytes), config['frame_size'])
+        else: # each window is sent as soon as it is decoded, extraction errors still fail the request before the stream starts
+            try:
+                audio_features = extraction_pool.extract(audio_bytes)
+            except Exception:
+                if claim is not None:
+                    claim.abandon()
+                raise
+            blocks = stream_facial_data(audio_features, claim)
+        response = Response(stream_with_context(ndjson_lines(blocks, config['frame_rate'])), mimetype='application/x-ndjson')
+        if claim is not None: # a stream that fails or is closed before its end gives the waiting requests back their own computation
+            response.call_on_close(claim.abandon)
+        return response
+
     generated_facial_data = preprocess_audio(audio_bytes)
-    
+
+    if response_format == 'binary':
+        body, headers = encode_binary(generated_facial_data, dtype, config['frame_rate'])
+        return Response(body, mimetype='application/octet-stream', headers=headers)
+    if response_format == 'msgpack':
+        return Response(encode_msgpack(generated_facial_data, dtype, config['frame_rate']), mimetype='application/msgpack')
+
     generated_facial_data_list = generated_facial_data.tolist() if isinstance(generated_facial_data, np.ndarray) else generated_facial_data
     
     return jsonify({'blendshapes': generated_facial_data_list})
 
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats_route():
+    return jsonify(scheduler.stats())
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats_route():
+    return jsonify(admission.stats())
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify(result_cache.stats() if result_cache is not None else {'enabled': False})
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=7777)
+    try:
+        run_app(app, config, port=7777)
+    finally:
+        scheduler.stop()
+        extraction_pool.shutdown()
+        persistence_writer.stop() # writes whatever is still queued
@@ -9,6 +9,9 @@ import librosa
 import io
 
 from extraction.extract_features_utils import extract_overlapping_mfcc, reduce_features
+from extraction.mfcc_engine import get_mfcc_engine
+from utils.audio.fast_wav import decode_audio_bytes
+from utils.audio.decoded_audio import DecodedAudio
 
 def load_and_preprocess_audio(audio_path, sr=88200):
     y, sr = load_audio(audio_path, sr)
@@ -24,13 +27,14 @@ def load_audio(audio_path, sr=88200):
     return y, sr
 
 def load_audio_from_bytes(audio_bytes, sr):
-    audio_file = io.BytesIO(audio_bytes)
-    y, sr = librosa.load(audio_file, sr=sr)
+    y, sr = decode_audio_bytes(audio_bytes, sr) # PCM WAV is parsed directly, other formats fall back to librosa.load
     return y, sr
 
 
 def extract_audio_features(audio_input, sr=88200, from_bytes=False):
-    if from_bytes:
+    if isinstance(audio_input, DecodedAudio): # decoded once per request, only resampled here for the model
+        y = audio_input.resampled(sr)
+    elif from_bytes:
         y, sr = load_audio_from_bytes(audio_input, sr)
     else:
         y, sr = load_and_preprocess_audio(audio_input, sr)
@@ -49,9 +53,13 @@ def extract_audio_features(audio_input, sr=88200, from_bytes=False):
     
     return combined_features, y
 
-def extract_and_combine_features(y, sr, frame_length, hop_length):
-    all_features = []
+def extract_and_combine_features(y, sr, frame_length, hop_length, use_librosa=False):
     num_mfcc = 26 
+
+    if not use_librosa: # cached window / mel / DCT engine, matches the librosa path below (python -m extraction.mfcc_engine checks it)
+        return get_mfcc_engine(sr, num_mfcc, frame_length, hop_length).features(y)
+
+    all_features = []
     
     mfcc_features = extract_overlapping_mfcc(y, sr, num_mfcc, frame_length, hop_length)
     reduced_mfcc_features = reduce_features(mfcc_features)
@@ -0,0 +1,87 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# extraction_pool.py
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from extraction.extract_features import extract_audio_features
+
+def extract_features_from_bytes(audio):
+    # audio bytes, or a DecodedAudio whose samples are pickled to the worker instead of being decoded again
+    audio_features, _ = extract_audio_features(audio, from_bytes=True)
+    return audio_features # only the feature matrix goes back to the parent, the decoded waveform stays in the worker
+
+class FeatureExtractionPool:
+    """
+    Runs extract_audio_features (librosa decode, resample, MFCC, deltas) in worker processes so it neither holds the GIL
+    of the serving process nor waits behind inference. num_workers=0 extracts inline on the calling thread.
+
+    Workers are forked, the entry points load the model and open sockets at import so a spawned worker would repeat all of that;
+    where fork is unavailable (Windows) a thread pool is used instead.
+
+    A worker that dies (killed, out of memory, crashed in native code) breaks the whole ProcessPoolExecutor, seen either when
+    submitting or in a future's result. The requests that saw it fail and broken is set for good: is_running() turns false,
+    so /ready answers 503 and the orchestrator drains and replaces the process. The pool is not started again, forking from
+    a process whose serving threads are running can deadlock the child, and spawned / forkserver workers import the entry point.
+    Until then later requests are extracted on the calling thread.
+    """
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self.executor = None
+        self.broken = False
+        if num_workers > 0:
+            self.executor = self._create_executor()
+
+    def _create_executor(self):
+        if 'fork' in multiprocessing.get_all_start_methods():
+            return ProcessPoolExecutor(max_workers=self.num_workers, mp_context=multiprocessing.get_context('fork'))
+        return ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def warm_up(self):
+        """Start the workers now, ideally before the serving threads exist, instead of on the first request."""
+        if self.executor is not None:
+            for future in [self.executor.submit(os.getpid) for _ in range(self.num_workers)]:
+                future.result()
+        return self
+
+    def submit(self, audio):
+        if self.executor is not None and not self.broken:
+            try:
+                future = self.executor.submit(extract_features_from_bytes, audio)
+            except BrokenProcessPool:
+                self._mark_broken()
+            else:
+                future.add_done_callback(self._check_result)
+                return future
+
+        future = Future()
+        try:
+            future.set_result(extract_features_from_bytes(audio))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def extract(self, audio):
+        return self.submit(audio).result()
+
+    def is_running(self):
+        return self.num_workers == 0 or (self.executor is not None and not self.broken)
+
+    def _check_result(self, future):
+        # a worker that dies mid-request only shows up here, in the future the features stage waits on
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._mark_broken()
+
+    def _mark_broken(self):
+        if not self.broken:
+            self.broken = True
+            print("Feature extraction pool broken (a worker died), extracting on the request threads until the process is replaced.")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
@@ -0,0 +1,173 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# mfcc_engine.py
+# python -m extraction.mfcc_engine [audio.wav] -> checks the engine against the librosa feature path
+
+import sys
+import math
+from functools import lru_cache
+
+import numpy as np
+import librosa
+
+from extraction.extract_features_utils import reduce_features
+
+class MfccEngine:
+    """
+    The librosa MFCC front-end (STFT -> mel -> dB -> DCT -> CMVN -> deltas -> pair reduction) as plain array ops,
+    with the window, mel basis, DCT matrix and delta filters built once for a fixed sr / n_fft / hop.
+    features() handles one clip in NumPy, features_batch() featurizes several clips at once with an optional torch STFT/mel/DCT.
+    """
+    def __init__(self, sr=88200, num_mfcc=26, frame_length=1470, hop_length=735, n_mels=128, top_db=80.0, delta_width=9):
+        self.sr = sr
+        self.num_mfcc = num_mfcc
+        self.n_fft = frame_length
+        self.hop_length = hop_length
+        self.top_db = top_db
+        self.delta_width = delta_width
+
+        # same defaults as librosa.feature.mfcc: periodic hann window, slaney mel basis, orthonormal DCT-II
+        self.window = 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(self.n_fft) / self.n_fft)
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=self.n_fft, n_mels=n_mels).astype(np.float32)
+        self.dct_matrix = dct_ortho_matrix(n_mels)[:num_mfcc].astype(np.float32)
+        self.delta_filters = {order: savgol_interp_filters(delta_width, order) for order in (1, 2)}
+
+        self._torch_tensors = {}
+
+    def num_stft_frames(self, num_samples):
+        return 1 + num_samples // self.hop_length # center=True pads n_fft // 2 on each side
+
+    def stft_power(self, y):
+        pad = self.n_fft // 2
+        y_padded = np.pad(y, (pad, pad), mode='constant')
+        frames = np.lib.stride_tricks.sliding_window_view(y_padded, self.n_fft)[::self.hop_length]
+        spectrum = np.fft.rfft(frames * self.window, axis=-1).astype(np.complex64)
+        return (spectrum.real ** 2 + spectrum.imag ** 2).T # [n_bins, frames]
+
+    def log_mel(self, power):
+        log_spec = 10.0 * np.log10(np.maximum(1e-10, self.mel_basis @ power))
+        return np.maximum(log_spec, log_spec.max() - self.top_db)
+
+    def mfcc(self, y):
+        return self.dct_matrix @ self.log_mel(self.stft_power(y))
+
+    def finish(self, mfcc):
+        """CMVN, deltas and pair reduction of a [num_mfcc, frames] clip, returns [reduced frames, 3 * num_mfcc]."""
+        mfcc = (mfcc - mfcc.mean(axis=1, keepdims=True)) / (mfcc.std(axis=1, keepdims=True) + 1e-10)
+        combined = np.vstack([mfcc, self.delta(mfcc, 1), self.delta(mfcc, 2)])
+        return reduce_features(combined).T
+
+    def features(self, y):
+        return self.finish(self.mfcc(np.asarray(y, dtype=np.float32)))
+
+    def delta(self, data, order):
+        left, centre, right = self.delta_filters[order]
+        half = self.delta_width // 2
+        if data.shape[-1] < self.delta_width:
+            raise ValueError(f"need at least {self.delta_width} frames for deltas, got {data.shape[-1]}")
+
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.delta_width, axis=-1)
+        output = np.empty_like(data)
+        output[:, half:-half] = windows @ centre
+        output[:, :half] = data[:, :self.delta_width] @ left.T
+        output[:, -half:] = data[:, -self.delta_width:] @ right.T
+        return output
+
+    def features_batch(self, clips, backend='numpy', device='cpu'):
+        if backend == 'numpy':
+            return [self.features(y) for y in clips]
+        if backend == 'torch':
+            return [self.finish(mfcc) for mfcc in self.mfcc_batch_torch(clips, device)]
+        raise ValueError(f"Unknown MFCC backend '{backend}', expected 'numpy' or 'torch'")
+
+    def mfcc_batch_torch(self, clips, device='cpu'):
+        import torch
+
+        window, mel_basis, dct_matrix = self.torch_tensors(device)
+        lengths = [len(y) for y in clips]
+        batch = torch.zeros(len(clips), max(lengths), dtype=torch.float32)
+        for i, y in enumerate(clips):
+            batch[i, :len(y)] = torch.from_numpy(np.asarray(y, dtype=np.float32))
+        batch = batch.to(device)
+
+        with torch.no_grad():
+            # zero padding past the end of a shorter clip matches the constant centre padding, so its valid frames are unaffected
+            spectrum = torch.stft(batch, self.n_fft, self.hop_length, window=window, center=True, pad_mode='constant', return_complex=True)
+            log_spec = 10.0 * torch.log10(torch.clamp(mel_basis @ spectrum.abs().pow(2), min=1e-10))
+
+            valid_frames = torch.tensor([self.num_stft_frames(length) for length in lengths], device=device)
+            valid = torch.arange(log_spec.shape[-1], device=device)[None, :] < valid_frames[:, None]
+            peak = log_spec.masked_fill(~valid[:, None, :], float('-inf')).amax(dim=(1, 2), keepdim=True)
+            log_spec = torch.maximum(log_spec, peak - self.top_db)
+
+            mfcc = (dct_matrix @ log_spec).cpu().numpy()
+
+        return [mfcc[i, :, :self.num_stft_frames(length)] for i, length in enumerate(lengths)]
+
+    def torch_tensors(self, device):
+        import torch
+
+        key = str(device)
+        if key not in self._torch_tensors:
+            self._torch_tensors[key] = (
+                torch.from_numpy(self.window.astype(np.float32)).to(device),
+                torch.from_numpy(self.mel_basis).to(device),
+                torch.from_numpy(self.dct_matrix).to(device),
+            )
+        return self._torch_tensors[key]
+
+def dct_ortho_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * k * (2 * i + 1) / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+def savgol_interp_filters(width, order):
+    """
+    Savitzky-Golay derivative filters as used by librosa.feature.delta (polyorder=order, mode='interp'):
+    a centre filter for the interior and [half, width] matrices that evaluate the edge polynomial fits for the first / last half frames.
+    """
+    half = width // 2
+    positions = np.arange(width) - half
+    vandermonde = positions[:, None] ** np.arange(order + 1)[None, :]
+    fit = np.linalg.pinv(vandermonde)
+
+    def derivative_at(u):
+        row = np.array([math.perm(power, order) * float(u) ** max(power - order, 0) for power in range(order + 1)])
+        return row @ fit
+
+    centre = derivative_at(0)
+    left = np.stack([derivative_at(u) for u in range(-half, 0)])
+    right = np.stack([derivative_at(u) for u in range(1, half + 1)])
+    return left.astype(np.float32), centre.astype(np.float32), right.astype(np.float32)
+
+@lru_cache(maxsize=None)
+def get_mfcc_engine(sr, num_mfcc, frame_length, hop_length):
+    return MfccEngine(sr, num_mfcc, frame_length, hop_length)
+
+def compare_with_librosa(y, sr=88200, num_mfcc=26):
+    from extraction.extract_features_utils import extract_overlapping_mfcc
+
+    frame_length = int(0.01667 * sr)
+    hop_length = frame_length // 2
+    reference = reduce_features(extract_overlapping_mfcc(y, sr, num_mfcc, frame_length, hop_length)).T
+    engine = get_mfcc_engine(sr, num_mfcc, frame_length, hop_length)
+    return {backend: float(np.abs(engine.features_batch([y], backend)[0] - reference).max()) for backend in ('numpy', 'torch')}
+
+if __name__ == '__main__':
+    audio_path = sys.argv[1] if len(sys.argv) > 1 else 'sample_data/audio.wav'
+    tolerance = 1e-3
+
+    y, sr = librosa.load(audio_path, sr=88200)
+    noise = np.random.RandomState(0).randn(sr * 3).astype(np.float32) * 0.1
+
+    passed = True
+    for name, signal in ((audio_path, y), ('3 s of noise', noise)):
+        errors = compare_with_librosa(signal, sr)
+        print(f"{name}: max abs difference to librosa, " + ", ".join(f"{backend} {error:.3g}" for backend, error in errors.items()))
+        passed = passed and max(errors.values()) <= tolerance
+
+    print("PASS" if passed else f"FAIL (tolerance {tolerance})")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,224 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# online_features.py
+# python -m extraction.online_features [audio.wav] [--cmvn running|window] [--lookahead 4] [--block-ms 20] -> divergence from the offline features
+
+import argparse
+
+import numpy as np
+import librosa
+
+from extraction.mfcc_engine import get_mfcc_engine
+from extraction.extract_features import extract_and_combine_features
+
+CMVN_MODES = ('running', 'window')
+
+class OnlineFeatureExtractor:
+    """
+    Streaming version of extract_and_combine_features: process() takes audio blocks of any length at sr and returns the
+    [frames, 3 * num_mfcc] pair-reduced feature frames they complete, flush() ends the utterance and returns the rest.
+
+    CMVN uses the statistics seen so far ('running') or of the last cmvn_window MFCC frames ('window') instead of the whole clip,
+    and the dB floor follows the running peak rather than the clip peak. The first frames of an utterance dominate the divergence
+    from the offline path; cmvn_prior=(mean, std, frames) seeds the running statistics as if that many frames had already been seen.
+    Deltas use the same 9-frame Savitzky-Golay fits as librosa.feature.delta, evaluated delta_lookahead frames before the newest frame:
+    4 reproduces the offline interior filters, 0 is fully causal (the fit's end point, noisier).
+
+    Lookahead: an output frame is emitted once lookahead_samples of audio past the end of its second MFCC frame have arrived,
+    n_fft / 2 for the centred STFT plus delta_lookahead hops, 735 + 4 * 735 samples (~42 ms) with the defaults at 88.2 kHz.
+    The first output frames of an utterance additionally wait for 9 MFCC frames (~50 ms of audio).
+    """
+    def __init__(self, sr=88200, num_mfcc=26, cmvn='running', cmvn_window=600, delta_lookahead=4, cmvn_prior=None):
+        if cmvn not in CMVN_MODES:
+            raise ValueError(f"Unknown CMVN mode '{cmvn}', expected one of {CMVN_MODES}")
+
+        frame_length = int(0.01667 * sr)
+        self.engine = get_mfcc_engine(sr, num_mfcc, frame_length, frame_length // 2)
+        self.sr = sr
+        self.cmvn = cmvn
+        self.cmvn_window = cmvn_window
+        self.cmvn_prior = cmvn_prior
+        self.width = self.engine.delta_width
+        self.half = self.width // 2
+        if not 0 <= delta_lookahead <= self.half:
+            raise ValueError(f"delta_lookahead must be between 0 and {self.half}, got {delta_lookahead}")
+        self.delta_lookahead = delta_lookahead
+
+        # derivative filters indexed by the frame's offset from the fit centre, -half .. half
+        self.delta_rows = {}
+        for order in (1, 2):
+            left, centre, right = self.engine.delta_filters[order]
+            self.delta_rows[order] = np.vstack([left, centre[None, :], right])
+
+        self.reset()
+
+    @property
+    def lookahead_samples(self):
+        return self.engine.n_fft // 2 + self.delta_lookahead * self.engine.hop_length
+
+    @property
+    def lookahead_seconds(self):
+        return self.lookahead_samples / self.sr
+
+    def reset(self):
+        self._audio = np.zeros(self.engine.n_fft // 2, dtype=np.float32) # centre padding at the start of the utterance
+        self._peak_db = -np.inf
+        self._count = 0
+        self._sum = np.zeros((self.engine.num_mfcc, 1))
+        self._sum_sq = np.zeros((self.engine.num_mfcc, 1))
+        if self.cmvn_prior is not None:
+            mean, std, frames = self.cmvn_prior
+            mean = np.asarray(mean, dtype=np.float64).reshape(-1, 1)
+            std = np.asarray(std, dtype=np.float64).reshape(-1, 1)
+            self._count = frames
+            self._sum = frames * mean
+            self._sum_sq = frames * (std ** 2 + mean ** 2)
+        self._cmvn_history = np.zeros((self.engine.num_mfcc, 0))
+        self._normalized = np.zeros((self.engine.num_mfcc, 0), dtype=np.float32)
+        self._normalized_offset = 0 # absolute index of the first frame kept in _normalized
+        self._next_delta_frame = 0
+        self._unpaired = None
+
+    def process(self, block):
+        self._audio = np.concatenate([self._audio, np.asarray(block, dtype=np.float32)])
+        self._add_mfcc_frames()
+        return self._reduce(self._emit_deltas(final=False), final=False)
+
+    def flush(self):
+        """End of the utterance: pads like the centred STFT and returns the remaining frames, none if it was shorter than 9 MFCC frames."""
+        self._audio = np.concatenate([self._audio, np.zeros(self.engine.n_fft // 2, dtype=np.float32)])
+        self._add_mfcc_frames()
+        if self._normalized_offset + self._normalized.shape[1] < self.width:
+            self.reset()
+            return np.zeros((0, 3 * self.engine.num_mfcc), dtype=np.float32)
+        features = self._reduce(self._emit_deltas(final=True), final=True)
+        self.reset()
+        return features
+
+    def _add_mfcc_frames(self):
+        n_fft, hop = self.engine.n_fft, self.engine.hop_length
+        num_frames = 0 if len(self._audio) < n_fft else (len(self._audio) - n_fft) // hop + 1
+        if num_frames == 0:
+            return
+
+        frames = np.lib.stride_tricks.sliding_window_view(self._audio[:(num_frames - 1) * hop + n_fft], n_fft)[::hop]
+        self._audio = self._audio[num_frames * hop:]
+
+        spectrum = np.fft.rfft(frames * self.engine.window, axis=-1).astype(np.complex64)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).T
+        log_spec = 10.0 * np.log10(np.maximum(1e-10, self.engine.mel_basis @ power))
+        # running peak per frame, the offline path floors at the clip peak
+        peaks = np.maximum.accumulate(np.maximum(log_spec.max(axis=0), self._peak_db))
+        self._peak_db = peaks[-1]
+        mfcc = self.engine.dct_matrix @ np.maximum(log_spec, peaks[None, :] - self.engine.top_db)
+
+        self._normalized = np.hstack([self._normalized, self._normalize(mfcc.astype(np.float64)).astype(np.float32)])
+
+    def _normalize(self, mfcc):
+        if self.cmvn == 'running':
+            counts = self._count + np.arange(1, mfcc.shape[1] + 1)
+            sums = self._sum + np.cumsum(mfcc, axis=1)
+            sums_sq = self._sum_sq + np.cumsum(mfcc ** 2, axis=1)
+            self._count = counts[-1]
+            self._sum = sums[:, -1:]
+            self._sum_sq = sums_sq[:, -1:]
+        else:
+            history = np.hstack([self._cmvn_history, mfcc])
+            cumulative = np.hstack([np.zeros((mfcc.shape[0], 1)), np.cumsum(history, axis=1)])
+            cumulative_sq = np.hstack([np.zeros((mfcc.shape[0], 1)), np.cumsum(history ** 2, axis=1)])
+            ends = np.arange(history.shape[1] - mfcc.shape[1], history.shape[1]) + 1
+            starts = np.maximum(ends - self.cmvn_window, 0)
+            counts = ends - starts
+            sums = cumulative[:, ends] - cumulative[:, starts]
+            sums_sq = cumulative_sq[:, ends] - cumulative_sq[:, starts]
+            self._cmvn_history = history[:, -(self.cmvn_window - 1):] if self.cmvn_window > 1 else history[:, :0]
+
+        mean = sums / counts
+        std = np.sqrt(np.maximum(sums_sq / counts - mean ** 2, 0.0))
+        return (mfcc - mean) / (std + 1e-10)
+
+    def _emit_deltas(self, final):
+        available = self._normalized_offset + self._normalized.shape[1] # absolute frame count so far
+        if available < self.width:
+            return np.zeros((3 * self.engine.num_mfcc, 0), dtype=np.float32)
+
+        end = available if final else available - self.delta_lookahead
+        frames = np.arange(self._next_delta_frame, max(end, self._next_delta_frame))
+        if len(frames) == 0:
+            return np.zeros((3 * self.engine.num_mfcc, 0), dtype=np.float32)
+
+        # fit window: ends delta_lookahead frames after the frame, clamped to the utterance edges (where librosa's interp fits apply)
+        starts = np.clip(frames + self.delta_lookahead - (self.width - 1), 0, available - self.width)
+        positions = frames - starts # offset from the fit centre + half, indexes delta_rows
+
+        windows = self._normalized[:, (starts - self._normalized_offset)[:, None] + np.arange(self.width)[None, :]] # [num_mfcc, frames, width]
+        mfcc = self._normalized[:, frames - self._normalized_offset]
+        delta = np.einsum('cfw,fw->cf', windows, self.delta_rows[1][positions])
+        delta2 = np.einsum('cfw,fw->cf', windows, self.delta_rows[2][positions])
+
+        self._next_delta_frame = frames[-1] + 1
+        keep_from = max(self._next_delta_frame + self.delta_lookahead - (self.width - 1), 0)
+        keep_from = min(keep_from, available - self.width)
+        if keep_from > self._normalized_offset:
+            self._normalized = self._normalized[:, keep_from - self._normalized_offset:]
+            self._normalized_offset = keep_from
+
+        return np.vstack([mfcc, delta, delta2]).astype(np.float32)
+
+    def _reduce(self, combined, final):
+        if self._unpaired is not None:
+            combined = np.hstack([self._unpaired, combined])
+            self._unpaired = None
+
+        num_pairs = combined.shape[1] // 2
+        reduced = combined[:, :num_pairs * 2].reshape(combined.shape[0], -1, 2).mean(axis=2)
+        if combined.shape[1] % 2 == 1:
+            if final:
+                reduced = np.hstack([reduced, combined[:, -1:]]) # same odd last frame handling as reduce_features
+            else:
+                self._unpaired = combined[:, -1:]
+        return reduced.T
+
+def extract_online(y, sr=88200, block_size=1764, **kwargs):
+    extractor = OnlineFeatureExtractor(sr, **kwargs)
+    outputs = [extractor.process(y[start:start + block_size]) for start in range(0, len(y), block_size)]
+    outputs.append(extractor.flush())
+    return np.vstack(outputs)
+
+def divergence_report(y, sr=88200, block_size=1764, **kwargs):
+    """Per feature group error of the online features against extract_and_combine_features on the same audio."""
+    frame_length = int(0.01667 * sr)
+    offline = extract_and_combine_features(y, sr, frame_length, frame_length // 2)
+    online = extract_online(y, sr, block_size, **kwargs)
+
+    num_mfcc = offline.shape[1] // 3
+    report = {'frames': (len(offline), len(online))}
+    num_frames = min(len(offline), len(online))
+    for index, name in enumerate(('mfcc', 'delta', 'delta2')):
+        group = slice(index * num_mfcc, (index + 1) * num_mfcc)
+        error = np.abs(online[:num_frames, group] - offline[:num_frames, group])
+        correlation = np.corrcoef(online[:num_frames, group].ravel(), offline[:num_frames, group].ravel())[0, 1]
+        report[name] = {'mean_abs': float(error.mean()), 'max_abs': float(error.max()), 'correlation': float(correlation)}
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the online feature extractor against the offline features.")
+    parser.add_argument('audio', nargs='?', default='sample_data/audio.wav')
+    parser.add_argument('--cmvn', choices=CMVN_MODES, default='running')
+    parser.add_argument('--cmvn-window', type=int, default=600)
+    parser.add_argument('--lookahead', type=int, default=4)
+    parser.add_argument('--block-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    y, sr = librosa.load(args.audio, sr=88200)
+    block_size = max(1, int(sr * args.block_ms / 1000))
+    extractor = OnlineFeatureExtractor(sr, cmvn=args.cmvn, cmvn_window=args.cmvn_window, delta_lookahead=args.lookahead)
+    report = divergence_report(y, sr, block_size, cmvn=args.cmvn, cmvn_window=args.cmvn_window, delta_lookahead=args.lookahead)
+
+    print(f"{args.audio}: cmvn={args.cmvn}, delta lookahead {args.lookahead} frames, {args.block_ms:g} ms blocks, "
+          f"lookahead {extractor.lookahead_seconds * 1000:.1f} ms")
+    print(f"frames: offline {report['frames'][0]}, online {report['frames'][1]}")
+    for name in ('mfcc', 'delta', 'delta2'):
+        group = report[name]
+        print(f"{name:<8} mean abs {group['mean_abs']:.4f}  max abs {group['max_abs']:.4f}  correlation {group['correlation']:.4f}")
@@ -6,24 +6,50 @@
 import numpy as np
 
 from extraction.extract_features import extract_audio_features
-from processing.audio_processing import process_audio_features
+from processing.audio_processing import process_audio_features, iter_process_audio_features
+from processing.temporal_filters import MovingAverageFilter, PAIR_SMOOTHING, StreamingSmoother, create_filter
 
-def generate_facial_data_from_bytes(audio_bytes, model, device, config, use_smoothing=True): # enable smoothing to reduce any stutter when increasing the scale in livelink > connect > pylivelinkface.py, more data/training will remove the need for this in the future.
+def generate_facial_data_from_bytes(audio_bytes, model, device, config, use_smoothing=True, scheduler=None): # enable smoothing to reduce any stutter when increasing the scale in livelink > connect > pylivelinkface.py, more data/training will remove the need for this in the future.
     
     audio_features, y = extract_audio_features(audio_bytes, from_bytes=True)
     
     if audio_features is None or y is None:
         return [], np.array([])
+
+    return generate_facial_data_from_features(audio_features, model, device, config, use_smoothing, scheduler)
+
+def generate_facial_data_from_features(audio_features, model, device, config, use_smoothing=True, scheduler=None): # inference half of generate_facial_data_from_bytes, for features extracted elsewhere (e.g. the extraction pool).
+
+    if audio_features is None:
+        return [], np.array([])
   
-    final_decoded_outputs = process_audio_features(audio_features, model, device, config)
+    final_decoded_outputs = process_audio_features(audio_features, model, device, config, scheduler=scheduler)
 
-    if use_smoothing: # this essentially takes a 60fps stuttery feed and blends frame pairs to smooth it if needed. Might be needed if scale is too high (anything over 1.2ish).
-        final_decoded_outputs = smooth_by_averaging_pairs(final_decoded_outputs)
+    smoothing_filter = create_filter(config.get('smoothing', PAIR_SMOOTHING)) if use_smoothing else None
+    if smoothing_filter is not None and len(final_decoded_outputs) > 0: # by default this takes a 60fps stuttery feed and blends frame pairs to smooth it if needed. Might be needed if scale is too high (anything over 1.2ish).
+        final_decoded_outputs = smoothing_filter.apply(final_decoded_outputs).astype(final_decoded_outputs.dtype, copy=False)
 
     return final_decoded_outputs
 
+def stream_facial_data_from_features(audio_features, model, device, config, use_smoothing=True, scheduler=None): # generate_facial_data_from_features as blocks of frames, the first one ready after the first window is decoded.
+    if audio_features is None:
+        return
+
+    smoothing_filter = create_filter(config.get('smoothing', PAIR_SMOOTHING)) if use_smoothing else None
+    smoother = StreamingSmoother(smoothing_filter) if smoothing_filter is not None else None
+
+    for decoded_outputs in iter_process_audio_features(audio_features, model, device, config, scheduler=scheduler):
+        if smoother is None:
+            yield decoded_outputs
+            continue
+        smoothed = smoother.push(decoded_outputs) # centred filters hold the last frames back until the next window
+        if len(smoothed) > 0:
+            yield smoothed.astype(decoded_outputs.dtype, copy=False)
+
+    held_back = smoother.finish() if smoother is not None else None
+    if held_back is not None and len(held_back) > 0:
+        yield held_back.astype(np.float32, copy=False)
+
 def smooth_by_averaging_pairs(data):
-    smoothed_data = data.copy()
-    for i in range(1, len(data)):
-        smoothed_data[i - 1] = (data[i - 1] + data[i]) / 2.0
-    return smoothed_data
+    data = np.asarray(data)
+    return MovingAverageFilter(2, centred=True).apply(data).astype(data.dtype, copy=False)
@@ -3,17 +3,18 @@
 
 # blending_anims.py
 
-import time
 import numpy as np
 
 from livelink.animations.default_animation import default_animation_data, FaceBlendShape
+from livelink.frame_pacer import FramePacer
 
+# pass one FramePacer through blend_in, play_full_animation and blend_out to keep them on one frame schedule
 
-def play_full_animation(facial_data, fps, py_face, socket_connection, blend_in_frames, blend_out_frames):
-    for blend_shape_data in facial_data[blend_in_frames:-blend_out_frames]:
+def play_full_animation(facial_data, fps, py_face, socket_connection, blend_in_frames, blend_out_frames, pacer=None):
+    pacer = pacer or FramePacer(fps)
+    for blend_shape_data in pacer.pace(facial_data[blend_in_frames:-blend_out_frames]):
         apply_blendshapes(blend_shape_data, 1.0, py_face)
         socket_connection.sendall(py_face.encode())
-        time.sleep(1 / fps)
 
 def apply_blendshapes(frame_data: np.ndarray, weight: float, py_face):
     for i in range(51):  # Apply the first 51 blendshapes (no neck at the moment)
@@ -32,17 +33,17 @@ def apply_blendshapes(frame_data: np.ndarray, weight: float, py_face):
     emotions = ["Angry", "Disgusted", "Fearful", "Happy", "Neutral", "Sad", "Surprised"]
     print(f"Highest emotion: {emotions[max_emotion_index]} with value: {additional_values[max_emotion_index]:.2f}")
 
-def blend_in(facial_data, fps, py_face, socket_connection, blend_in_frames):
-    for frame_index in range(blend_in_frames):
+def blend_in(facial_data, fps, py_face, socket_connection, blend_in_frames, pacer=None):
+    pacer = pacer or FramePacer(fps)
+    for frame_index in pacer.pace(range(blend_in_frames)):
         weight = frame_index / blend_in_frames
         apply_blendshapes(facial_data[frame_index], weight, py_face)
         socket_connection.sendall(py_face.encode())
-        time.sleep(1 / fps)
 
-def blend_out(facial_data, fps, py_face, socket_connection, blend_out_frames):
-    for frame_index in range(blend_out_frames):
+def blend_out(facial_data, fps, py_face, socket_connection, blend_out_frames, pacer=None):
+    pacer = pacer or FramePacer(fps)
+    for frame_index in pacer.pace(range(blend_out_frames)):
         weight = frame_index / blend_out_frames
         reverse_index = len(facial_data) - blend_out_frames + frame_index
         apply_blendshapes(facial_data[reverse_index], 1.0 - weight, py_face)
         socket_connection.sendall(py_face.encode())
-        time.sleep(1 / fps)
@@ -1,13 +1,14 @@
 # This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
 # For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
 
-import time
-import socket
+import os
+import struct
 import numpy as np
-import pandas as pd
-from threading import Event
+from threading import Event, Lock
 
-from livelink.connect.livelink_init import FaceBlendShape, UDP_IP, UDP_PORT
+from livelink.connect.livelink_init import FaceBlendShape, create_livelink_sender
+from livelink.connect.pylivelinkface import timecode_frames
+from livelink.frame_pacer import FramePacer
 
 ground_truth_path = r"livelink/animations/default_anim/default.csv"
 columns_to_drop = [
@@ -17,9 +18,25 @@ columns_to_drop = [
 ]
 
 def load_default_animation(csv_path):
+    # the parsed CSV is cached next to it as .npy, rebuilt whenever the CSV is newer
+    cache_path = os.path.splitext(csv_path)[0] + '.npy'
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(csv_path):
+        try:
+            return np.load(cache_path)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable default animation cache {cache_path}: {e}")
+
+    import pandas as pd
     data = pd.read_csv(csv_path)
     data = data.drop(columns=['Timecode', 'BlendshapeCount'] + columns_to_drop)
-    return data.values
+    data = data.values
+
+    try:
+        np.save(cache_path + '.tmp.npy', data)
+        os.replace(cache_path + '.tmp.npy', cache_path)
+    except OSError as e:
+        print(f"Could not cache the default animation as {cache_path}: {e}")
+    return data
 
 default_animation_data = load_default_animation(ground_truth_path)
 
@@ -40,14 +57,59 @@ blended_animation_data = blend_animation(default_animation_data, blend_frames=30
 
 stop_default_animation = Event()
 
-def default_animation_loop(py_face):
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.connect((UDP_IP, UDP_PORT))
+class IdleAnimationRing:
+    """
+    The looping idle animation encoded once into a single buffer of LiveLink packets.
+    Sending a frame only patches its timecode in place, no set_blendshape / encode() per frame.
+    """
+    def __init__(self, py_face, animation_data=None):
+        animation_data = blended_animation_data if animation_data is None else animation_data
+        blend_shapes = list(py_face._blend_shapes)
+        packets = py_face.encode_batch(animation_data, as_buffer=True, filtered=False) # baked animation, and the clip filter's state is left alone
+        py_face._blend_shapes = blend_shapes # building the ring does not move the face
+
+        self.fps = py_face.fps
+        self.packet_size = packets.dtype.itemsize
+        self.timecode_offset = packets.dtype.fields['frames'][1]
+        self.buffer = bytearray(packets.tobytes())
+        self.view = memoryview(self.buffer)
+        self.animation_data = np.asarray(animation_data)
+
+    def __len__(self):
+        return len(self.buffer) // self.packet_size
+
+    def packet(self, index, timecode=None):
+        offset = (index % len(self)) * self.packet_size
+        struct.pack_into('>I', self.buffer, offset + self.timecode_offset, timecode_frames(self.fps) if timecode is None else timecode)
+        return self.view[offset:offset + self.packet_size]
+
+_idle_rings = {}
+_idle_rings_lock = Lock()
+
+def get_idle_animation_ring(py_face):
+    """One ring per face identity and scaling factor, encoded on first use and reused by every restart of the idle loop."""
+    key = (py_face.encode_header(), py_face._scaling_factor, py_face.fps)
+    with _idle_rings_lock:
+        ring = _idle_rings.get(key)
+        if ring is None:
+            ring = _idle_rings[key] = IdleAnimationRing(py_face)
+    return ring
+
+def default_animation_loop(py_face, pacer=None):
+    pacer = pacer or FramePacer(60)
+    ring = get_idle_animation_ring(py_face)
+    last_index = None
+    s = create_livelink_sender(py_face)
+    try:
         while not stop_default_animation.is_set():
-            for frame in blended_animation_data:
+            for index in pacer.pace(range(len(ring))):
                 if stop_default_animation.is_set():
                     break
-                for i, value in enumerate(frame):
-                    py_face.set_blendshape(FaceBlendShape(i), float(value))
-                s.sendall(py_face.encode())
-                time.sleep(1 / 60)
+                s.sendall(ring.packet(index))
+                last_index = index
+    finally:
+        s.close()
+
+    if last_index is not None: # leave the face on the last idle pose sent, as setting it frame by frame did
+        for i, value in enumerate(ring.animation_data[last_index]):
+            py_face.set_blendshape(FaceBlendShape(i), float(value))
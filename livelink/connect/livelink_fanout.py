@@ -0,0 +1,204 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# livelink_fanout.py
+
+import ctypes
+import ctypes.util
+import os
+import socket
+import sys
+import time
+import uuid
+from threading import Lock
+
+from livelink.connect.pylivelinkface import PyLiveLinkFace
+
+class LiveLinkTarget:
+    """One Unreal endpoint. subject renames the face for this target, None keeps the name / uuid of the encoded packets."""
+    def __init__(self, host, port, subject=None):
+        self.host = host
+        self.port = port
+        self.subject = subject
+        self.header = None
+        if subject is not None:
+            subject_uuid = str(uuid.uuid5(uuid.NAMESPACE_OID, subject)) # stable per subject, so Unreal keeps one source for it
+            self.header = PyLiveLinkFace(name=subject, uuid=subject_uuid).encode_header()
+
+        self.sent = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.last_error = None
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    def retarget(self, packet, source_header_length):
+        return bytes(packet) if self.header is None else self.header + bytes(packet[source_header_length:])
+
+class LiveLinkFanout:
+    """
+    Sends every packet to several Unreal endpoints / subjects over persistent sockets.
+    On Linux all copies of a frame go out in one sendmmsg call on a shared socket, elsewhere each target has its own connected socket.
+    Per-target packet / byte / error counts and throughput are kept in stats(). Exposes sendall() so it can stand in for a socket.
+    """
+    def __init__(self, targets, source_header_length, use_sendmmsg=True):
+        self.targets = [target if isinstance(target, LiveLinkTarget) else LiveLinkTarget(*target) for target in targets]
+        self.source_header_length = source_header_length
+        self.started = time.monotonic()
+        self._lock = Lock()
+
+        self._batch = SendmmsgBatch.create(self.targets) if use_sendmmsg else None
+        self._sockets = None
+        if self._batch is None:
+            self._sockets = []
+            for target in self.targets:
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.connect(target.address)
+                self._sockets.append(s)
+
+    @property
+    def batched(self):
+        return self._batch is not None
+
+    def send(self, packet):
+        self.send_many([packet])
+
+    sendall = send
+
+    def send_many(self, packets):
+        """Sends each packet to every target, in order."""
+        messages = [(index, target.retarget(packet, self.source_header_length)) for packet in packets for index, target in enumerate(self.targets)]
+        with self._lock:
+            if self._batch is not None:
+                results = self._batch.send(messages)
+            else:
+                results = [self._send_one(index, payload) for index, payload in messages]
+
+            for (index, payload), error in zip(messages, results):
+                target = self.targets[index]
+                if error is None:
+                    target.sent += 1
+                    target.bytes_sent += len(payload)
+                else:
+                    target.errors += 1
+                    target.last_error = error
+
+    def _send_one(self, index, payload):
+        try:
+            self._sockets[index].send(payload)
+            return None
+        except OSError as e: # nothing listening (ICMP port unreachable) on one target must not stop the others
+            return str(e)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self._lock:
+            return {
+                'batched': self.batched,
+                'targets': [{
+                    'target': f"{target.host}:{target.port}",
+                    'subject': target.subject,
+                    'sent': target.sent,
+                    'errors': target.errors,
+                    'last_error': target.last_error,
+                    'packets_per_second': target.sent / elapsed,
+                    'kbytes_per_second': target.bytes_sent / elapsed / 1024.0,
+                } for target in self.targets],
+            }
+
+    def close(self):
+        if self._batch is not None:
+            self._batch.close()
+        for s in self._sockets or []:
+            s.close()
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_char_p), ('iov_len', ctypes.c_size_t)] # c_char_p points straight at a bytes payload
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_iovec)), ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_uint16), ('sin_addr', ctypes.c_ubyte * 4), ('sin_zero', ctypes.c_ubyte * 8)]
+
+class SendmmsgBatch:
+    """
+    sendmmsg(2) through ctypes on one unconnected IPv4 socket, with the target addresses resolved once and the message arrays
+    reused per batch size. Being unconnected, the socket does not see ICMP port unreachable, so only local send errors are counted.
+    """
+    @classmethod
+    def create(cls, targets):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            sendmmsg = libc.sendmmsg
+        except (OSError, AttributeError):
+            return None
+        try:
+            addresses = [socket.getaddrinfo(target.host, target.port, socket.AF_INET, socket.SOCK_DGRAM)[0][4] for target in targets]
+        except socket.gaierror:
+            return None
+        return cls(sendmmsg, addresses)
+
+    def __init__(self, sendmmsg, addresses):
+        self._sendmmsg = sendmmsg
+        self._sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        self._sendmmsg.restype = ctypes.c_int
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self._prepared = {}
+        self._addresses = []
+        for host, port in addresses:
+            address = _sockaddr_in()
+            address.sin_family = socket.AF_INET
+            address.sin_port = socket.htons(port)
+            address.sin_addr[:] = socket.inet_aton(host)
+            self._addresses.append(address)
+
+    def send(self, messages):
+        """messages: [(target index, payload)], returns None or an error string per message."""
+        count = len(messages)
+        headers, vectors = self._arrays(count)
+        for i, (index, payload) in enumerate(messages):
+            vectors[i].iov_base = payload
+            vectors[i].iov_len = len(payload)
+            headers[i].msg_hdr.msg_name = ctypes.addressof(self._addresses[index])
+
+        results = [None] * count
+        start = 0
+        while start < count:
+            sent = self._sendmmsg(self.socket.fileno(), ctypes.addressof(headers) + start * ctypes.sizeof(_mmsghdr), count - start, 0)
+            if sent <= 0: # the message at start failed, record it and carry on with the rest
+                error = ctypes.get_errno()
+                results[start] = f"[Errno {error}] {os.strerror(error)}"
+                start += 1
+            else:
+                start += sent
+        return results
+
+    def _arrays(self, count):
+        prepared = self._prepared.get(count)
+        if prepared is None:
+            headers = (_mmsghdr * count)()
+            vectors = (_iovec * count)()
+            for i in range(count):
+                header = headers[i].msg_hdr
+                header.msg_namelen = ctypes.sizeof(_sockaddr_in)
+                header.msg_iov = ctypes.pointer(vectors[i])
+                header.msg_iovlen = 1
+            prepared = self._prepared[count] = (headers, vectors)
+        return prepared
+
+    def close(self):
+        self.socket.close()
@@ -5,18 +5,30 @@
 
 import socket
 from livelink.connect.pylivelinkface import PyLiveLinkFace, FaceBlendShape
+from livelink.connect.livelink_fanout import LiveLinkFanout
+from processing.temporal_filters import create_filter
 
 
 UDP_IP = "0.0.0.0"  # set this to your local IP for Unreal Connection on a local PC installation
 UDP_PORT = 11111
 
+# every Unreal instance to drive as (ip, port, subject), a subject other than None renames the face for that instance
+LIVELINK_TARGETS = [
+    (UDP_IP, UDP_PORT, None),
+]
+
 def create_socket_connection():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.connect((UDP_IP, UDP_PORT))
     return s
 
-def initialize_py_face():
-    py_face = PyLiveLinkFace()
+def create_livelink_sender(py_face, targets=None):
+    """Persistent sockets to every LIVELINK_TARGETS entry, a drop-in for create_socket_connection() when sending py_face's packets."""
+    return LiveLinkFanout(targets or LIVELINK_TARGETS, len(py_face.encode_header()))
+
+def initialize_py_face(filter_settings=None):
+    """filter_settings: a processing.temporal_filters.create_filter entry (config['livelink_filter']) applied to the frames as they are encoded."""
+    py_face = PyLiveLinkFace(blendshape_filter=create_filter(filter_settings))
     initial_blendshapes = [0.0] * 61
     for i, value in enumerate(initial_blendshapes):
         py_face.set_blendshape(FaceBlendShape(i), float(value))
@@ -5,9 +5,6 @@
 
 from __future__ import annotations
 
-from collections import deque
-from timecode import Timecode
-from statistics import mean
 from typing import List
 
 import datetime
@@ -15,7 +12,13 @@ import struct
 import random
 import uuid
 
+import numpy as np
+
 from livelink.connect.faceblendshapes import FaceBlendShape
+from processing.temporal_filters import TemporalFilter, MovingAverageFilter
+
+NUM_BLENDSHAPES = 61
+HEAD_ROTATION_INDICES = [FaceBlendShape.HeadYaw.value, FaceBlendShape.HeadPitch.value, FaceBlendShape.HeadRoll.value]
 
 def scale_blendshapes(blendshapes: List[float], scale_factor: float, threshold: float = 0.0) -> List[float]:
     scaled_blendshapes = []
@@ -29,8 +32,39 @@ def scale_blendshapes(blendshapes: List[float], scale_factor: float, threshold:
             scaled_blendshapes.append(max(value, 0.0))  # Ensure non-negative
     return scaled_blendshapes
 
+def scale_blendshapes_array(blendshapes: np.ndarray, scale_factor: float, threshold: float = 0.0) -> np.ndarray:
+    """scale_blendshapes over a [frames, blendshapes] array."""
+    scaled = np.maximum(np.minimum(blendshapes * scale_factor, 1.0), 0.0)
+    return np.where(blendshapes > threshold, scaled, np.maximum(blendshapes, 0.0))
+
+def timecode_frames(fps: int, now: datetime.datetime = None) -> int:
+    """Frame number of the wall clock time of day at fps, counted from 1 like Timecode.frames."""
+    now = now or datetime.datetime.now()
+    seconds = (now.hour * 60 + now.minute) * 60 + now.second
+    return seconds * fps + now.microsecond * fps // 1000000 + 1
+
+def packet_dtype(header_length: int) -> np.dtype:
+    """One LiveLink face packet as encode() writes it, after the constant version / uuid / name header."""
+    return np.dtype([
+        ('header', np.uint8, (header_length,)),
+        ('frames', '>u4'),
+        ('sub_frame', '>u4'),
+        ('fps', '>u4'),
+        ('denominator', '>u4'),
+        ('count', np.uint8),
+        ('blend_shapes', '>f4', (NUM_BLENDSHAPES,)),
+    ])
+
+PACKET_TAIL_SIZE = packet_dtype(0).itemsize # timecode, sub frame, fps, denominator, count and blendshapes after the header
+
+def stamp_timecode(packet, fps: int, timecode: int = None) -> bytearray:
+    """A copy of an encoded packet with its timecode set to now (or timecode), for packets encoded ahead of the moment they are sent."""
+    packet = bytearray(packet)
+    struct.pack_into('>I', packet, len(packet) - PACKET_TAIL_SIZE, timecode_frames(fps) if timecode is None else timecode)
+    return packet
+
 class PyLiveLinkFace:
-    def __init__(self, name: str = "Python_LiveLinkFace", uuid: str = str(uuid.uuid1()), fps=60, filter_size: int = 0) -> None:
+    def __init__(self, name: str = "Python_LiveLinkFace", uuid: str = str(uuid.uuid1()), fps=60, filter_size: int = 0, blendshape_filter: TemporalFilter = None) -> None:
         self.uuid = f"${uuid}" if not uuid.startswith("$") else uuid
         self.name = name
         self.fps = fps
@@ -39,38 +73,88 @@ class PyLiveLinkFace:
         
         self._scaling_factor = 1.2 # increase this to make the animation more pronounced to get more emotion. Enable smoothing in generate_face_shapes.py to smooth any stutter.
 
-        now = datetime.datetime.now()
-        timcode = Timecode(self.fps, f'{now.hour}:{now.minute}:{now.second}:{now.microsecond * 0.001}')
-        self._frames = timcode.frames
+        self._frames = timecode_frames(self.fps)
         self._sub_frame = 1056060032
         self._denominator = int(self.fps / 60)
         self._blend_shapes = [0.0] * 61
-        self._old_blend_shapes = [deque([0.0], maxlen=filter_size) for _ in range(61)]
+        self._filtered_channels = np.zeros(NUM_BLENDSHAPES, dtype=bool) # set with no_filter=False, filtered when encoded
+        self._filter = blendshape_filter
+        if self._filter is None and filter_size > 0: # the old per-blendshape deque mean
+            self._filter = MovingAverageFilter(filter_size)
 
-    def encode(self) -> bytes:
+    def set_filter(self, blendshape_filter: TemporalFilter) -> None:
+        """Temporal filter (processing.temporal_filters) run over every frame encode_batch() packs, and in encode() over the blendshapes set with no_filter=False."""
+        self._filter = blendshape_filter
+
+    def encode_header(self) -> bytes:
         version_packed = struct.pack('<I', self._version)
         uuid_packed = self.uuid.encode('utf-8')
         name_packed = self.name.encode('utf-8')
         name_length_packed = struct.pack('!i', len(self.name))
-        now = datetime.datetime.now()
-        timcode = Timecode(self.fps, f'{now.hour}:{now.minute}:{now.second}:{now.microsecond * 0.001}')
-        frames_packed = struct.pack("!II", timcode.frames, self._sub_frame)
+        return version_packed + uuid_packed + name_length_packed + name_packed
+
+    def encode(self) -> bytes:
+        frames_packed = struct.pack("!II", timecode_frames(self.fps), self._sub_frame)
         frame_rate_packed = struct.pack("!II", self.fps, self._denominator)
     
-        scaled_blend_shapes = scale_blendshapes(self._blend_shapes, self._scaling_factor)
+        blend_shapes = self._blend_shapes
+        if self._filter is not None and self._filtered_channels.any(): # one filter step per encoded frame, over all 61 channels at once
+            filtered = self._filter.step(np.asarray(blend_shapes))
+            blend_shapes = np.where(self._filtered_channels, filtered, blend_shapes).tolist()
+        scaled_blend_shapes = scale_blendshapes(blend_shapes, self._scaling_factor)
     
         data_packed = struct.pack('!B61f', 61, *scaled_blend_shapes)
-        return version_packed + uuid_packed + name_length_packed + name_packed + frames_packed + frame_rate_packed + data_packed
+        return self.encode_header() + frames_packed + frame_rate_packed + data_packed
+
+    def encode_batch(self, frames: np.ndarray, start_frame: int = None, as_buffer: bool = False, filtered: bool = True):
+        """
+        Encodes a [frames, n] array of blendshape values (n <= 61, the remaining blendshapes keep their current values) in one pass:
+        the header is packed once, scaling and clamping are vectorised and all packets are written into one structured array.
+        Timecodes count up one frame per packet from start_frame, by default the current time as encode() stamps it;
+        packets encoded ahead of playback are stamped again as they are sent (stamp_timecode).
+        Afterwards the face holds the last frame, as if it had been set blendshape by blendshape.
+        With a filter set (and filtered) the frames go through it in one block, continuing its state from the previous call.
+
+        Returns a list of packets, or with as_buffer the [frames] structured array whose rows are the packets (tobytes() / memoryview for sending).
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        if frames.ndim != 2 or frames.shape[1] > NUM_BLENDSHAPES:
+            raise ValueError(f"expected a [frames, <= {NUM_BLENDSHAPES}] array, got shape {frames.shape}")
+        num_frames, num_values = frames.shape
+
+        values = np.empty((num_frames, NUM_BLENDSHAPES))
+        values[:] = self._blend_shapes
+        values[:, :num_values] = frames
+        head_rotation = [index for index in HEAD_ROTATION_INDICES if index < num_values]
+        values[:, head_rotation] = np.clip(values[:, head_rotation], -0.0, 0.0) # same clamp as set_blendshape
+        if self._filter is not None and filtered and num_frames > 0:
+            values = self._filter.process(values)
+
+        header = self.encode_header()
+        packets = np.zeros(num_frames, dtype=packet_dtype(len(header)))
+        packets['header'] = np.frombuffer(header, dtype=np.uint8)
+        packets['frames'] = (timecode_frames(self.fps) if start_frame is None else start_frame) + np.arange(num_frames)
+        packets['sub_frame'] = self._sub_frame
+        packets['fps'] = self.fps
+        packets['denominator'] = self._denominator
+        packets['count'] = NUM_BLENDSHAPES
+        packets['blend_shapes'] = scale_blendshapes_array(values, self._scaling_factor)
+
+        if num_frames > 0:
+            self._blend_shapes = values[-1].tolist()
+
+        if as_buffer:
+            return packets
+        buffer = packets.tobytes()
+        size = packets.dtype.itemsize
+        return [buffer[i * size:(i + 1) * size] for i in range(num_frames)]
 
     def set_blendshape(self, index: FaceBlendShape, value: float, no_filter: bool = True) -> None:        
         if index in [FaceBlendShape.HeadYaw, FaceBlendShape.HeadPitch, FaceBlendShape.HeadRoll]:
             value = max(min(value, 0.00), -0.00) 
         
-        if no_filter:
-            self._blend_shapes[index.value] = value
-        else:
-            self._old_blend_shapes[index.value].append(value)
-            self._blend_shapes[index.value] = mean(self._old_blend_shapes[index.value])
+        self._blend_shapes[index.value] = value
+        self._filtered_channels[index.value] = not no_filter
 
     def set_scaling_factor(self, scaling_factor: float) -> None:
         self._scaling_factor = scaling_factor   
@@ -0,0 +1,84 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# frame_pacer.py
+
+import time
+from collections import deque
+from threading import Lock
+
+import numpy as np
+
+class FramePacer:
+    """
+    Paces frames against absolute deadlines start + index / fps on the monotonic clock, so send time and sleep overshoot
+    do not add up the way sleep(1 / fps) after every send does. A frame whose deadline has already passed by more than
+    max_late_frames frames is dropped (drop_late=True) or sent straight away (drop_late=False), either way playback catches up
+    with the audio instead of drifting behind it.
+
+    pace() can be called several times (blend-in, clip, blend-out), frame indices and statistics carry over until reset().
+    Per-frame lateness is kept for the last history frames, so an endless loop (the idle animation) stays bounded.
+    """
+    def __init__(self, fps, max_late_frames=2, drop_late=True, history=3600):
+        self.fps = fps
+        self.frame_interval = 1.0 / fps
+        self.max_lateness = max_late_frames * self.frame_interval
+        self.drop_late = drop_late
+        self.history = history
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start_time = None
+            self.index = 0
+            self.sent = 0
+            self.dropped = 0
+            self.max_lateness_seen = 0.0
+            self.lateness = deque(maxlen=self.history) # seconds past the deadline at which each recent frame went out
+
+    def start(self, start_time=None):
+        """Frame 0 is due at start_time (now by default), call it when the audio starts."""
+        self.start_time = time.monotonic() if start_time is None else start_time
+
+    def deadline(self, index):
+        return self.start_time + index * self.frame_interval
+
+    def pace(self, frames):
+        """Yields the frames of an iterable at their deadlines, skipping the ones that are too late to be worth sending."""
+        if self.start_time is None:
+            self.start()
+
+        for frame in frames:
+            deadline = self.deadline(self.index)
+            self.index += 1
+
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+                now = time.monotonic()
+            elif now - deadline > self.max_lateness and self.drop_late:
+                with self._lock:
+                    self.dropped += 1
+                continue
+
+            with self._lock:
+                self.sent += 1
+                self.lateness.append(now - deadline)
+                self.max_lateness_seen = max(self.max_lateness_seen, now - deadline)
+            yield frame
+
+    def stats(self):
+        """Frame counts over the whole run, lateness figures in ms over the recent history."""
+        with self._lock:
+            lateness = np.array(self.lateness) * 1000.0
+            stats = {'frames': self.index, 'sent': self.sent, 'dropped': self.dropped, 'max_lateness_ms': self.max_lateness_seen * 1000.0}
+        if len(lateness) == 0:
+            return dict(stats, mean_lateness_ms=0.0, p95_lateness_ms=0.0, jitter_ms=0.0, drift_ms=0.0)
+        return {
+            **stats,
+            'mean_lateness_ms': float(lateness.mean()),
+            'p95_lateness_ms': float(np.percentile(lateness, 95)),
+            'jitter_ms': float(lateness.std()),
+            'drift_ms': float(lateness[-1]), # how far behind schedule the last frame went out
+        }
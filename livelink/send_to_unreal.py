@@ -3,14 +3,15 @@
 
 # send_to_unreal.py
 
-import time 
 import numpy as np
 from typing import List
 
 from livelink.connect.livelink_init import create_socket_connection, FaceBlendShape
+from livelink.connect.pylivelinkface import stamp_timecode
 from livelink.animations.default_animation import default_animation_data
+from livelink.frame_pacer import FramePacer
 
-def pre_encode_facial_data(facial_data: List[np.ndarray], py_face, fps: int = 60) -> List[bytes]:
+def pre_encode_facial_data(facial_data: List[np.ndarray], py_face, fps: int = 60, blend_in: bool = True, blend_out: bool = True) -> List[bytes]:
     """
     Pre-encodes facial data to reduce runtime encoding delays, including blend-in and blend-out effects.
     
@@ -18,36 +19,37 @@ def pre_encode_facial_data(facial_data: List[np.ndarray], py_face, fps: int = 60
         facial_data (List[np.ndarray]): The facial data to encode.
         py_face: Instance of PyLiveLinkFace used to encode the data.
         fps (int): Frames per second to determine the blend-in and blend-out duration.
+        blend_in (bool): Blend in from the default pose, off for the later windows of a streamed clip.
+        blend_out (bool): Blend out to the default pose, off for all but the last window of a streamed clip.
 
     Returns:
         List[bytes]: List of pre-encoded facial data frames.
     """
-    encoded_data = []
+    facial_data = np.asarray(facial_data)
+    num_frames = len(facial_data)
 
     # Determine blend-in and blend-out frame counts
-    blend_in_frames = int(0.1 * fps)
-    blend_out_frames = int(0.3 * fps)
-
-    # Apply blend-in
-    for frame_index in range(blend_in_frames):
-        weight = frame_index / blend_in_frames
-        apply_blendshapes(facial_data[frame_index], weight, py_face)
-        encoded_data.append(py_face.encode())
-
-    # Encode the main animation frames
-    for frame_data in facial_data[blend_in_frames:-blend_out_frames]:
-        for i in range(min(len(frame_data), 51)):  # Ensure we only process the first 51 blendshapes
-            py_face.set_blendshape(FaceBlendShape(i), frame_data[i])
-        encoded_data.append(py_face.encode())
-
-    # Apply blend-out
-    for frame_index in range(blend_out_frames):
-        weight = frame_index / blend_out_frames
-        reverse_index = len(facial_data) - blend_out_frames + frame_index
-        apply_blendshapes(facial_data[reverse_index], 1.0 - weight, py_face)
-        encoded_data.append(py_face.encode())
-
-    return encoded_data
+    blend_in_frames = int(0.1 * fps) if blend_in else 0
+    blend_out_frames = int(0.3 * fps) if blend_out else 0
+
+    # Rows and weights towards the default pose: blend-in, the main animation frames at full weight, then blend-out
+    main_rows = np.arange(blend_in_frames, max(num_frames - blend_out_frames, blend_in_frames))
+    rows = np.concatenate([np.arange(blend_in_frames), main_rows, num_frames - blend_out_frames + np.arange(blend_out_frames)])
+    weights = np.concatenate([np.arange(blend_in_frames) / max(blend_in_frames, 1), np.ones(len(main_rows)),
+                              1.0 - np.arange(blend_out_frames) / max(blend_out_frames, 1)])
+
+    for frame_data in facial_data[rows[:blend_in_frames]]:
+        print_emotion_values(frame_data)
+
+    # Only the first 51 blendshapes are animated (no neck at the moment), the batch encoder packs every frame in one pass
+    frames = facial_data[rows, :51].astype(np.float64)
+    default_pose = np.asarray(default_animation_data[0][:frames.shape[1]], dtype=np.float64)
+    frames = (1.0 - weights[:, None]) * default_pose + weights[:, None] * frames
+
+    for frame_data in facial_data[rows[len(rows) - blend_out_frames:]]:
+        print_emotion_values(frame_data)
+
+    return py_face.encode_batch(frames)
 
 def apply_blendshapes(frame_data: np.ndarray, weight: float, py_face):
     for i in range(51):  # Apply the first 51 blendshapes (no neck at the moment)
@@ -56,6 +58,9 @@ def apply_blendshapes(frame_data: np.ndarray, weight: float, py_face):
         blended_value = (1 - weight) * default_value + weight * facial_value
         py_face.set_blendshape(FaceBlendShape(i), float(blended_value))
 
+    print_emotion_values(frame_data)
+
+def print_emotion_values(frame_data: np.ndarray):
     # Handle new emotion dimensions (61 to 67)
     additional_values = frame_data[61:68]
     values_str = " ".join([f"{i+61}: {value:.2f}" for i, value in enumerate(additional_values)])
@@ -66,16 +71,23 @@ def apply_blendshapes(frame_data: np.ndarray, weight: float, py_face):
     emotions = ["Angry", "Disgusted", "Fearful", "Happy", "Neutral", "Sad", "Surprised"]
     print(f"Highest emotion: {emotions[max_emotion_index]} with value: {additional_values[max_emotion_index]:.2f}")
 
-def send_pre_encoded_data_to_unreal(encoded_facial_data: List[bytes], start_event, fps: int, socket_connection=None):
+def send_pre_encoded_data_to_unreal(encoded_facial_data: List[bytes], start_event, fps: int, socket_connection=None, pacer: FramePacer = None) -> dict:
     """
     Sends pre-encoded facial data to Unreal Engine, synchronizing it with the audio.
+    Each frame is stamped with the timecode of the moment it is sent, not the one it was encoded at.
 
     Args:
         encoded_facial_data (List[bytes]): List of pre-encoded facial data frames.
         start_event: Event to synchronize the start with the audio.
         fps (int): Frames per second to control the playback speed.
         socket_connection: Socket connection to send the data to Unreal Engine.
+        pacer (FramePacer): Schedules each frame against its deadline from the start event, late frames are dropped.
+
+    Returns:
+        dict: The pacer's lateness / drift / dropped frame statistics.
     """
+    if pacer is None:
+        pacer = FramePacer(fps)
     try:
         own_socket = False
         if socket_connection is None:
@@ -83,13 +95,14 @@ def send_pre_encoded_data_to_unreal(encoded_facial_data: List[bytes], start_even
             own_socket = True
 
         start_event.wait()  # Wait until it's time to start playback
+        pacer.start()
 
-        for frame_data in encoded_facial_data:
-            socket_connection.sendall(frame_data)
-            time.sleep(1 / fps)
+        for frame_data in pacer.pace(encoded_facial_data):
+            socket_connection.sendall(stamp_timecode(frame_data, fps))
 
     except KeyboardInterrupt:
         pass
     finally:
         if own_socket:
             socket_connection.close()
+    return pacer.stats()
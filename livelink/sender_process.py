@@ -0,0 +1,272 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# sender_process.py
+# python -m livelink.sender_process [--seconds 10] -> UDP frame jitter of the in-process sender thread vs the sender process under GIL load
+
+import argparse
+import mmap
+import multiprocessing
+import socket
+import struct
+import time
+from itertools import count
+from threading import Thread, Lock
+
+import numpy as np
+
+from livelink.connect.livelink_init import LIVELINK_TARGETS, create_livelink_sender
+from livelink.connect.pylivelinkface import PyLiveLinkFace, stamp_timecode
+from livelink.frame_pacer import FramePacer
+
+class SharedFrameRing:
+    """
+    Single producer / single consumer ring of encoded packets in anonymous shared memory, inherited by a forked sender.
+    The producer writes a slot and then publishes it by advancing the write index, the consumer reads it and advances the read index;
+    each index has exactly one writer, so no lock is needed (aligned 8-byte stores, in order on x86 / the CPython eval loop).
+    """
+    HEADER_SIZE = 128 # write index at 0, read index at 64, on separate cache lines
+
+    def __init__(self, capacity=4096, slot_size=512):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.stride = slot_size + 4 # u32 length prefix
+        self.memory = mmap.mmap(-1, self.HEADER_SIZE + capacity * self.stride)
+        self._write_index = np.ndarray((1,), dtype=np.uint64, buffer=self.memory, offset=0)
+        self._read_index = np.ndarray((1,), dtype=np.uint64, buffer=self.memory, offset=64)
+
+    def __len__(self):
+        return int(self._write_index[0] - self._read_index[0])
+
+    def push(self, packet, timeout=None, poll_interval=0.001):
+        """Blocks while the ring is full, returns False if timeout passes first."""
+        if len(packet) > self.slot_size:
+            raise ValueError(f"packet of {len(packet)} bytes does not fit a {self.slot_size} byte slot")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self) >= self.capacity:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(poll_interval)
+
+        write_index = int(self._write_index[0])
+        offset = self.HEADER_SIZE + (write_index % self.capacity) * self.stride
+        struct.pack_into('<I', self.memory, offset, len(packet))
+        self.memory[offset + 4:offset + 4 + len(packet)] = packet
+        self._write_index[0] = write_index + 1
+        return True
+
+    def pop(self, timeout=None, poll_interval=0.0005):
+        """The next packet, or None if timeout passes while the ring is empty."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self) == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+        read_index = int(self._read_index[0])
+        offset = self.HEADER_SIZE + (read_index % self.capacity) * self.stride
+        length = struct.unpack_from('<I', self.memory, offset)[0]
+        packet = bytes(self.memory[offset + 4:offset + 4 + length])
+        self._read_index[0] = read_index + 1
+        return packet
+
+def run_sender(ring, control, fps, face_identity, targets):
+    """
+    Sender loop: plays the idle animation when enabled and nothing else is playing, and clips announced on the control channel
+    from the ring, each frame paced against start_time + i / fps. Replies ('done', clip_id, pacer stats) after every clip.
+    """
+    from livelink.animations.default_animation import IdleAnimationRing
+
+    name, uuid, scaling_factor = face_identity
+    py_face = PyLiveLinkFace(name=name, uuid=uuid, fps=fps)
+    py_face.set_scaling_factor(scaling_factor)
+    idle_ring = IdleAnimationRing(py_face)
+    state = {'idle': False, 'stop': False}
+    idle_position = 0
+    next_idle_deadline = time.monotonic()
+    frame_interval = 1.0 / fps
+
+    s = create_livelink_sender(py_face, targets)
+    try:
+        while not state['stop']:
+            timeout = max(next_idle_deadline - time.monotonic(), 0.0) if state['idle'] else None
+            if control.poll(timeout):
+                message = control.recv()
+                if message[0] == 'clip':
+                    _, clip_id, num_frames, start_time = message
+                    stats = play_clip(ring, control, s, fps, num_frames, start_time, state)
+                    control.send(('done', clip_id, dict(stats, livelink=s.stats())))
+                    next_idle_deadline = time.monotonic() # the idle animation picks up where the clip ended
+                else:
+                    was_idle = state['idle']
+                    handle_command(message, state)
+                    if state['idle'] and not was_idle:
+                        next_idle_deadline = time.monotonic()
+                continue
+
+            s.send(idle_ring.packet(idle_position))
+            idle_position += 1
+            next_idle_deadline += frame_interval
+            if time.monotonic() - next_idle_deadline > 2 * frame_interval: # fell behind, skip ahead instead of bursting
+                next_idle_deadline = time.monotonic()
+    finally:
+        s.close()
+
+def handle_command(message, state):
+    if message[0] == 'stop':
+        state['stop'] = True
+    elif message[0] == 'idle':
+        state['idle'] = message[1]
+
+def play_clip(ring, control, s, fps, num_frames, start_time, state):
+    pacer = FramePacer(fps)
+    pacer.start(start_time)
+    frames = (ring.pop() for _ in range(num_frames)) # popped before the pacer decides, so dropped frames leave the ring too
+    for packet in pacer.pace(frames):
+        s.send(stamp_timecode(packet, fps)) # encoded up to a few clips ahead, timecoded as it goes out like the idle frames
+        if not control.poll():
+            continue
+        message = control.recv()
+        handle_command(message, state)
+        if message[0] in ('clear', 'stop'):
+            for _ in range(num_frames - pacer.index): # the producer still pushes the rest of the clip
+                ring.pop()
+            break
+    return pacer.stats()
+
+class SenderProcess:
+    """
+    Moves the 60 fps LiveLink sender out of the serving process, so torch / librosa / Flask holding the GIL cannot stall it.
+    Encoded frames go through a SharedFrameRing, start / idle / clear / stop through a Pipe. The process is forked
+    (a spawned child would re-import the entry point and load the model), where fork is unavailable the same loop runs as a thread.
+    """
+    def __init__(self, py_face, fps=60, capacity=4096, slot_size=512, targets=None):
+        self.fps = fps
+        self.face_identity = (py_face.name, py_face.uuid, py_face._scaling_factor)
+        self.targets = targets or LIVELINK_TARGETS
+        self.ring = SharedFrameRing(capacity, slot_size)
+        self._control, self._child_control = multiprocessing.Pipe()
+        self._send_lock = Lock()
+        self._clip_ids = count()
+        self.worker = None
+
+    def start(self):
+        args = (self.ring, self._child_control, self.fps, self.face_identity, self.targets)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.worker = multiprocessing.get_context('fork').Process(target=run_sender, args=args, daemon=True)
+        else:
+            self.worker = Thread(target=run_sender, args=args, daemon=True)
+        self.worker.start()
+        return self
+
+    def set_idle(self, enabled):
+        self._send(('idle', enabled))
+
+    def clear(self):
+        self._send(('clear',))
+
+    def play(self, encoded_facial_data, start_event=None, start_time=None):
+        """
+        Plays a clip from when start_event is set (with the audio), blocks until it has been sent and returns the pacer stats.
+        start_time (monotonic) puts frame 0 on an earlier timeline instead, the later windows of a streamed clip continue the first one's.
+        """
+        if start_event is not None:
+            start_event.wait()
+        clip_id = next(self._clip_ids)
+        self._send(('clip', clip_id, len(encoded_facial_data), time.monotonic() if start_time is None else start_time))
+        for packet in encoded_facial_data:
+            self.ring.push(packet)
+
+        while self.worker is not None and self.worker.is_alive(): # only the playback thread receives, the other commands do not reply
+            if self._control.poll(0.5):
+                message = self._control.recv()
+                if message[0] == 'done' and message[1] == clip_id:
+                    return message[2]
+        return {}
+
+    def is_running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def stop(self):
+        if self.worker is None:
+            return
+        self._send(('stop',))
+        self.worker.join(timeout=5)
+        self.worker = None
+
+    def _send(self, message):
+        with self._send_lock:
+            self._control.send(message)
+
+def receive_intervals(port, num_packets, results):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', port))
+        s.settimeout(5)
+        arrivals = []
+        try:
+            while len(arrivals) < num_packets:
+                s.recv(2048)
+                arrivals.append(time.monotonic())
+        except socket.timeout:
+            pass
+    results.put(np.diff(arrivals) * 1000.0)
+
+def gil_load(stop):
+    while not stop[0]: # pure Python work, holds the GIL for the interpreter's whole switch interval at a time
+        sum(i * i for i in range(20000))
+
+def measure_jitter(mode, seconds, port=11199, fps=60):
+    from livelink.send_to_unreal import send_pre_encoded_data_to_unreal
+    from livelink.connect.livelink_init import initialize_py_face
+
+    py_face = initialize_py_face()
+    frames = py_face.encode_batch(np.random.RandomState(0).rand(int(seconds * fps), 51) * 0.5)
+
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else multiprocessing
+    results = context.Queue()
+    receiver = context.Process(target=receive_intervals, args=(port, len(frames), results))
+    receiver.start()
+    time.sleep(0.3)
+
+    stop = [False]
+    load_threads = [Thread(target=gil_load, args=(stop,)) for _ in range(2)]
+    for thread in load_threads:
+        thread.start()
+
+    if mode == 'thread':
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(('127.0.0.1', port))
+            from threading import Event
+            start_event = Event()
+            start_event.set()
+            sender_thread = Thread(target=send_pre_encoded_data_to_unreal, args=(frames, start_event, fps, s))
+            sender_thread.start()
+            sender_thread.join()
+    else:
+        sender = SenderProcess(py_face, fps, targets=[('127.0.0.1', port)]).start()
+        sender.play(frames)
+        sender.stop()
+
+    stop[0] = True
+    for thread in load_threads:
+        thread.join()
+    intervals = results.get()
+    receiver.join()
+
+    expected = 1000.0 / fps
+    return {
+        'received': len(intervals) + 1,
+        'interval_std_ms': float(intervals.std()),
+        'p99_deviation_ms': float(np.percentile(np.abs(intervals - expected), 99)),
+        'max_interval_ms': float(intervals.max()),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare LiveLink frame jitter of the sender thread and the sender process under GIL load.")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    for mode in ('thread', 'process'):
+        stats = measure_jitter(mode, args.seconds)
+        print(f"{mode:<8} received {stats['received']}, interval std {stats['interval_std_ms']:.2f} ms, "
+              f"p99 deviation {stats['p99_deviation_ms']:.2f} ms, max interval {stats['max_interval_ms']:.2f} ms")
@@ -3,26 +3,130 @@
 # For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
 
 
+import os
+import hashlib
+import inspect
+from threading import Lock
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from model_backends import apply_precision, apply_backend, checkpoint_id
+from processing.temporal_filters import PAIR_SMOOTHING
+
+# config keys that change the loaded model, everything else (batching, queues, ...) shares the cached instance.
+MODEL_CONFIG_KEYS = ('input_dim', 'output_dim', 'hidden_dim', 'n_layers', 'num_heads', 'frame_size', 'backend', 'onnx_path', 'precision')
+
+_model_cache = {}
+_model_cache_lock = Lock()
+
+def load_model(model_path, config, device, lazy=None):
+    """
+    Returns the process wide model for (model_path, model config, device), building it on the first call.
+    With lazy (or config['lazy_load']) a LazyModel is returned and the weights are only loaded on first use.
+    """
+    if lazy is None:
+        lazy = config.get('lazy_load', False)
+    if lazy:
+        return LazyModel(model_path, config, device)
+
+    cache_key = model_cache_key(model_path, config, device)
+    with _model_cache_lock:
+        model = _model_cache.get(cache_key)
+        if model is None:
+            model = build_model(model_path, config, device)
+            _model_cache[cache_key] = model
+    return model
+
+def model_cache_key(model_path, config, device):
+    return (os.path.abspath(model_path), tuple((key, config.get(key)) for key in MODEL_CONFIG_KEYS), str(device))
 
-def load_model(model_path, config, device):
+def model_fingerprint(model_path, config):
+    """Short id of the checkpoint (checkpoint_id, cheap enough for startup) and the model config, used to key stored results."""
+    digest = hashlib.sha256()
+    digest.update(checkpoint_id(model_path).encode())
+    digest.update(repr([(key, config.get(key)) for key in MODEL_CONFIG_KEYS if key != 'onnx_path']).encode())
+    if config.get('smoothing', PAIR_SMOOTHING) != PAIR_SMOOTHING: # stored results are smoothed, the default keeps the fingerprints from before smoothing was configurable
+        digest.update(repr(config['smoothing']).encode())
+    return digest.hexdigest()[:16]
+
+def clear_model_cache():
+    with _model_cache_lock:
+        _model_cache.clear()
+
+def build_model(model_path, config, device):
     hidden_dim = config['hidden_dim']
     n_layers = config['n_layers']
     num_heads = config['num_heads']
 
     encoder = Encoder(config['input_dim'], hidden_dim, n_layers, num_heads)
     decoder = Decoder(config['output_dim'], hidden_dim, n_layers, num_heads)
-    model = Seq2Seq(encoder, decoder, device).to(device)
-    
-    state_dict = torch.load(model_path, map_location=device)
+    model = Seq2Seq(encoder, decoder, device)
+
+    state_dict = load_state_dict(model_path, device)
+
+    if supports_assign():
+        # adopt the (memory-mapped) checkpoint tensors instead of copying them into freshly allocated parameters.
+        model.load_state_dict(state_dict, strict=True, assign=True)
+        model = model.to(device)
+    else:
+        model = model.to(device)
+        model.load_state_dict(state_dict, strict=True)
 
-    model.load_state_dict(state_dict, strict=True)
     model.eval()
+
+    model = apply_precision(model, config, device)
     
-    return model
+    return apply_backend(model, config, device, model_path)
+
+def load_state_dict(model_path, device):
+    if model_path.endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(model_path, device=str(device)) # safetensors maps the file, tensors are paged in on use
+
+    try:
+        return torch.load(model_path, map_location=device, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError) as e: # torch < 2.1 has no mmap, legacy (non zip) checkpoints cannot be mapped
+        print(f"Memory-mapped load of {model_path} unavailable ({e}), falling back to a full load.")
+        return torch.load(model_path, map_location=device)
+
+def supports_assign():
+    return 'assign' in inspect.signature(nn.Module.load_state_dict).parameters
+
+class LazyModel:
+    """Stands in for the model until it is first called, then loads it through load_model (and its cache)."""
+    def __init__(self, model_path, config, device):
+        self.model_path = model_path
+        self.config = config
+        self.device = device
+        self._model = None
+        self._lock = Lock()
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = load_model(self.model_path, self.config, self.device, lazy=False)
+        return self._model
+
+    def __call__(self, src):
+        return self.get()(src)
+
+    def eval(self):
+        self.get().eval()
+        return self
+
+    def __getstate__(self):
+        return {'model_path': self.model_path, 'config': self.config, 'device': self.device} # pickled unloaded, loads again on first use
+
+    def __setstate__(self, state):
+        self.__init__(state['model_path'], state['config'], state['device'])
+
+    def __getattr__(self, name):
+        if name.startswith('_'): # _model / _lock before __init__ ran (unpickling, copying), never a reason to load the weights
+            raise AttributeError(name)
+        return getattr(self.get(), name)
 
 class PositionalEncoding(nn.Module):
     def __init__(self, d_model, max_len=1000):
@@ -88,9 +192,17 @@ class Decoder(nn.Module):
     def forward(self, encoder_outputs):
         input = encoder_outputs.transpose(0, 1)
         input = self.pos_encoder(input)
-        cross_attn_output, _ = self.cross_attention(input, encoder_outputs, encoder_outputs)
-        decoder_input = input + cross_attn_output
-        decoder_output = self.transformer_decoder(decoder_input, encoder_outputs.transpose(0, 1))
+        memory = encoder_outputs.transpose(0, 1)
+        seq_len, batch_size, hidden_dim = input.shape
+        # cross attention pairs every position with the encoder output at the same position of the same sequence,
+        # folding the batch into the leading dim keeps that pairing for batch sizes > 1 (identical to the old path for batch size 1).
+        cross_attn_output, _ = self.cross_attention(
+            input.reshape(seq_len * batch_size, 1, hidden_dim),
+            memory.reshape(seq_len * batch_size, 1, hidden_dim),
+            memory.reshape(seq_len * batch_size, 1, hidden_dim),
+        )
+        decoder_input = input + cross_attn_output.view(seq_len, batch_size, hidden_dim)
+        decoder_output = self.transformer_decoder(decoder_input, memory)
         decoder_output = decoder_output.transpose(0, 1)
         
         if self.use_norm:
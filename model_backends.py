@@ -0,0 +1,193 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# model_backends.py
+
+import os
+import json
+import hashlib
+import inspect
+from threading import Lock
+import numpy as np
+import torch
+import torch.nn as nn
+
+BACKENDS = ('eager', 'torchscript', 'compile', 'onnx')
+PRECISIONS = ('fp32', 'int8', 'bf16')
+ONNX_CHECKPOINT_KEY = 'neurosync_checkpoint' # ONNX metadata entry holding the checkpoint_id of the weights a graph was exported from
+
+CHECKPOINT_SAMPLES = 64 # 64 KiB blocks hashed through the middle of a checkpoint, besides its first and last MiB
+CHECKPOINT_ID_SUFFIX = '.id' # <checkpoint>.id keeps the id with the size and mtime it was computed for
+
+_checkpoint_ids = {} # (path, size, mtime) -> checkpoint_id
+_checkpoint_ids_lock = Lock()
+
+def checkpoint_id(model_path):
+    """
+    Content id of a checkpoint without reading all of it: sha256 of its size, first and last MiB and CHECKPOINT_SAMPLES blocks
+    spread through the rest, so a same-shaped fine-tune (which changes nearly every tensor) gets a new id. The id is kept in
+    <checkpoint>.id, a start with the file unchanged (same size and mtime) reads only that; a copy with a new mtime samples again
+    and gets the same id. Cached per process by path, size and mtime.
+    """
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+    with _checkpoint_ids_lock: # not model.py's _model_cache_lock, build_model runs under it
+        checkpoint = _checkpoint_ids.get(key)
+    if checkpoint is not None:
+        return checkpoint
+
+    id_path = model_path + CHECKPOINT_ID_SUFFIX
+    try:
+        with open(id_path) as f:
+            stored = json.load(f)
+        if (stored['size'], stored['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            checkpoint = stored['id']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if checkpoint is None:
+        checkpoint = sample_checkpoint(model_path, stat.st_size)
+        try:
+            with open(id_path, 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'id': checkpoint}, f)
+        except OSError: # read-only model directory, sampled again on the next start
+            pass
+
+    with _checkpoint_ids_lock:
+        _checkpoint_ids[key] = checkpoint
+    return checkpoint
+
+def sample_checkpoint(model_path, file_size):
+    edge_size, block_size = 1 << 20, 1 << 16
+    digest = hashlib.sha256(str(file_size).encode())
+    with open(model_path, 'rb') as f:
+        digest.update(f.read(edge_size))
+        middle = file_size - 2 * edge_size
+        if middle > 0:
+            for index in range(CHECKPOINT_SAMPLES):
+                f.seek(edge_size + middle * index // CHECKPOINT_SAMPLES)
+                digest.update(f.read(block_size))
+        f.seek(max(file_size - edge_size, 0))
+        digest.update(f.read(edge_size))
+    return digest.hexdigest()
+
+def apply_precision(model, config, device):
+    """Reduce the precision of the eager Seq2Seq according to config['precision'] (fp32 leaves it untouched)."""
+    precision = config.get('precision', 'fp32')
+
+    if precision == 'fp32':
+        return model
+    if precision == 'int8':
+        if torch.device(device).type != 'cpu':
+            raise ValueError("int8 dynamic quantization only runs on CPU, use precision 'fp32' or 'bf16' on GPU")
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if precision == 'bf16':
+        return AutocastModel(model, device, torch.bfloat16).eval()
+
+    raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+
+class AutocastModel(nn.Module):
+    """Runs the wrapped model under autocast and hands back fp32 outputs, weights stay fp32."""
+    def __init__(self, model, device, dtype):
+        super(AutocastModel, self).__init__()
+        self.model = model
+        self.device_type = torch.device(device).type
+        self.dtype = dtype
+
+    def forward(self, src):
+        with torch.no_grad(), torch.autocast(device_type=self.device_type, dtype=self.dtype):
+            output = self.model(src)
+        return output.float()
+
+def apply_backend(model, config, device, model_path=None):
+    """
+    Wrap the eager Seq2Seq in the runtime picked by config['backend'], anything returned is called as model(src) -> output.
+    model_path is the checkpoint the weights came from, an ONNX graph exported from another one is exported again.
+    """
+    backend = config.get('backend', 'eager')
+
+    if backend == 'eager':
+        return model
+    if backend == 'torchscript':
+        return trace_model(model, config, device)
+    if backend == 'compile':
+        return torch.compile(model)
+    if backend == 'onnx':
+        if config.get('precision', 'fp32') != 'fp32':
+            raise ValueError("The onnx backend runs the exported fp32 graph, set precision to 'fp32'")
+        onnx_path = config.get('onnx_path', '_out/model.onnx')
+        checkpoint = checkpoint_id(model_path) if model_path is not None else None
+        if not os.path.exists(onnx_path):
+            print(f"No ONNX graph at {onnx_path}, exporting it from the loaded weights.")
+            export_onnx(model, config, onnx_path, checkpoint=checkpoint)
+        elif checkpoint is not None and onnx_checkpoint(onnx_path) != checkpoint:
+            print(f"The ONNX graph at {onnx_path} was exported from other weights, exporting it again from the loaded ones.")
+            export_onnx(model, config, onnx_path, checkpoint=checkpoint)
+        return OnnxRuntimeModel(onnx_path, device)
+
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+def example_input(config, device, batch_size=1):
+    return torch.zeros(batch_size, config['frame_size'], config['input_dim'], dtype=torch.float32, device=device)
+
+def trace_model(model, config, device):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_input(config, device), check_trace=False)
+    return torch.jit.freeze(traced.eval())
+
+def export_onnx(model, config, onnx_path, opset_version=17, checkpoint=None):
+    """Exports the graph with a dynamic batch axis, checkpoint (checkpoint_id of the weights) is stored in its metadata."""
+    os.makedirs(os.path.dirname(onnx_path) or '.', exist_ok=True)
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs['dynamo'] = False # the TorchScript based exporter handles the dynamic batch axis of this graph
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (example_input(config, next(model.parameters()).device),),
+            onnx_path,
+            input_names=['src'],
+            output_names=['output'],
+            dynamic_axes={'src': {0: 'batch'}, 'output': {0: 'batch'}},
+            opset_version=opset_version,
+            **export_kwargs
+        )
+    if checkpoint is not None:
+        import onnx
+
+        graph = onnx.load(onnx_path)
+        onnx.helper.set_model_props(graph, {ONNX_CHECKPOINT_KEY: checkpoint})
+        onnx.save(graph, onnx_path)
+    print(f"Exported ONNX graph to {onnx_path}")
+    return onnx_path
+
+def onnx_checkpoint(onnx_path):
+    """The checkpoint id stored by export_onnx, None for a graph exported without one."""
+    import onnx
+
+    graph = onnx.load(onnx_path, load_external_data=False)
+    return next((prop.value for prop in graph.metadata_props if prop.key == ONNX_CHECKPOINT_KEY), None)
+
+class OnnxRuntimeModel:
+    """Runs an exported Seq2Seq graph with onnxruntime, takes and returns torch tensors like the eager model."""
+    def __init__(self, onnx_path, device):
+        import onnxruntime as ort
+
+        providers = ['CPUExecutionProvider']
+        if torch.device(device).type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = device
+
+    def __call__(self, src):
+        src = np.ascontiguousarray(src.detach().cpu().numpy(), dtype=np.float32)
+        output = self.session.run(None, {self.input_name: src})[0]
+        return torch.from_numpy(output).to(self.device)
+
+    def eval(self):
+        return self
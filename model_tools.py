@@ -0,0 +1,129 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# model_tools.py
+# python model_tools.py export-onnx            -> writes config['onnx_path'] from _out/model.pth
+# python model_tools.py parity --backend onnx  -> compares a backend against eager on sample_data/audio.wav
+# python model_tools.py precision-report --precision int8 -> per blendshape error of int8 / bf16 against fp32 and sample_data/shapes.csv
+
+import argparse
+import io
+import time
+import numpy as np
+import pandas as pd
+import torch
+
+from model import load_model, checkpoint_id
+from model_backends import BACKENDS, PRECISIONS, export_onnx
+from extraction.extract_features import extract_audio_features
+from processing.audio_processing import decode_audio, postprocess_decoded_outputs
+from utils.csv.save_csv import BLENDSHAPE_NAMES
+
+config = {
+    'sr': 88200,
+    'frame_rate': 60,
+    'hidden_dim':  1024,
+    'n_layers': 4,
+    'num_heads': 4,
+    'dropout': 0.0,
+    'output_dim': 68,
+    'input_dim': 26 + 26 + 26,
+    'frame_size': 256,
+    'batch_size': 8,  # windows decoded per model pass, set to 1 for the chunk by chunk path
+    'backend': 'eager',  # eager, torchscript, compile or onnx (see model_backends.py)
+    'onnx_path': '_out/model.onnx',
+    'precision': 'fp32',  # fp32, int8 (dynamic quantized Linear layers, CPU only) or bf16 (autocast)
+}
+
+model_path = '_out/model.pth'
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+def timed_decode(audio_features, model, config, repeats):
+    decode_audio(audio_features, model, device, config) # warm-up, compile / graph optimisation happens here
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decoded_outputs = decode_audio(audio_features, model, device, config)
+    return decoded_outputs, (time.perf_counter() - start) / repeats
+
+def check_backend_parity(backend, audio_path='sample_data/audio.wav', repeats=3, atol=1e-3):
+    audio_features, _ = extract_audio_features(audio_path)
+
+    eager_model = load_model(model_path, dict(config, backend='eager'), device)
+    backend_model = load_model(model_path, dict(config, backend=backend), device)
+
+    eager_outputs, eager_time = timed_decode(audio_features, eager_model, config, repeats)
+    backend_outputs, backend_time = timed_decode(audio_features, backend_model, config, repeats)
+
+    abs_error = np.abs(eager_outputs - backend_outputs)
+    print(f"Backend '{backend}' vs eager on {audio_path} ({audio_features.shape[0]} frames)")
+    print(f"  max abs error:  {abs_error.max():.6g}")
+    print(f"  mean abs error: {abs_error.mean():.6g}")
+    print(f"  eager: {eager_time * 1000:.1f} ms, {backend}: {backend_time * 1000:.1f} ms per clip")
+
+    passed = bool(abs_error.max() <= atol)
+    print("  PASS" if passed else f"  FAIL (tolerance {atol})")
+    return passed
+
+def serialized_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+def precision_report(precision, audio_path='sample_data/audio.wav', shapes_path='sample_data/shapes.csv', repeats=3):
+    audio_features, _ = extract_audio_features(audio_path)
+    ground_truth = pd.read_csv(shapes_path).drop(columns=['Timecode', 'BlendshapeCount'], errors='ignore').values
+
+    fp32_model = load_model(model_path, dict(config, precision='fp32', backend='eager'), device)
+    reduced_model = load_model(model_path, dict(config, precision=precision, backend='eager'), device)
+
+    fp32_outputs, fp32_time = timed_decode(audio_features, fp32_model, config, repeats)
+    reduced_outputs, reduced_time = timed_decode(audio_features, reduced_model, config, repeats)
+    fp32_outputs = postprocess_decoded_outputs(fp32_outputs)
+    reduced_outputs = postprocess_decoded_outputs(reduced_outputs)
+
+    num_frames = min(len(fp32_outputs), len(ground_truth))
+    error_vs_fp32 = np.abs(reduced_outputs - fp32_outputs)
+    fp32_error_vs_truth = np.abs(fp32_outputs[:num_frames] - ground_truth[:num_frames])
+    reduced_error_vs_truth = np.abs(reduced_outputs[:num_frames] - ground_truth[:num_frames])
+
+    print(f"Precision '{precision}' vs fp32 on {audio_path} ({len(fp32_outputs)} frames), ground truth {shapes_path}")
+    print(f"{'blendshape':<22}{'mae vs fp32':>14}{'max vs fp32':>14}{'mae fp32/gt':>14}{'mae ' + precision + '/gt':>14}")
+    for i, name in enumerate(BLENDSHAPE_NAMES):
+        print(f"{name:<22}{error_vs_fp32[:, i].mean():>14.6f}{error_vs_fp32[:, i].max():>14.6f}"
+              f"{fp32_error_vs_truth[:, i].mean():>14.6f}{reduced_error_vs_truth[:, i].mean():>14.6f}")
+    print(f"{'all':<22}{error_vs_fp32.mean():>14.6f}{error_vs_fp32.max():>14.6f}"
+          f"{fp32_error_vs_truth.mean():>14.6f}{reduced_error_vs_truth.mean():>14.6f}")
+
+    print(f"weights: fp32 {serialized_size_mb(fp32_model):.1f} MB, {precision} {serialized_size_mb(reduced_model):.1f} MB")
+    print(f"decode: fp32 {fp32_time * 1000:.1f} ms, {precision} {reduced_time * 1000:.1f} ms per clip")
+
+    return error_vs_fp32
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export and check the inference backends of the NeuroSync model.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export-onnx', help="export the model to an ONNX graph")
+    export_parser.add_argument('--output', default=config['onnx_path'])
+    export_parser.add_argument('--opset', type=int, default=17)
+
+    parity_parser = subparsers.add_parser('parity', help="compare a backend against eager outputs")
+    parity_parser.add_argument('--backend', choices=BACKENDS, default='onnx')
+    parity_parser.add_argument('--audio', default='sample_data/audio.wav')
+    parity_parser.add_argument('--atol', type=float, default=1e-3)
+
+    report_parser = subparsers.add_parser('precision-report', help="per blendshape error of a reduced precision mode against fp32")
+    report_parser.add_argument('--precision', choices=PRECISIONS, default='int8')
+    report_parser.add_argument('--audio', default='sample_data/audio.wav')
+    report_parser.add_argument('--shapes', default='sample_data/shapes.csv')
+
+    args = parser.parse_args()
+
+    if args.command == 'export-onnx':
+        eager_model = load_model(model_path, dict(config, backend='eager'), device)
+        export_onnx(eager_model, config, args.output, opset_version=args.opset, checkpoint=checkpoint_id(model_path))
+    elif args.command == 'parity':
+        passed = check_backend_parity(args.backend, args.audio, atol=args.atol)
+        raise SystemExit(0 if passed else 1)
+    elif args.command == 'precision-report':
+        precision_report(args.precision, args.audio, args.shapes)
@@ -3,12 +3,12 @@
 from threading import Thread
 import pygame
 
-from livelink.connect.livelink_init import create_socket_connection, initialize_py_face
+from livelink.connect.livelink_init import create_livelink_sender, initialize_py_face
 
-from utils.generated_utils import list_generated_files, load_facial_data_from_csv, run_audio_animation, default_animation_loop, stop_default_animation
+from utils.generated_utils import list_generated_files, load_facial_data, run_audio_animation, default_animation_loop, stop_default_animation
 
 py_face = initialize_py_face()
-socket_connection = create_socket_connection()
+socket_connection = create_livelink_sender(py_face)
 
 default_animation_thread = Thread(target=default_animation_loop, args=(py_face,))
 default_animation_thread.start()
@@ -31,7 +31,7 @@ def main():
             index = int(user_input) - 1
             if 0 <= index < len(generated_files):
                 audio_path, shapes_path = generated_files[index]
-                generated_facial_data = load_facial_data_from_csv(shapes_path)
+                generated_facial_data = load_facial_data(shapes_path)
                 run_audio_animation(audio_path, generated_facial_data, py_face, socket_connection, default_animation_thread)
             else:
                 print("Invalid selection. Please try again.")
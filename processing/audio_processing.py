@@ -3,31 +3,50 @@
 
 # audio_processing.py
 
-from processing.audio_processing_utils import pad_audio_chunk, decode_audio_chunk, concatenate_outputs, ensure_2d  
+from processing.audio_processing_utils import split_into_windows, decode_audio_chunk, decode_audio_batch, concatenate_outputs, ensure_2d  
 
-def process_audio_features(audio_features, model, device, config):
-    all_decoded_outputs = decode_audio(audio_features, model, device, config)
+def process_audio_features(audio_features, model, device, config, scheduler=None):
+    if scheduler is not None: # windows are batched with other in-flight requests by the shared InferenceScheduler
+        all_decoded_outputs = scheduler.decode_audio(audio_features)
+    else:
+        all_decoded_outputs = decode_audio(audio_features, model, device, config)
     final_decoded_outputs = postprocess_decoded_outputs(all_decoded_outputs)
     return final_decoded_outputs
 
+def iter_process_audio_features(audio_features, model, device, config, scheduler=None):
+    """process_audio_features one frame_size window at a time, for streaming responses."""
+    if scheduler is not None:
+        decoded_windows = scheduler.iter_decode_audio(audio_features)
+    else:
+        decoded_windows = iter_decode_audio(audio_features, model, device, config)
+    for decoded_outputs in decoded_windows:
+        yield postprocess_decoded_outputs(decoded_outputs)
+
 def postprocess_decoded_outputs(final_decoded_outputs):
     final_decoded_outputs = ensure_2d(final_decoded_outputs)
     final_decoded_outputs[:, :61] /= 100 # scale the 0-100 down to 0 - 1 before playback.
     return final_decoded_outputs
 
 def decode_audio(normalized_audio_features, model, device, config):
-    frame_length = config['frame_size'] # now brings this through from the root py so you can set frame size to 128 or 256 depending on your model more easily.... 
-    num_features = normalized_audio_features.shape[1]
     num_frames = normalized_audio_features.shape[0]
-    all_decoded_outputs = []
+    all_decoded_outputs = list(iter_decode_audio(normalized_audio_features, model, device, config))
+    return concatenate_outputs(all_decoded_outputs, num_frames)
+
+def iter_decode_audio(normalized_audio_features, model, device, config):
+    frame_length = config['frame_size'] # now brings this through from the root py so you can set frame size to 128 or 256 depending on your model more easily.... 
+    batch_size = config.get('batch_size', 1) # number of frame_size windows run through the model in one pass, 1 keeps the old chunk by chunk path.
 
     model.eval()
-    
-    for start_idx in range(0, num_frames, frame_length):
-        end_idx = min(start_idx + frame_length, num_frames)
-        audio_chunk = normalized_audio_features[start_idx:end_idx]
-        audio_chunk = pad_audio_chunk(audio_chunk, frame_length, num_features)
-        decoded_outputs = decode_audio_chunk(audio_chunk, model, device)
-        all_decoded_outputs.append(decoded_outputs[:end_idx - start_idx])
 
-    return concatenate_outputs(all_decoded_outputs, num_frames)
+    windows = split_into_windows(normalized_audio_features, frame_length)
+
+    if batch_size <= 1:
+        for audio_chunk, valid_length in windows:
+            decoded_outputs = decode_audio_chunk(audio_chunk, model, device)
+            yield decoded_outputs[:valid_length]
+    else:
+        for batch_start in range(0, len(windows), batch_size):
+            batch_windows = windows[batch_start:batch_start + batch_size]
+            decoded_batch = decode_audio_batch([audio_chunk for audio_chunk, _ in batch_windows], model, device)
+            for decoded_outputs, (_, valid_length) in zip(decoded_batch, batch_windows):
+                yield decoded_outputs[:valid_length]
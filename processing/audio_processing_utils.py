@@ -17,14 +17,31 @@ def pad_audio_chunk(audio_chunk, frame_length, num_features):
         audio_chunk = np.vstack((audio_chunk, padding[-pad_length:, :num_features]))
     return audio_chunk
 
+def split_into_windows(audio_features, frame_length):
+    num_frames = audio_features.shape[0]
+    num_features = audio_features.shape[1]
+    windows = []
+    for start_idx in range(0, num_frames, frame_length):
+        end_idx = min(start_idx + frame_length, num_frames)
+        audio_chunk = pad_audio_chunk(audio_features[start_idx:end_idx], frame_length, num_features)
+        windows.append((audio_chunk, end_idx - start_idx))
+    return windows
+
 def decode_audio_chunk(audio_chunk, model, device):
     src_tensor = torch.tensor(audio_chunk, dtype=torch.float32).unsqueeze(0).to(device)
     with torch.no_grad():
-        encoder_outputs = model.encoder(src_tensor)
-        output_sequence = model.decoder(encoder_outputs)
+        output_sequence = model(src_tensor)
         decoded_outputs = output_sequence.squeeze(0).cpu().numpy()
     return decoded_outputs
 
+def decode_audio_batch(audio_chunks, model, device):
+    # audio_chunks: list of padded [frame_length, num_features] windows, decoded together as one [B, frame_length, num_features] batch.
+    src_tensor = torch.from_numpy(np.stack(audio_chunks).astype(np.float32, copy=False)).to(device)
+    with torch.no_grad():
+        output_sequence = model(src_tensor)
+        decoded_outputs = output_sequence.cpu().numpy()
+    return decoded_outputs
+
 def concatenate_outputs(all_decoded_outputs, num_frames):
     final_decoded_outputs = np.concatenate(all_decoded_outputs, axis=0)
     final_decoded_outputs = final_decoded_outputs[:num_frames]
@@ -0,0 +1,136 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# inference_scheduler.py
+
+import time
+from threading import Thread, Event, Lock
+from queue import Queue, Empty
+
+from processing.audio_processing_utils import split_into_windows, decode_audio_batch, concatenate_outputs
+
+class PendingWindow:
+    __slots__ = ('audio_chunk', 'result', 'error', 'done')
+
+    def __init__(self, audio_chunk):
+        self.audio_chunk = audio_chunk
+        self.result = None
+        self.error = None
+        self.done = Event()
+
+class InferenceScheduler:
+    """
+    Collects frame_size windows from every in-flight request and runs them through the shared model as one batch,
+    once max_batch_size windows are waiting or the oldest window has waited max_wait_ms.
+    """
+    def __init__(self, model, device, config):
+        self.model = model
+        self.device = device
+        self.frame_length = config['frame_size']
+        self.max_batch_size = config.get('scheduler_max_batch_size', 16)
+        self.max_wait = config.get('scheduler_max_wait_ms', 10) / 1000.0
+
+        self._queue = Queue()
+        self._stats_lock = Lock()
+        self._batch_size_counts = {}
+        self._num_batches = 0
+        self._num_windows = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, audio_chunk):
+        pending = PendingWindow(audio_chunk)
+        self._queue.put(pending)
+        return pending
+
+    def decode_audio(self, normalized_audio_features):
+        """Drop-in for processing.audio_processing.decode_audio, the windows of this clip share batches with other requests."""
+        num_frames = normalized_audio_features.shape[0]
+        return concatenate_outputs(list(self.iter_decode_audio(normalized_audio_features)), num_frames)
+
+    def iter_decode_audio(self, normalized_audio_features):
+        """The decoded windows of the clip in order, each as soon as it and the ones before it are done. All are queued up front."""
+        windows = split_into_windows(normalized_audio_features, self.frame_length)
+        pending_windows = [self.submit(audio_chunk) for audio_chunk, _ in windows]
+
+        for pending, (_, valid_length) in zip(pending_windows, windows):
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            yield pending.result[:valid_length]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'batches': self._num_batches,
+                'windows': self._num_windows,
+                'mean_batch_size': self._num_windows / self._num_batches if self._num_batches else 0.0,
+                'batch_size_counts': dict(self._batch_size_counts),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+            }
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        stopping = False
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            if pending is None:
+                stopping = True
+                break
+            batch.append(pending)
+        return batch, stopping
+
+    def _run(self):
+        evaluating = False
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch, stopping = self._collect_batch(first)
+
+            try:
+                if not evaluating: # on the first batch rather than at start(), a LazyModel only reads its weights here
+                    self.model.eval()
+                    evaluating = True
+                decoded_batch = decode_audio_batch([pending.audio_chunk for pending in batch], self.model, self.device)
+                for pending, decoded_outputs in zip(batch, decoded_batch):
+                    pending.result = decoded_outputs
+            except Exception as e:
+                print(f"Error in inference scheduler: {e}")
+                for pending in batch:
+                    pending.error = e
+
+            for pending in batch:
+                pending.done.set()
+
+            with self._stats_lock:
+                self._num_batches += 1
+                self._num_windows += len(batch)
+                self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+
+            if stopping:
+                break
@@ -0,0 +1,292 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# temporal_filters.py
+
+import numpy as np
+from scipy.signal import lfilter, savgol_coeffs, savgol_filter
+
+class TemporalFilter:
+    """
+    Smooths [frames, channels] blendshape arrays along time. Every parameter is a scalar or one value per channel.
+
+    process() is the online form: it takes a block of frames (a single frame is a [1, channels] block) and carries its state
+    over to the next call, so feeding a clip frame by frame or in windows gives the same result as feeding it in one block.
+    apply() is the offline form on a whole clip from a fresh state; it equals process() on that clip except for the centred
+    filters, which look ahead and can only be applied offline.
+    """
+    centred = False
+
+    def __init__(self, **params):
+        self.params = params
+        self.reset()
+
+    def reset(self):
+        self._channels = None
+
+    def clone(self):
+        return type(self)(**self.params)
+
+    def step(self, frame):
+        return self.process(np.asarray(frame)[None, :])[0]
+
+    def process(self, frames):
+        if self.centred:
+            raise ValueError(f"{type(self).__name__} is centred (looks ahead), use apply() on a whole clip")
+        frames = np.asarray(frames, dtype=np.float64)
+        if frames.ndim != 2:
+            raise ValueError(f"expected a [frames, channels] array, got shape {frames.shape}")
+        if len(frames) == 0:
+            return frames.copy()
+        if self._channels is None:
+            self._channels = frames.shape[1]
+            self._start(frames.shape[1])
+        elif frames.shape[1] != self._channels:
+            raise ValueError(f"filter was started on {self._channels} channels, got {frames.shape[1]}")
+        return self._process(frames)
+
+    def apply(self, data):
+        return self.clone().process(data)
+
+    @property
+    def lookahead(self):
+        """Frames after a frame that a centred filter needs to smooth it, 0 for the online ones."""
+        return 0
+
+    @property
+    def context(self):
+        """Frames apply() has to see around a frame for its value to match the one on the whole clip."""
+        return 1
+
+    def per_channel(self, name, channels, dtype=np.float64):
+        value = np.broadcast_to(np.asarray(self.params[name], dtype=dtype), (channels,))
+        return value.copy()
+
+    def channel_groups(self, channels, *names):
+        """Channels sharing the same values of the named parameters, as (values, channel indices), for filters that need one call per setting."""
+        columns = np.stack([self.per_channel(name, channels) for name in names], axis=1)
+        settings, inverse = np.unique(columns, axis=0, return_inverse=True)
+        return [(tuple(setting), np.flatnonzero(inverse.ravel() == index)) for index, setting in enumerate(settings)]
+
+    def _start(self, channels):
+        pass
+
+    def _process(self, frames):
+        raise NotImplementedError
+
+class MovingAverageFilter(TemporalFilter):
+    """
+    Mean of the last window frames (fewer at the start of a clip). centred=True averages window frames around each frame
+    instead (the later one of the two middle frames for even windows), offline only; window=2 centred is smooth_by_averaging_pairs.
+    """
+    def __init__(self, window=2, centred=False):
+        self.centred = centred
+        super().__init__(window=window, centred=centred)
+
+    def _start(self, channels):
+        self.window = self.per_channel('window', channels, dtype=np.int64)
+        if np.any(self.window < 1):
+            raise ValueError("window must be at least 1")
+        self._history = np.zeros((0, channels)) # last max(window) - 1 input frames
+
+    def _process(self, frames):
+        history_length = len(self._history)
+        data = np.vstack([self._history, frames])
+        ends = history_length + np.arange(1, len(frames) + 1)
+        averaged = self._window_means(data, ends[:, None] - self.window[None, :], ends[:, None])
+        self._history = data[max(len(data) - (self.window.max() - 1), 0):]
+        return averaged
+
+    @property
+    def lookahead(self):
+        return int(np.max(self.params['window'])) // 2 if self.centred else 0
+
+    @property
+    def context(self):
+        return int(np.max(self.params['window']))
+
+    def apply(self, data):
+        if not self.centred:
+            return super().apply(data)
+        data = np.asarray(data, dtype=np.float64)
+        if len(data) == 0:
+            return data.copy()
+        window = self.per_channel('window', data.shape[1], dtype=np.int64)
+        rows = np.arange(len(data))[:, None]
+        return self._window_means(data, rows - (window[None, :] - 1) // 2, rows + window[None, :] // 2 + 1)
+
+    @staticmethod
+    def _window_means(data, starts, ends):
+        """Per row and channel mean of data[start:end], the bounds clipped to the data."""
+        cumulative = np.vstack([np.zeros((1, data.shape[1])), np.cumsum(data, axis=0)])
+        starts = np.clip(starts, 0, len(data))
+        ends = np.clip(ends, 0, len(data))
+        sums = np.take_along_axis(cumulative, ends, axis=0) - np.take_along_axis(cumulative, starts, axis=0)
+        return sums / (ends - starts)
+
+class ExponentialFilter(TemporalFilter):
+    """y[t] = y[t - 1] + alpha * (x[t] - y[t - 1]), starting at the first frame. Smaller alpha is smoother and lags more."""
+    def __init__(self, alpha=0.5):
+        super().__init__(alpha=alpha)
+
+    def _start(self, channels):
+        self.alpha = self.per_channel('alpha', channels)
+        if np.any((self.alpha <= 0) | (self.alpha > 1)):
+            raise ValueError("alpha must be in (0, 1]")
+        self._groups = self.channel_groups(channels, 'alpha')
+        self._last = None
+
+    def _process(self, frames):
+        if self._last is None:
+            self._last = frames[0]
+        filtered = np.empty_like(frames)
+        for (alpha,), columns in self._groups: # one IIR pass per distinct alpha, usually a single one
+            initial = (1.0 - alpha) * self._last[None, columns]
+            filtered[:, columns], _ = lfilter([alpha], [1.0, alpha - 1.0], frames[:, columns], axis=0, zi=initial)
+        self._last = filtered[-1]
+        return filtered
+
+class OneEuroFilter(TemporalFilter):
+    """
+    One-Euro filter (Casiez et al. 2012): an exponential filter whose cutoff rises with the (smoothed) speed of the channel,
+    so holds are smoothed hard (min_cutoff Hz) and fast movements (beta scales the speed) come through without lag.
+    The cutoff depends on the previous output, so it runs frame by frame, vectorised over the channels.
+    """
+    def __init__(self, fps=60, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        super().__init__(fps=fps, min_cutoff=min_cutoff, beta=beta, d_cutoff=d_cutoff)
+
+    def _start(self, channels):
+        self.fps = float(self.params['fps'])
+        self.min_cutoff = self.per_channel('min_cutoff', channels)
+        self.beta = self.per_channel('beta', channels)
+        self.derivative_alpha = self._alpha(self.per_channel('d_cutoff', channels))
+        self._last = None
+        self._last_derivative = np.zeros(channels)
+
+    def _alpha(self, cutoff):
+        tau = 1.0 / (2.0 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau * self.fps)
+
+    def _process(self, frames):
+        filtered = np.empty_like(frames)
+        start = 0
+        if self._last is None:
+            self._last = filtered[0] = frames[0].copy()
+            start = 1
+        for index in range(start, len(frames)):
+            derivative = (frames[index] - self._last) * self.fps
+            self._last_derivative += self.derivative_alpha * (derivative - self._last_derivative)
+            alpha = self._alpha(self.min_cutoff + self.beta * np.abs(self._last_derivative))
+            self._last = filtered[index] = self._last + alpha * (frames[index] - self._last)
+        return filtered
+
+class SavitzkyGolayFilter(TemporalFilter):
+    """
+    Least squares polynomial fits of polyorder over window frames. Causal (the default) evaluates each fit at its newest frame,
+    which follows movements without delay but smooths less; the first window - 1 frames pass through unchanged.
+    centred=True is scipy's savgol_filter (interp edges), offline only; clips shorter than the window are returned unchanged.
+    """
+    def __init__(self, window=9, polyorder=2, centred=False):
+        self.centred = centred
+        super().__init__(window=window, polyorder=polyorder, centred=centred)
+
+    def _start(self, channels):
+        self._groups = []
+        for (window, polyorder), columns in self.channel_groups(channels, 'window', 'polyorder'):
+            window, polyorder = int(window), int(polyorder)
+            if polyorder >= window:
+                raise ValueError("polyorder must be less than window")
+            self._groups.append((window, savgol_coeffs(window, polyorder, pos=window - 1, use='dot'), columns))
+        self._max_window = max(window for window, _, _ in self._groups)
+        self._history = np.zeros((0, channels))
+
+    def _process(self, frames):
+        history_length = len(self._history)
+        data = np.vstack([self._history, frames])
+        filtered = frames.copy()
+        for window, coefficients, columns in self._groups:
+            first = max(window - 1, history_length) # first row of data with a full window behind it
+            if first >= len(data):
+                continue
+            windows = np.lib.stride_tricks.sliding_window_view(data[first - (window - 1):, columns], window, axis=0) # [rows, columns, window]
+            filtered[first - history_length:, columns] = windows @ coefficients
+        self._history = data[max(len(data) - (self._max_window - 1), 0):]
+        return filtered
+
+    @property
+    def lookahead(self):
+        return int(np.max(self.params['window'])) // 2 if self.centred else 0
+
+    @property
+    def context(self):
+        return int(np.max(self.params['window']))
+
+    def apply(self, data):
+        if not self.centred:
+            return super().apply(data)
+        data = np.asarray(data, dtype=np.float64)
+        filtered = data.copy()
+        for (window, polyorder), columns in self.channel_groups(data.shape[1], 'window', 'polyorder'):
+            if len(data) >= window:
+                filtered[:, columns] = savgol_filter(data[:, columns], int(window), int(polyorder), axis=0, mode='interp')
+        return filtered
+
+class StreamingSmoother:
+    """
+    Smooths a clip that arrives in blocks (e.g. one decoded window at a time) and returns the frames whose smoothed value is final,
+    the values apply() gives on the whole clip. Online filters process() each block as it comes. Centred ones hold back their
+    last lookahead frames until the frames after them arrive or finish() is called, and are applied over the new frames plus
+    the context frames before them.
+    """
+    def __init__(self, smoothing_filter):
+        self.filter = smoothing_filter.clone()
+        self._pending = None # centred filters: unsmoothed frames from clip index _offset on
+        self._offset = 0
+        self._emitted = 0
+
+    def push(self, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        if not self.filter.centred:
+            return self.filter.process(frames)
+
+        self._pending = frames if self._pending is None else np.vstack([self._pending, frames])
+        ready = self._offset + len(self._pending) - self.filter.lookahead
+        if ready <= self._emitted or len(self._pending) < self.filter.context:
+            return np.zeros((0, frames.shape[1]))
+
+        smoothed = self.filter.apply(self._pending)[self._emitted - self._offset:ready - self._offset]
+        self._emitted = ready
+        drop = max(self._emitted - self.filter.context - self._offset, 0)
+        self._pending = self._pending[drop:]
+        self._offset += drop
+        return smoothed
+
+    def finish(self):
+        """The frames still held back once the clip has ended, None if there are none."""
+        if not self.filter.centred or self._pending is None:
+            return None
+        smoothed = self.filter.apply(self._pending)[self._emitted - self._offset:]
+        self._emitted = self._offset + len(self._pending)
+        return smoothed
+
+PAIR_SMOOTHING = {'filter': 'moving_average', 'window': 2, 'centred': True} # smooth_by_averaging_pairs, the generation default
+
+FILTERS = {
+    'moving_average': MovingAverageFilter,
+    'ema': ExponentialFilter,
+    'one_euro': OneEuroFilter,
+    'savgol': SavitzkyGolayFilter,
+}
+
+def create_filter(settings):
+    """
+    A filter from a config entry such as {'filter': 'one_euro', 'min_cutoff': 1.5, 'beta': 0.3}, None for None.
+    Parameters may be lists with one value per channel.
+    """
+    if settings is None:
+        return None
+    params = dict(settings)
+    name = params.pop('filter')
+    if name not in FILTERS:
+        raise ValueError(f"Unknown filter '{name}', expected one of {tuple(FILTERS)}")
+    return FILTERS[name](**params)
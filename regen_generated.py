@@ -1,60 +1,185 @@
 # regen_generated.py
 # This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
 # For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+#
+# python regen_generated.py [--workers 4] [--inflight 8] [--force] [--rehash] [--keep-old] [--prune-formats] [--limit N]
+# -> regenerates the shapes of every generated/ entry not yet produced by the current model, resumable after an interruption
 
+import argparse
+import hashlib
 import os
 import shutil
-import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
 import torch
 
-from model import load_model
-from generate_face_shapes import generate_facial_data_from_bytes 
-from utils.csv.save_csv import save_generated_data_as_csv
+from model import load_model, model_fingerprint
+from generate_face_shapes import generate_facial_data_from_features
+from extraction.extraction_pool import FeatureExtractionPool
+from processing.inference_scheduler import InferenceScheduler
+from utils.csv.shapes_store import SHAPES_NPZ, SHAPES_CSV, save_shapes, read_npz_header
+from utils.generated_manifest import open_manifest, file_hash, GENERATED_DIR
 
 config = {
-    'sr': 88200,  
-    'frame_rate': 60,           
-    'hidden_dim':  1024,   
+    'sr': 88200,
+    'frame_rate': 60,
+    'hidden_dim':  1024,
     'n_layers': 4,
-    'num_heads': 4,    
-    'dropout': 0.0,        
-    'output_dim': 68,      
-    'input_dim': 26 + 26 + 26, 
+    'num_heads': 4,
+    'dropout': 0.0,
+    'output_dim': 68,
+    'input_dim': 26 + 26 + 26,
     'frame_size': 256,
+    'batch_size': 8,  # windows decoded per model pass, set to 1 for the chunk by chunk path
+    'backend': 'eager',  # eager, torchscript, compile or onnx (see model_backends.py)
+    'onnx_path': '_out/model.onnx',
+    'precision': 'fp32',  # fp32, int8 (dynamic quantized Linear layers, CPU only) or bf16 (autocast)
+    'lazy_load': False,  # True defers reading the weights until the first inference
+    'shapes_format': 'both',  # generated shapes as both (npz read back, csv for Unreal), npz only (binary, memory-mappable) or csv only, see utils/csv/shapes_store.py
+    'shapes_dtype': 'float32',  # float16 halves the npz files, ~1e-3 precision
+    'extraction_workers': 2,  # feature extraction processes (--workers)
+    'regen_inflight': 8,  # entries being extracted / inferred at once, their windows share the scheduler's batches (--inflight)
+    'scheduler_max_batch_size': 16,  # windows from different entries run together in one model pass
+    'scheduler_max_wait_ms': 10,  # longest a window waits for others to join its batch
 }
 
 model_path = '_out/model.pth'
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model = load_model(model_path, config, device)
 
-GENERATED_DIR = 'generated'
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._lock = Lock()
 
-def process_audio_files():
-    directories = [d for d in os.listdir(GENERATED_DIR) if os.path.isdir(os.path.join(GENERATED_DIR, d))]
-    
-    for directory in directories:
-        dir_path = os.path.join(GENERATED_DIR, directory)
+    def update(self, entry_id, outcome):
+        with self._lock:
+            self.done += 1
+            self.failed += outcome == 'failed'
+            self.skipped += outcome == 'skipped'
+            elapsed = time.monotonic() - self.started
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            eta = (self.total - self.done) / rate if rate > 0 else 0.0
+            print(f"[{self.done}/{self.total}] {entry_id} {outcome}  {rate:.2f} entries/s, ETA {eta:.0f} s")
+
+def select_entries(manifest, fingerprint, force=False, rehash=False):
+    """
+    Entries to regenerate: all with force, otherwise the ones produced by another model plus the ones whose audio.wav changed since
+    they were recorded. The manifest row is only updated once an entry's new shapes are in place, so after an interruption
+    the entries already done are skipped here and the run resumes where it stopped. Audio is rehashed when its mtime is newer
+    than the row (every entry with rehash), unchanged files are not read.
+    """
+    if force:
+        return manifest.entries()
+
+    selected = manifest.stale(fingerprint)
+    for entry in manifest.entries():
+        if entry['fingerprint'] != fingerprint:
+            continue
+        audio_path = os.path.join(GENERATED_DIR, entry['id'], 'audio.wav')
+        try:
+            modified = os.path.getmtime(audio_path) > entry['updated_at']
+        except OSError:
+            continue
+        if (rehash or modified) and file_hash(audio_path) != (entry['wav_hash'] or entry['audio_hash']):
+            selected.append(entry)
+    return selected
+
+def replace_shapes(dir_path, generated_facial_data, fingerprint, keep_old=False, prune_formats=False):
+    """
+    Writes the new shapes (each file to a temporary name, then renamed over the old one) in config['shapes_format'] and in every
+    format the entry already had, so a shapes.csv imported into Unreal is regenerated rather than removed or left stale.
+    prune_formats removes the shapes files of formats not in config['shapes_format'] instead. keep_old keeps the previous shapes
+    as old/shapes_<fingerprint of the model that made them>, one copy per model. Returns (shapes path, format written).
+    """
+    previous = [os.path.join(dir_path, name) for name in (SHAPES_NPZ, SHAPES_CSV) if os.path.exists(os.path.join(dir_path, name))]
+    if keep_old and previous:
+        old_dir = os.path.join(dir_path, 'old')
+        os.makedirs(old_dir, exist_ok=True)
+        npz_path = os.path.join(dir_path, SHAPES_NPZ)
+        old_fingerprint = (read_npz_header(npz_path).get('fingerprint') if os.path.exists(npz_path) else None) or 'unknown'
+        for shapes_path in previous:
+            shutil.copy2(shapes_path, os.path.join(old_dir, f"shapes_{old_fingerprint}{os.path.splitext(shapes_path)[1]}"))
+
+    shapes_format = config['shapes_format']
+    configured = {SHAPES_NPZ, SHAPES_CSV} if shapes_format == 'both' else {SHAPES_NPZ if shapes_format == 'npz' else SHAPES_CSV}
+    if not prune_formats and any(os.path.basename(old_path) not in configured for old_path in previous):
+        shapes_format = 'both'
+    shapes_path = save_shapes(generated_facial_data, dir_path, shapes_format, config['frame_rate'], fingerprint, config['shapes_dtype'])
+    if prune_formats:
+        for old_path in previous:
+            if os.path.basename(old_path) not in configured:
+                os.remove(old_path)
+    return shapes_path, shapes_format
+
+def regenerate(workers=None, inflight=None, force=False, rehash=False, keep_old=False, limit=None, prune_formats=False):
+    workers = config['extraction_workers'] if workers is None else workers
+    inflight = config['regen_inflight'] if inflight is None else inflight
+    fingerprint = model_fingerprint(model_path, config)
+
+    extraction_pool = FeatureExtractionPool(workers).warm_up() # forked before the threads below exist
+    manifest = open_manifest(GENERATED_DIR, fingerprint) # entries come from the index, not a walk of generated/
+    entries = select_entries(manifest, fingerprint, force, rehash)[:limit]
+    print(f"Model {fingerprint}: {len(entries)} of {len(manifest)} entries to regenerate, {workers} extraction workers, {inflight} in flight")
+
+    scheduler = InferenceScheduler(model, device, config).start()
+    progress = Progress(len(entries))
+
+    def process_entry(entry):
+        dir_path = os.path.join(GENERATED_DIR, entry['id'])
         audio_path = os.path.join(dir_path, 'audio.wav')
-        shapes_path = os.path.join(dir_path, 'shapes.csv')
-        
-        if os.path.exists(audio_path):
-            print(f"Processing: {audio_path}")
-            
+        try:
             with open(audio_path, 'rb') as f:
                 audio_bytes = f.read()
-            
-            generated_facial_data = generate_facial_data_from_bytes(audio_bytes, model, device, config)
-            
-            old_dir = os.path.join(dir_path, 'old')
-            os.makedirs(old_dir, exist_ok=True)
-
-            if os.path.exists(shapes_path):
-                unique_old_name = f"shapes_{uuid.uuid4()}.csv"
-                shutil.move(shapes_path, os.path.join(old_dir, unique_old_name))
-            
-            save_generated_data_as_csv(generated_facial_data, shapes_path)
-            
-            print(f"New shapes.csv generated and old shapes.csv moved to {old_dir}")
+            audio_features = extraction_pool.extract(audio_bytes) # waits without the GIL while the pool works
+            if audio_features is None:
+                progress.update(entry['id'], 'skipped')
+                return
+            generated_facial_data = generate_facial_data_from_features(audio_features, model, device, config, scheduler=scheduler)
+
+            _, shapes_format = replace_shapes(dir_path, generated_facial_data, fingerprint, keep_old, prune_formats)
+            num_frames = len(generated_facial_data)
+            wav_hash = hashlib.sha256(audio_bytes).hexdigest()
+            # the hash of the upload stays unless audio.wav was replaced, then the new file is the source
+            audio_hash = entry['audio_hash'] if wav_hash == (entry['wav_hash'] or entry['audio_hash']) else wav_hash
+            manifest.record(entry['id'], audio_hash, num_frames / config['frame_rate'], num_frames,
+                            fingerprint, shapes_format, entry['created_at'], wav_hash)
+            progress.update(entry['id'], 'done')
+        except Exception as e:
+            print(f"Error regenerating {audio_path}: {e}")
+            progress.update(entry['id'], 'failed')
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(inflight, 1)) as executor:
+            list(executor.map(process_entry, entries))
+    finally:
+        scheduler.stop()
+        extraction_pool.shutdown()
+        manifest.close()
+
+    elapsed = time.monotonic() - progress.started
+    print(f"Regenerated {progress.done - progress.failed - progress.skipped} entries in {elapsed:.1f} s "
+          f"({progress.skipped} too short, {progress.failed} failed), batches: {scheduler.stats()['mean_batch_size']:.1f} windows on average")
+    return progress
+
+def process_audio_files():
+    regenerate()
 
 if __name__ == '__main__':
-    process_audio_files()
+    parser = argparse.ArgumentParser(description="Regenerate the shapes of the generated/ corpus with the current model.")
+    parser.add_argument('--workers', type=int, default=None, help="feature extraction processes (config 'extraction_workers')")
+    parser.add_argument('--inflight', type=int, default=None, help="entries processed at once (config 'regen_inflight')")
+    parser.add_argument('--force', action='store_true', help="regenerate every entry, even those already produced by this model")
+    parser.add_argument('--rehash', action='store_true', help="hash every audio.wav instead of only the ones modified since they were recorded")
+    parser.add_argument('--keep-old', action='store_true', help="keep the previous shapes as old/shapes_<previous model fingerprint>")
+    parser.add_argument('--prune-formats', action='store_true', help="delete shapes files of a format not in config 'shapes_format' (kept and regenerated by default)")
+    parser.add_argument('--limit', type=int, default=None, help="at most this many entries in this run")
+    args = parser.parse_args()
+
+    regenerate(args.workers, args.inflight, args.force, args.rehash, args.keep_old, args.limit, args.prune_formats)
@@ -0,0 +1,36 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# test_mfcc_engine.py
+# python -m unittest tests.test_mfcc_engine
+
+import os
+import unittest
+
+import numpy as np
+
+try:
+    import librosa # the reference the engine is checked against, and a dependency of the engine module itself
+except ImportError:
+    librosa = None
+
+SAMPLE_AUDIO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_data', 'audio.wav')
+TOLERANCE = 1e-3
+
+@unittest.skipIf(librosa is None, "librosa is not installed")
+class MfccEngineTest(unittest.TestCase):
+    def assert_matches_librosa(self, y, sr=88200):
+        from extraction.mfcc_engine import compare_with_librosa
+
+        for backend, error in compare_with_librosa(y, sr).items():
+            self.assertLessEqual(error, TOLERANCE, f"{backend} backend differs from librosa by {error:.3g}")
+
+    def test_sample_audio(self):
+        y, sr = librosa.load(SAMPLE_AUDIO, sr=88200)
+        self.assert_matches_librosa(y, sr)
+
+    def test_noise(self):
+        self.assert_matches_librosa(np.random.RandomState(0).randn(88200 * 3).astype(np.float32) * 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# test_pipeline.py
+# python -m unittest tests.test_pipeline
+
+import time
+import unittest
+from queue import Queue, Empty
+
+from utils.pipeline import ClipPipeline, Stage
+
+def take_request(clip):
+    clip.audio = clip.request
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+def played(pipeline, output_queue, until, timeout=5.0):
+    """What process_playback_queue would play: the items of the current generation, up to and including the request until."""
+    items = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            item = output_queue.get(timeout=0.1)
+        except Empty:
+            continue
+        if pipeline.current(item[3]):
+            items.append(item[0])
+        if item[0] == until:
+            return items
+    raise AssertionError(f"{until} never came out of the pipeline")
+
+class ClipPipelineTest(unittest.TestCase):
+    def test_in_order(self):
+        output_queue = Queue()
+        pipeline = ClipPipeline([Stage('first', take_request, workers=3, queue_size=0), Stage('second', take_request, workers=2)], output_queue).start()
+        for request in range(20):
+            pipeline.submit(request)
+        self.assertEqual(played(pipeline, output_queue, 19), list(range(20)))
+        pipeline.stop()
+
+    def test_clear_with_full_playback_queue(self):
+        # the playback queue holds 2 clips, the third is put while it is full and blocks the release in put() when clear() runs
+        output_queue = Queue(maxsize=2)
+        stage = Stage('take', take_request, workers=1, queue_size=8)
+        pipeline = ClipPipeline([stage], output_queue).start()
+        for request in range(5):
+            pipeline.submit(f"old {request}")
+        wait_for(lambda: output_queue.full() and stage.stats()['processed'] >= 3)
+        time.sleep(0.05)
+
+        pipeline.clear()
+        while not output_queue.empty(): # as /clear_queue drains the playback queue, which unblocks the release of "old 2"
+            output_queue.get_nowait()
+        pipeline.submit("new")
+
+        self.assertEqual(played(pipeline, output_queue, "new"), ["new"])
+        self.assertTrue(pipeline.empty())
+        pipeline.stop()
+
+if __name__ == '__main__':
+    unittest.main()
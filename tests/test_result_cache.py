@@ -0,0 +1,63 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# test_result_cache.py
+# python -m unittest tests.test_result_cache
+
+import time
+import unittest
+from threading import Thread
+
+import numpy as np
+
+from utils.result_cache import ResultCache
+
+AUDIO = b'RIFF not really a wav, only hashed'
+
+def wait_in_thread(cache, results):
+    def compute():
+        results['computed'] = True
+        return np.ones((3, 68), dtype=np.float32)
+    thread = Thread(target=lambda: results.update(result=cache.get_or_compute(AUDIO, compute)))
+    thread.start()
+    return thread
+
+class ResultClaimTest(unittest.TestCase):
+    def test_waiters_share_the_claimed_result(self):
+        cache = ResultCache('test')
+        claim = cache.claim(AUDIO)
+        self.assertIsNone(cache.claim(AUDIO))
+
+        results = {}
+        waiter = wait_in_thread(cache, results)
+        time.sleep(0.05)
+        self.assertNotIn('result', results) # waits for the claim instead of computing
+
+        claim.complete(np.zeros((3, 68), dtype=np.float32))
+        waiter.join(5)
+        generated_facial_data, hit = results['result']
+        self.assertTrue(hit)
+        self.assertNotIn('computed', results)
+        self.assertFalse(generated_facial_data.any())
+        self.assertEqual((cache.stats()['misses'], cache.stats()['in_flight']), (1, 0))
+
+        claim.abandon() # after complete(), as when the finished stream is closed
+        self.assertEqual(cache.get_or_compute(AUDIO, None)[1], True)
+
+    def test_abandoned_claim_is_computed_by_the_waiters(self):
+        cache = ResultCache('test')
+        claim = cache.claim(AUDIO)
+
+        results = {}
+        waiter = wait_in_thread(cache, results)
+        time.sleep(0.05)
+        claim.abandon()
+        waiter.join(5)
+
+        generated_facial_data, hit = results['result']
+        self.assertFalse(hit)
+        self.assertTrue(results['computed'])
+        self.assertTrue(generated_facial_data.all())
+
+if __name__ == '__main__':
+    unittest.main()
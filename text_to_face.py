@@ -6,13 +6,14 @@ import uuid
 from threading import Thread, Event, Lock
 
 from generate_face_shapes import generate_facial_data_from_bytes
-from livelink.connect.livelink_init import create_socket_connection, initialize_py_face
+from livelink.connect.livelink_init import create_livelink_sender, initialize_py_face
 from livelink.animations.default_animation import default_animation_loop, stop_default_animation
 from livelink.send_to_unreal import pre_encode_facial_data, send_pre_encoded_data_to_unreal
 from utils.audio.play_audio import play_audio_from_memory
 from utils.audio.save_audio import save_audio_file
-from utils.csv.save_csv import save_generated_data_as_csv
-from model import load_model
+from utils.csv.shapes_store import save_shapes
+from model import load_model, model_fingerprint
+from utils.generated_manifest import open_manifest, record_saved_entry
 
 # Configuration
 config = {
@@ -25,6 +26,13 @@ config = {
     'output_dim': 68,
     'input_dim': 26 + 26 + 26,
     'frame_size': 256,
+    'batch_size': 8,  # windows decoded per model pass, set to 1 for the chunk by chunk path
+    'backend': 'eager',  # eager, torchscript, compile or onnx (see model_backends.py)
+    'onnx_path': '_out/model.onnx',
+    'precision': 'fp32',  # fp32, int8 (dynamic quantized Linear layers, CPU only) or bf16 (autocast)
+    'lazy_load': False,  # True defers reading the weights until the first inference
+    'shapes_format': 'both',  # generated shapes as both (npz read back, csv for Unreal), npz only (binary, memory-mappable) or csv only, see utils/csv/shapes_store.py
+    'shapes_dtype': 'float32',  # float16 halves the npz files, ~1e-3 precision
 }
 
 model_path = '_out/model.pth'
@@ -81,10 +89,14 @@ def save_generated_data(audio_bytes, generated_facial_data):
     os.makedirs(output_dir, exist_ok=True)
 
     audio_path = os.path.join(output_dir, 'audio.wav')
-    shapes_path = os.path.join(output_dir, 'shapes.csv')
 
     save_audio_file(audio_bytes, audio_path)
-    save_generated_data_as_csv(generated_facial_data, shapes_path)
+    fingerprint = model_fingerprint(model_path, config)
+    shapes_path = save_shapes(generated_facial_data, output_dir, config['shapes_format'], config['frame_rate'], fingerprint, config['shapes_dtype'])
+
+    manifest = open_manifest(GENERATED_DIR, fingerprint)
+    record_saved_entry(manifest, unique_id, audio_bytes, generated_facial_data, shapes_path, config['shapes_format'], config['frame_rate'])
+    manifest.close()
 
     return unique_id, audio_path, shapes_path
 
@@ -126,7 +138,7 @@ if __name__ == "__main__":
 
     # Initialize PyFace and the default animation
     py_face = initialize_py_face()
-    socket_connection = create_socket_connection()
+    socket_connection = create_livelink_sender(py_face)
 
     default_animation_thread = Thread(target=default_animation_loop, args=(py_face,))
     default_animation_thread.start()
@@ -2,32 +2,45 @@
 # For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
 
 import os
+import time
 import uuid
-from threading import Thread, Event, Lock
+from queue import Queue
+from threading import Thread, Event, Lock, local
 
-from livelink.connect.livelink_init import create_socket_connection
+from livelink.connect.livelink_init import create_livelink_sender, initialize_py_face
 from livelink.send_to_unreal import pre_encode_facial_data, send_pre_encoded_data_to_unreal
+from livelink.frame_pacer import FramePacer
 from livelink.animations.default_animation import default_animation_loop, stop_default_animation
 
-from generate_face_shapes import generate_facial_data_from_bytes
+from generate_face_shapes import generate_facial_data_from_bytes, generate_facial_data_from_features
+from extraction.extraction_pool import FeatureExtractionPool
 
-from utils.csv.save_csv import save_generated_data_as_csv
+from utils.csv.shapes_store import save_shapes
+from utils.generated_manifest import record_saved_entry, GENERATED_DIR
 
-from utils.audio.play_audio import play_audio_bytes
+from utils.audio.play_audio import play_audio_bytes, play_decoded_audio, play_decoded_audio_stream
 from utils.audio.save_audio import save_audio_file
+from utils.audio.decoded_audio import DecodedAudio
+from utils.pipeline import ClipPipeline, Stage
 
-GENERATED_DIR = 'generated'
 queue_lock = Lock()
+active_streams = set() # AudioStreamSessions still producing windows, guarded by queue_lock
+playback_stats = {} # frame pacing of the last clip played and totals, see run_audio_animation
 
 def initialize_directories():
     if not os.path.exists(GENERATED_DIR):
         os.makedirs(GENERATED_DIR)
 
-def run_audio_animation(audio_bytes, encoded_facial_data, py_face, socket_connection):
+def run_audio_animation(audio, encoded_facial_data, py_face, socket_connection, sender=None):
     start_event = Event()
+    pacer = FramePacer(60)
+    sender_stats = {}
 
-    audio_thread = Thread(target=play_audio_bytes, args=(audio_bytes, start_event))
-    data_thread = Thread(target=send_pre_encoded_data_to_unreal, args=(encoded_facial_data, start_event, 60, socket_connection))
+    audio_thread = Thread(target=play_decoded_audio if isinstance(audio, DecodedAudio) else play_audio_bytes, args=(audio, start_event))
+    if sender is not None: # the sender process paces the frames from the moment the audio starts
+        data_thread = Thread(target=lambda: sender_stats.update(sender.play(encoded_facial_data, start_event)))
+    else:
+        data_thread = Thread(target=send_pre_encoded_data_to_unreal, args=(encoded_facial_data, start_event, 60, socket_connection, pacer))
 
     audio_thread.start()
     data_thread.start()
@@ -36,52 +49,238 @@ def run_audio_animation(audio_bytes, encoded_facial_data, py_face, socket_connec
     audio_thread.join()
     data_thread.join()
 
-def preprocess_audio(audio_bytes, model, device, config):
-    return generate_facial_data_from_bytes(audio_bytes, model, device, config)
+    stats = sender_stats if sender is not None else pacer.stats()
+    if sender is None and hasattr(socket_connection, 'stats'):
+        stats['livelink'] = socket_connection.stats()
+    record_playback_stats(stats)
+    return stats
 
-def save_generated_data(audio_bytes, generated_facial_data):
+class StreamClip:
+    """
+    The windows of one /audio_to_face_stream upload, put on the playback queue as a single item once the first window is ready
+    and played as one clip: the audio windows back to back on one mixer channel, the frames on one pacer timeline.
+    """
+    def __init__(self):
+        self.seconds = 0.0 # audio appended so far
+        self.cancelled = Event()
+        self._audio_windows = Queue()
+        self._frame_windows = Queue()
+
+    def append(self, audio, encoded_facial_data):
+        self.seconds += audio.duration
+        self._audio_windows.put(audio)
+        self._frame_windows.put(encoded_facial_data)
+
+    def end(self):
+        self._audio_windows.put(None)
+        self._frame_windows.put(None)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.end()
+
+    def audio_windows(self):
+        return self._windows(self._audio_windows)
+
+    def frame_windows(self):
+        return self._windows(self._frame_windows)
+
+    def _windows(self, windows):
+        while not self.cancelled.is_set():
+            window = windows.get()
+            if window is None:
+                return
+            yield window
+
+def run_stream_animation(stream_clip, py_face, socket_connection, sender=None):
+    start_event = Event()
+    pacer = FramePacer(60)
+    sender_stats = {}
+
+    audio_thread = Thread(target=play_decoded_audio_stream, args=(stream_clip.audio_windows(), start_event, stream_clip.cancelled))
+    if sender is not None: # each window is announced once the previous one is sent, on the timeline of the first
+        data_thread = Thread(target=lambda: sender_stats.update(send_stream_to_sender(stream_clip, sender, start_event)))
+    else:
+        frames = (frame_data for window in stream_clip.frame_windows() for frame_data in window)
+        data_thread = Thread(target=send_pre_encoded_data_to_unreal, args=(frames, start_event, 60, socket_connection, pacer))
+
+    audio_thread.start()
+    data_thread.start()
+
+    start_event.set()
+    audio_thread.join()
+    data_thread.join()
+
+    stats = sender_stats if sender is not None else pacer.stats()
+    if sender is None and hasattr(socket_connection, 'stats'):
+        stats['livelink'] = socket_connection.stats()
+    record_playback_stats(stats)
+    return stats
+
+def send_stream_to_sender(stream_clip, sender, start_event, fps=60):
+    start_event.wait()
+    start_time = time.monotonic()
+    frames = 0
+    stats = {}
+    for encoded_facial_data in stream_clip.frame_windows():
+        if len(encoded_facial_data) == 0:
+            continue
+        window_stats = sender.play(encoded_facial_data, start_time=start_time + frames / fps)
+        frames += len(encoded_facial_data)
+        for key in ('frames', 'sent', 'dropped'):
+            window_stats[key] = stats.get(key, 0) + window_stats.get(key, 0)
+        window_stats['max_lateness_ms'] = max(stats.get('max_lateness_ms', 0.0), window_stats.get('max_lateness_ms', 0.0))
+        stats = window_stats
+    return stats
+
+def record_playback_stats(stats):
+    with queue_lock:
+        playback_stats['last_clip'] = stats
+        playback_stats['clips'] = playback_stats.get('clips', 0) + 1
+        playback_stats['frames_sent'] = playback_stats.get('frames_sent', 0) + stats.get('sent', 0)
+        playback_stats['frames_dropped'] = playback_stats.get('frames_dropped', 0) + stats.get('dropped', 0)
+        playback_stats['max_lateness_ms'] = max(playback_stats.get('max_lateness_ms', 0.0), stats.get('max_lateness_ms', 0.0))
+        if 'livelink' in stats: # per target sent / errors / throughput of the persistent sender
+            playback_stats['livelink'] = stats['livelink']
+
+def playback_backlog_seconds(queued_clips):
+    """Estimated seconds before a clip queued now starts playing: the rest of the current clip plus queued_clips at the mean clip length."""
+    remaining = max(playback_stats.get('playing_until', 0.0) - time.monotonic(), 0.0)
+    return remaining + queued_clips * playback_stats.get('mean_clip_s', 0.0)
+
+def preprocess_audio(audio, model, device, config):
+    return generate_facial_data_from_bytes(audio, model, device, config)
+
+def decode_request(audio_bytes):
+    """The one decode of a request's audio, shared by extraction, persistence and playback. None if it cannot be decoded."""
+    try:
+        return DecodedAudio.from_bytes(audio_bytes)
+    except Exception as e:
+        print(f"Error decoding request audio: {e}")
+        return None
+
+def save_generated_data(audio, generated_facial_data, config=None, manifest=None):
+    """Writes generated/<new id>/ and, with a GeneratedManifest, records the entry in it once its files are in place."""
+    config = config or {}
     unique_id = str(uuid.uuid4())
     output_dir = os.path.join(GENERATED_DIR, unique_id)
     os.makedirs(output_dir, exist_ok=True)
 
     audio_path = os.path.join(output_dir, 'audio.wav')
-    shapes_path = os.path.join(output_dir, 'shapes.csv')
 
-    save_audio_file(audio_bytes, audio_path)
-    save_generated_data_as_csv(generated_facial_data, shapes_path)
+    save_audio_file(audio, audio_path)
+    shapes_format = config.get('shapes_format', 'both')
+    fingerprint = manifest.fingerprint if manifest is not None else None
+    shapes_path = save_shapes(generated_facial_data, output_dir, shapes_format, config.get('frame_rate', 60), fingerprint, config.get('shapes_dtype', 'float32'))
+    if manifest is not None:
+        record_saved_entry(manifest, unique_id, audio, generated_facial_data, shapes_path, shapes_format, config.get('frame_rate', 60))
 
     return unique_id, audio_path, shapes_path
 
-def process_preprocessing_queue(request_queue, preprocessed_data_queue, model, device, config):
-    while True:
-        audio_bytes = request_queue.get()
-        if audio_bytes is None:
-            break
-        generated_facial_data = preprocess_audio(audio_bytes, model, device, config)
-        save_generated_data(audio_bytes, generated_facial_data)
-        preprocessed_data_queue.put((audio_bytes, generated_facial_data))
-        request_queue.task_done()
+PIPELINE_STAGES = ('decode', 'features', 'inference', 'encode')
+
+def create_clip_pipeline(preprocessed_data_queue, model, device, config, result_cache=None, extraction_pool=None, persistence_writer=None, manifest=None):
+    """
+    The /audio_to_face stage graph: decode -> features -> inference -> encode, feeding preprocessed_data_queue (the playback stage)
+    with clips already encoded for LiveLink, in request order. config['pipeline'] sets workers and queue_size per stage.
+    """
+    extraction_pool = extraction_pool or FeatureExtractionPool(0) # without a process pool the features stage's threads extract
+    encoders = local()
+
+    def decode(clip):
+        clip.audio = decode_request(clip.request) # the one decode, shared by extraction, persistence and playback
+        clip.failed = clip.audio is None
 
-def process_playback_queue(preprocessed_data_queue, py_face, default_animation_thread, request_queue):
+    def features(clip):
+        # with a process pool this only hands the samples over, features for clip N+1 are computed while clip N is in inference
+        if result_cache is None or not result_cache.contains(clip.audio):
+            clip.features = extraction_pool.submit(clip.audio)
+
+    def inference(clip):
+        def generate():
+            audio_features = (clip.features or extraction_pool.submit(clip.audio)).result()
+            return generate_facial_data_from_features(audio_features, model, device, config)
+        clip.generated_facial_data = generate_and_save(clip.audio, generate, result_cache, config, persistence_writer, manifest)
+
+    def encode(clip):
+        if not hasattr(encoders, 'py_face'): # own encoder state per worker, the playback thread's py_face keeps sending meanwhile
+            encoders.py_face = initialize_py_face(config.get('livelink_filter'))
+        clip.encoded_facial_data = pre_encode_facial_data(clip.generated_facial_data, encoders.py_face, fps=60)
+
+    stage_fns = {'decode': decode, 'features': features, 'inference': inference, 'encode': encode}
+    settings = config.get('pipeline', {})
+    stages = [Stage(name, stage_fns[name], settings.get(name, {}).get('workers', 1), settings.get(name, {}).get('queue_size', 4)) for name in PIPELINE_STAGES]
+    return ClipPipeline(stages, preprocessed_data_queue)
+
+def generate_and_save(audio, generate, result_cache=None, config=None, persistence_writer=None, manifest=None):
+    """With a persistence_writer the result is saved in the background and returned for playback straight after inference."""
+    if result_cache is not None: # a miss is generated and stored under generated/<cache key>, a hit skips inference and saving
+        generated_facial_data, _ = result_cache.get_or_compute(audio, generate)
+    else:
+        generated_facial_data = generate()
+        if persistence_writer is not None:
+            persistence_writer.submit(save_generated_data, audio, generated_facial_data, config, manifest)
+        else:
+            save_generated_data(audio, generated_facial_data, config, manifest)
+    return generated_facial_data
+
+def process_playback_queue(preprocessed_data_queue, py_face, default_animation_thread, pipeline, sender=None):
+    """
+    The playback stage, after a ClipPipeline (and streamed uploads, one StreamClip each). With a SenderProcess the frames and the idle animation are sent by it,
+    otherwise by threads of this process. playback_stats['last_gap_ms'] / 'max_gap_ms' measure the silence between back-to-back clips.
+    Items are (audio, generated_facial_data, encoded_facial_data, generation), or (stream_clip, None, None, generation); the ones from before the last pipeline.clear() are dropped.
+    """
     global stop_default_animation
+    livelink_sender = create_livelink_sender(py_face) if sender is None else None # kept for every clip instead of a new socket each time
+    finished_at = None # end of the previous clip, when the next one was already waiting
     while True:
-        audio_bytes, generated_facial_data = preprocessed_data_queue.get()
-        if audio_bytes is None:
+        item = preprocessed_data_queue.get()
+        audio, generated_facial_data = item[:2]
+        if audio is None:
             break
+        if len(item) > 3 and item[3] is not None and not pipeline.current(item[3]): # put while /clear_queue ran
+            preprocessed_data_queue.task_done()
+            default_animation_thread = resume_idle_animation(preprocessed_data_queue, pipeline, py_face, default_animation_thread, sender)
+            continue
 
         with queue_lock:
-            stop_default_animation.set()
-            if default_animation_thread and default_animation_thread.is_alive():
-                default_animation_thread.join()
+            if sender is not None:
+                sender.set_idle(False)
+            else:
+                stop_default_animation.set()
+                if default_animation_thread and default_animation_thread.is_alive():
+                    default_animation_thread.join()
 
-        # Pre-encode facial data before sending to Unreal Engine
-        encoded_facial_data = pre_encode_facial_data(generated_facial_data, py_face, fps=60)
-        run_audio_animation(audio_bytes, encoded_facial_data, py_face, create_socket_connection())
+        if isinstance(audio, StreamClip): # the length is only known so far, the rest of the upload is still coming in
+            record_clip_start(audio.seconds, finished_at)
+            run_stream_animation(audio, py_face, livelink_sender, sender)
+        else:
+            # clips from the pipeline arrive encoded, the encode stage ran while the previous clip played
+            encoded_facial_data = item[2] if len(item) > 2 and item[2] is not None else pre_encode_facial_data(generated_facial_data, py_face, fps=60)
+            record_clip_start(len(encoded_facial_data) / 60, finished_at)
+            run_audio_animation(audio, encoded_facial_data, py_face, livelink_sender, sender)
 
         preprocessed_data_queue.task_done()
+        finished_at = time.monotonic() if not preprocessed_data_queue.empty() else None
 
-        with queue_lock:
-            if preprocessed_data_queue.empty() and request_queue.empty():
+        default_animation_thread = resume_idle_animation(preprocessed_data_queue, pipeline, py_face, default_animation_thread, sender)
+
+def record_clip_start(clip_s, finished_at):
+    with queue_lock: # for playback_backlog_seconds
+        if finished_at is not None:
+            playback_stats['last_gap_ms'] = (time.monotonic() - finished_at) * 1000.0
+            playback_stats['max_gap_ms'] = max(playback_stats.get('max_gap_ms', 0.0), playback_stats['last_gap_ms'])
+        playback_stats['playing_until'] = time.monotonic() + clip_s
+        playback_stats['mean_clip_s'] = clip_s if 'mean_clip_s' not in playback_stats else playback_stats['mean_clip_s'] + 0.2 * (clip_s - playback_stats['mean_clip_s'])
+
+def resume_idle_animation(preprocessed_data_queue, pipeline, py_face, default_animation_thread, sender=None):
+    """Back to the idle animation once nothing is left to play, returns the default animation thread (unchanged with a SenderProcess)."""
+    with queue_lock:
+        if preprocessed_data_queue.empty() and pipeline.empty() and not active_streams:
+            if sender is not None:
+                sender.set_idle(True)
+            elif default_animation_thread is None or not default_animation_thread.is_alive():
                 stop_default_animation.clear()
                 default_animation_thread = Thread(target=default_animation_loop, args=(py_face,))
                 default_animation_thread.start()
+    return default_animation_thread
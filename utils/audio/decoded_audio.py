@@ -0,0 +1,51 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# decoded_audio.py
+
+import numpy as np
+
+from utils.audio.fast_wav import decode_audio_bytes, resample_audio
+
+class DecodedAudio:
+    """
+    One request's audio, decoded once: mono float32 samples at the rate they came in, handed to feature extraction, persistence
+    and playback instead of the raw bytes each of them used to decode again. Only feature extraction resamples (resampled(88200)),
+    and it does not keep the result, so the 88.2 kHz buffer lives no longer than the MFCC pass.
+
+    audio_bytes keeps the original upload for the result cache key; it is not sent along when the object goes to an extraction worker.
+    """
+    def __init__(self, samples, sample_rate, audio_bytes=None):
+        self.samples = np.ascontiguousarray(samples, dtype=np.float32)
+        self.sample_rate = int(sample_rate)
+        self.audio_bytes = audio_bytes
+
+    @classmethod
+    def from_bytes(cls, audio_bytes):
+        y, sr = decode_audio_bytes(audio_bytes) # native rate, PCM / float WAV without librosa
+        return cls(y, sr, audio_bytes)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def resampled(self, sr):
+        return resample_audio(self.samples, self.sample_rate, sr)
+
+    def pcm16(self, sr=None):
+        """16-bit PCM samples, at sr if given, scaled the way save_audio_file always wrote them."""
+        y = self.samples if sr is None else self.resampled(sr)
+        return (np.clip(y, -1.0, 1.0) * 32767).astype(np.int16)
+
+    def __getstate__(self):
+        return {'samples': self.samples, 'sample_rate': self.sample_rate, 'audio_bytes': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+def source_bytes(audio):
+    """The original bytes of audio bytes or a DecodedAudio made from them, for hashing."""
+    return audio.audio_bytes if isinstance(audio, DecodedAudio) else audio
@@ -0,0 +1,210 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# fast_wav.py
+
+import io
+import math
+import struct
+from functools import lru_cache
+
+import numpy as np
+import librosa
+from scipy.signal import firwin, resample_poly
+
+try:
+    import soxr # librosa's default resampler since 0.10
+except ImportError:
+    soxr = None
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def parse_wav_header(audio_bytes):
+    """
+    Walks the RIFF chunks of a WAV file held in memory.
+    Returns (audio_format, channels, sample_rate, bits_per_sample, data_offset, data_size), or None if this is not a WAV we can read directly.
+    """
+    if len(audio_bytes) < 12 or audio_bytes[:4] != b'RIFF' or audio_bytes[8:12] != b'WAVE':
+        return None
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(audio_bytes):
+        chunk_id = audio_bytes[offset:offset + 4]
+        chunk_size = struct.unpack_from('<I', audio_bytes, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b'fmt ' and chunk_size >= 16:
+            audio_format, channels, sample_rate, _, _, bits_per_sample = struct.unpack_from('<HHIIHH', audio_bytes, body)
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                audio_format = struct.unpack_from('<H', audio_bytes, body + 24)[0] # first two bytes of the sub-format GUID
+            fmt = (audio_format, channels, sample_rate, bits_per_sample)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            available = len(audio_bytes) - body
+            if chunk_size == 0 or chunk_size > available: # streamed WAVs leave the size at 0 / 0xFFFFFFFF
+                chunk_size = available
+            return fmt + (body, chunk_size)
+
+        offset = body + chunk_size + (chunk_size & 1) # chunks are word aligned
+
+    return None
+
+def pcm_to_float(audio_bytes, audio_format, channels, bits_per_sample, data_offset, data_size):
+    """Samples as float32 in [-1, 1), shaped [frames, channels]. The integer view over the input buffer is zero-copy."""
+    sample_width = bits_per_sample // 8
+    frame_width = sample_width * channels
+    if channels < 1 or frame_width == 0:
+        return None
+    num_frames = data_size // frame_width
+    count = num_frames * channels
+
+    if audio_format == WAVE_FORMAT_PCM:
+        if bits_per_sample == 16:
+            samples = np.frombuffer(audio_bytes, dtype='<i2', count=count, offset=data_offset).astype(np.float32) / 32768.0
+        elif bits_per_sample == 32:
+            samples = np.frombuffer(audio_bytes, dtype='<i4', count=count, offset=data_offset).astype(np.float32) / 2147483648.0
+        elif bits_per_sample == 8:
+            samples = (np.frombuffer(audio_bytes, dtype=np.uint8, count=count, offset=data_offset).astype(np.float32) - 128.0) / 128.0
+        elif bits_per_sample == 24:
+            raw = np.frombuffer(audio_bytes, dtype=np.uint8, count=count * 3, offset=data_offset).reshape(-1, 3).astype(np.int32)
+            samples = ((raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)).astype(np.float32) / 2147483648.0
+        else:
+            return None
+    elif audio_format == WAVE_FORMAT_IEEE_FLOAT:
+        if bits_per_sample == 32:
+            samples = np.frombuffer(audio_bytes, dtype='<f4', count=count, offset=data_offset).astype(np.float32, copy=False)
+        elif bits_per_sample == 64:
+            samples = np.frombuffer(audio_bytes, dtype='<f8', count=count, offset=data_offset).astype(np.float32)
+        else:
+            return None
+    else:
+        return None
+
+    return samples.reshape(num_frames, channels)
+
+def read_wav_bytes(audio_bytes):
+    """(mono float32 samples, sample rate) of a PCM / float WAV, or None for anything else (compressed WAV, mp3, ...)."""
+    header = parse_wav_header(audio_bytes)
+    if header is None:
+        return None
+    audio_format, channels, sample_rate, bits_per_sample, data_offset, data_size = header
+
+    samples = pcm_to_float(audio_bytes, audio_format, channels, bits_per_sample, data_offset, data_size)
+    if samples is None:
+        return None
+
+    y = samples[:, 0] if channels == 1 else samples.mean(axis=1) # librosa.load(mono=True) averages the channels
+    return np.ascontiguousarray(y, dtype=np.float32), sample_rate
+
+@lru_cache(maxsize=32)
+def polyphase_filter(up, down):
+    """Anti-aliasing FIR for an up/down ratio, the same design resample_poly uses by default, built once per ratio."""
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)).astype(np.float32)
+
+def resample_audio(y, orig_sr, target_sr):
+    if orig_sr == target_sr:
+        return y
+    if soxr is not None: # same result as librosa.load(sr=...) with its default res_type='soxr_hq'
+        return soxr.resample(y, orig_sr, target_sr, quality='HQ').astype(np.float32, copy=False)
+    ratio_gcd = math.gcd(int(orig_sr), int(target_sr))
+    up = int(target_sr) // ratio_gcd
+    down = int(orig_sr) // ratio_gcd
+    return resample_poly(y, up, down, window=polyphase_filter(up, down)).astype(np.float32, copy=False)
+
+class StreamingWavDecoder:
+    """
+    Decodes a PCM / float WAV that arrives in chunks: feed() returns the mono float32 samples completed by each chunk
+    (resampled to sr unless sr is None). Anything else sets unsupported and is kept whole in pending for a one-shot decode at the end.
+    """
+    def __init__(self, sr=None):
+        self.sr = sr
+        self.header = None
+        self.unsupported = False
+        self.pending = bytearray()
+        self._remaining = None # data bytes left, None when the header leaves the size open
+        self._resampler = None
+
+    @property
+    def sample_rate(self):
+        return self.header[2] if self.header is not None else None
+
+    def feed(self, chunk):
+        self.pending += chunk
+        if self.unsupported:
+            return np.zeros(0, dtype=np.float32)
+
+        if self.header is None and not self._read_header():
+            return np.zeros(0, dtype=np.float32)
+
+        audio_format, channels, sample_rate, bits_per_sample = self.header[:4]
+        frame_width = channels * (bits_per_sample // 8)
+        usable = len(self.pending) // frame_width * frame_width
+        if self._remaining is not None:
+            usable = min(usable, self._remaining)
+            self._remaining -= usable
+
+        samples = pcm_to_float(bytes(self.pending[:usable]), audio_format, channels, bits_per_sample, 0, usable)
+        del self.pending[:usable]
+        if self._remaining == 0:
+            self.pending.clear() # trailing chunks (LIST, ...) are not audio
+
+        y = samples[:, 0] if channels == 1 else samples.mean(axis=1)
+        return self._resample(np.ascontiguousarray(y, dtype=np.float32), last=False)
+
+    def flush(self):
+        """Samples still held back by the resampler, call once after the last chunk."""
+        if self.unsupported or self.header is None:
+            return np.zeros(0, dtype=np.float32)
+        return self._resample(np.zeros(0, dtype=np.float32), last=True)
+
+    def _read_header(self):
+        if len(self.pending) >= 12 and (self.pending[:4] != b'RIFF' or self.pending[8:12] != b'WAVE'):
+            self.unsupported = True
+            return False
+
+        header = parse_wav_header(bytes(self.pending))
+        if header is None:
+            return False
+
+        audio_format, channels, sample_rate, bits_per_sample, data_offset, _ = header
+        if pcm_to_float(b'', audio_format, channels, bits_per_sample, 0, 0) is None:
+            self.unsupported = True
+            return False
+
+        declared_size = struct.unpack_from('<I', self.pending, data_offset - 4)[0]
+        if declared_size not in (0, 0xFFFFFFFF):
+            self._remaining = declared_size
+        self.header = header
+        del self.pending[:data_offset]
+
+        if self.sr is not None and self.sr != sample_rate and soxr is not None:
+            self._resampler = soxr.ResampleStream(sample_rate, self.sr, 1, dtype='float32', quality='HQ')
+        return True
+
+    def _resample(self, y, last):
+        if self.sr is None or self.sr == self.sample_rate:
+            return y
+        if self._resampler is not None: # stateful, no seams between chunks
+            return self._resampler.resample_chunk(y, last=last).astype(np.float32, copy=False)
+        return resample_audio(y, self.sample_rate, self.sr) if len(y) else y
+
+def decode_audio_bytes(audio_bytes, sr=None):
+    """
+    Decodes audio bytes to mono float32, resampled to sr unless sr is None.
+    PCM / float WAV is parsed directly and resampled with soxr, or a cached polyphase filter without it (22.05k, 24k, 44.1k -> 88.2k are small integer ratios),
+    everything else goes through librosa.load.
+    """
+    decoded = read_wav_bytes(audio_bytes)
+    if decoded is None:
+        return librosa.load(io.BytesIO(audio_bytes), sr=sr)
+
+    y, orig_sr = decoded
+    if sr is None:
+        return y, orig_sr
+    return resample_audio(y, orig_sr, sr), sr
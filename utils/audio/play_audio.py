@@ -5,6 +5,8 @@ import pygame
 import time
 import io
 
+import numpy as np
+
 
 def play_audio_bytes(audio_bytes, start_event):
     try:
@@ -27,6 +29,58 @@ def play_audio_bytes(audio_bytes, start_event):
     except Exception as e:
         print(f"Error in play_audio: {e}")
         
+def decoded_audio_sound(audio):
+    """A pygame Sound of a DecodedAudio's PCM samples, no WAV decode: resampled to the mixer's rate only if that differs."""
+    if not pygame.mixer.get_init():
+        pygame.mixer.init(frequency=audio.sample_rate, size=-16, channels=1)
+    frequency, size, channels = pygame.mixer.get_init()
+    if size != -16: # mixer opened elsewhere with another sample format
+        pygame.mixer.quit()
+        pygame.mixer.init(frequency=audio.sample_rate, size=-16, channels=1)
+        frequency, size, channels = pygame.mixer.get_init()
+
+    pcm = audio.pcm16(None if frequency == audio.sample_rate else frequency)
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1)
+    return pygame.mixer.Sound(buffer=np.ascontiguousarray(pcm).tobytes())
+
+def play_decoded_audio(audio, start_event):
+    """Plays a DecodedAudio from its PCM samples."""
+    try:
+        sound = decoded_audio_sound(audio)
+
+        start_event.wait()
+        channel = sound.play()
+        while channel is not None and channel.get_busy():
+            pygame.time.Clock().tick(10)
+    except Exception as e:
+        print(f"Error in play_decoded_audio: {e}")
+
+def play_decoded_audio_stream(windows, start_event, cancelled=None, poll_interval=0.005):
+    """
+    Plays an iterable of DecodedAudio windows back to back on one mixer channel: each window is queued behind the one playing
+    as soon as the channel's queue slot is free, so the mixer goes from one to the next without a gap. Stops when cancelled is set.
+    """
+    try:
+        channel = None
+        start_event.wait()
+        for audio in windows:
+            sound = decoded_audio_sound(audio)
+            if channel is None:
+                channel = pygame.mixer.find_channel(True)
+            while channel.get_queue() is not None and not (cancelled is not None and cancelled.is_set()):
+                time.sleep(poll_interval)
+            if cancelled is not None and cancelled.is_set():
+                break
+            channel.queue(sound) # starts straight away when nothing is playing on the channel
+        while channel is not None and channel.get_busy():
+            if cancelled is not None and cancelled.is_set():
+                channel.stop()
+                break
+            time.sleep(poll_interval)
+    except Exception as e:
+        print(f"Error in play_decoded_audio_stream: {e}")
+
 def play_audio_from_memory(audio_data, start_event):
     try:
         pygame.mixer.init()
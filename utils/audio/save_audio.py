@@ -1,25 +1,27 @@
 # This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
 # For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
 
-import librosa
 import wave 
 import io
 import numpy as np
 
+from utils.audio.fast_wav import decode_audio_bytes
+from utils.audio.decoded_audio import DecodedAudio
 
-def save_audio_file(audio_bytes, output_path, target_sr=88200):
 
-    y, sr = librosa.load(io.BytesIO(audio_bytes), sr=None)
-    
-    if sr != target_sr:
-        y = librosa.resample(y, orig_sr=sr, target_sr=target_sr)
-        sr = target_sr
+def save_audio_file(audio, output_path, target_sr=88200):
+    # written at target_sr either way, a DecodedAudio is only resampled when its rate differs, raw bytes are decoded first
+    if isinstance(audio, DecodedAudio):
+        pcm, sr = audio.pcm16(None if audio.sample_rate == target_sr else target_sr), target_sr
+    else:
+        y, sr = decode_audio_bytes(audio, target_sr)
+        pcm = (y * 32767).astype(np.int16)  # Convert float32 to int16 for WAV format
 
     with wave.open(output_path, 'wb') as wf:
         wf.setnchannels(1)  # Mono audio
         wf.setsampwidth(2)  # Assuming 16-bit PCM audio
         wf.setframerate(sr)
-        wf.writeframes((y * 32767).astype(np.int16))  # Convert float32 to int16 for WAV format
+        wf.writeframes(pcm)
     print(f"Audio data saved to {output_path}")
 
 
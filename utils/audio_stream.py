@@ -0,0 +1,191 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# audio_stream.py
+
+from threading import Thread, Event
+from queue import Queue
+
+import numpy as np
+
+from extraction.extract_features import extract_and_combine_features
+from extraction.online_features import OnlineFeatureExtractor
+from generate_face_shapes import generate_facial_data_from_features
+from livelink.connect.livelink_init import initialize_py_face
+from livelink.send_to_unreal import pre_encode_facial_data
+from processing.temporal_filters import StreamingSmoother, create_filter, PAIR_SMOOTHING
+from utils.audio.fast_wav import StreamingWavDecoder, decode_audio_bytes
+from utils.audio.decoded_audio import DecodedAudio
+from utils.api_utils import queue_lock, active_streams, StreamClip
+
+MIN_FEATURE_FRAMES = 9 # same minimum as extract_audio_features, needed for the deltas
+
+class AudioStreamSession:
+    """
+    One chunked upload to /audio_to_face_stream. Audio is decoded as it arrives and cut into windows of stream_window_frames output frames;
+    each window goes through feature extraction and inference on its own and is appended to one StreamClip, already encoded,
+    which goes on the playback queue with the first window: the face starts moving once the first window is in rather than
+    after the whole clip has been processed, and the windows play back to back as one clip. Smoothing runs over the whole
+    stream (a StreamingSmoother carries its state from window to window), so the pose does not jump at window boundaries.
+
+    With stream_features='online' (the default) features come from an OnlineFeatureExtractor run over the whole stream (running CMVN,
+    ~42 ms lookahead), with 'window' each window is featurized on its own with its own CMVN.
+    Either way normalisation differs from the whole-clip CMVN, so results differ slightly from /audio_to_face on the same audio.
+    Uploads that are not PCM / float WAV are buffered and decoded when the upload ends, then queued window by window.
+    Streamed clips are not saved to generated/ or the result cache.
+    """
+    def __init__(self, model, device, config, preprocessed_data_queue, generation=None):
+        self.model = model
+        self.device = device
+        self.config = config
+        self.preprocessed_data_queue = preprocessed_data_queue
+        self.generation = generation # of the ClipPipeline feeding the same playback queue, windows still queued after a clear are dropped
+
+        self.sr = config['sr']
+        self.fps = config['frame_rate']
+        self.frame_length = int(0.01667 * self.sr) # one output frame, as in extract_audio_features
+        self.hop_length = self.frame_length // 2
+        self.window_frames = config.get('stream_window_frames', config['frame_size'])
+        self.window_samples = self.window_frames * self.frame_length
+        self.blend_in_frames = int(0.1 * self.fps)
+        self.blend_out_frames = int(0.3 * self.fps)
+
+        self.py_face = initialize_py_face(config.get('livelink_filter')) # own encoder state, the playback thread encodes other clips with its py_face concurrently
+        self.extractor = OnlineFeatureExtractor(self.sr) if config.get('stream_features', 'online') == 'online' else None
+        smoothing_filter = create_filter(config.get('smoothing', PAIR_SMOOTHING))
+        self.smoother = StreamingSmoother(smoothing_filter) if smoothing_filter is not None else None
+        self.stream_clip = None # put on the playback queue with the first window
+        self.windows_queued = 0
+        self.frames_queued = 0
+        self._audio = np.zeros(0, dtype=np.float32)
+        self._features = np.zeros((0, 3 * 26), dtype=np.float32)
+        self._last_frame = None
+        self._chunks = Queue()
+        self._cancelled = Event()
+
+        with queue_lock:
+            active_streams.add(self)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def feed(self, chunk):
+        self._chunks.put(chunk)
+
+    def finish(self):
+        """End of the upload, the remaining audio is queued as the last window."""
+        self._chunks.put(None)
+
+    def cancel(self):
+        self._cancelled.set()
+        self._chunks.put(None)
+        if self.stream_clip is not None:
+            self.stream_clip.cancel()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        decoder = StreamingWavDecoder(self.sr)
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None or self._cancelled.is_set():
+                    break
+                self._add_audio(decoder.feed(chunk))
+                self._queue_full_windows(final=False)
+
+            if self._cancelled.is_set():
+                return
+
+            if decoder.unsupported:
+                self._add_audio(decode_audio_bytes(bytes(decoder.pending), self.sr)[0])
+            else:
+                self._add_audio(decoder.flush())
+            if self.extractor is not None:
+                self._features = np.vstack([self._features, self.extractor.flush()])
+
+            self._queue_full_windows(final=True)
+            self._finish_stream()
+        except Exception as e:
+            print(f"Error in audio stream: {e}")
+        finally:
+            with queue_lock:
+                active_streams.discard(self)
+            if self.stream_clip is not None:
+                self.stream_clip.end()
+
+    def _add_audio(self, y):
+        self._audio = np.concatenate([self._audio, y])
+        if self.extractor is not None:
+            self._features = np.vstack([self._features, self.extractor.process(y)])
+
+    def _queue_full_windows(self, final):
+        # at the end of the stream a window that exactly fits is kept back as the last one, so it gets the blend-out
+        while not self._cancelled.is_set():
+            enough_audio = len(self._audio) > self.window_samples if final else len(self._audio) >= self.window_samples
+            if not enough_audio or (self.extractor is not None and len(self._features) < self.window_frames):
+                return
+            self._queue_window(self._audio[:self.window_samples], last=False, audio_features=self._features[:self.window_frames] if self.extractor is not None else None)
+            self._audio = self._audio[self.window_samples:]
+            self._features = self._features[self.window_frames:]
+
+    def _finish_stream(self):
+        # leave active_streams before the last window is queued, so playback restarts the default animation after it
+        with queue_lock:
+            active_streams.discard(self)
+
+        if len(self._audio) > 0:
+            self._queue_window(self._audio, last=True, audio_features=self._features if len(self._features) > 0 else None)
+        elif self._last_frame is not None: # the clip ended on a window boundary: the frames held back, then the last pose while blending out
+            held_back = self._smooth(np.zeros((0, len(self._last_frame)), dtype=np.float32), last=True)
+            last_frame = held_back[-1] if len(held_back) > 0 else self._last_frame
+            facial_data = np.vstack([held_back, np.repeat(last_frame[None, :], self.blend_out_frames, axis=0)])
+            silence = np.zeros(self.blend_out_frames * self.frame_length, dtype=np.float32)
+            self._queue(silence, facial_data, last=True)
+
+    def _queue_window(self, y, last, audio_features=None):
+        first = self.windows_queued == 0
+        num_frames = -(-len(y) // self.frame_length)
+        if last: # pre_encode_facial_data needs enough frames for the blends
+            num_frames = max(num_frames, self.blend_out_frames + (self.blend_in_frames if first else 0))
+
+        if audio_features is None:
+            padded = y
+            min_samples = max(num_frames * self.frame_length, self.frame_length + (MIN_FEATURE_FRAMES - 1) * self.hop_length)
+            if len(padded) < min_samples:
+                padded = np.pad(y, (0, min_samples - len(y)))
+            audio_features = extract_and_combine_features(padded, self.sr, self.frame_length, self.hop_length)
+        elif len(audio_features) < num_frames:
+            audio_features = np.pad(audio_features, ((0, num_frames - len(audio_features)), (0, 0)), mode='edge')
+
+        facial_data = generate_facial_data_from_features(audio_features[:num_frames], self.model, self.device, self.config, use_smoothing=False)
+        self._queue(y, self._smooth(facial_data[:num_frames], last), last)
+
+    def _smooth(self, facial_data, last):
+        # centred filters hold the last frames of a window back until the next one, the frames stay on the stream's timeline
+        if self.smoother is None:
+            return facial_data
+        smoothed = self.smoother.push(facial_data) if len(facial_data) > 0 else facial_data
+        held_back = self.smoother.finish() if last else None
+        if held_back is not None and len(held_back) > 0:
+            smoothed = np.vstack([smoothed, held_back])
+        return smoothed.astype(np.float32, copy=False)
+
+    def _queue(self, y, facial_data, last):
+        if self._cancelled.is_set():
+            return
+        if len(facial_data) > 0:
+            encoded_facial_data = pre_encode_facial_data(facial_data, self.py_face, fps=self.fps, blend_in=self.frames_queued == 0, blend_out=last)
+            self._last_frame = facial_data[-1]
+        else:
+            encoded_facial_data = []
+        audio = DecodedAudio(y, self.sr) # played from the samples, no WAV round trip
+
+        if self.stream_clip is None:
+            self.stream_clip = StreamClip()
+            self.stream_clip.append(audio, encoded_facial_data)
+            self.preprocessed_data_queue.put((self.stream_clip, None, None, self.generation))
+        else:
+            self.stream_clip.append(audio, encoded_facial_data)
+        self.windows_queued += 1
+        self.frames_queued += len(facial_data)
@@ -0,0 +1,150 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# shapes_store.py
+# python -m utils.csv.shapes_store to-npz|to-csv [paths ...] -> converts shapes files (default: every entry under generated/)
+
+import argparse
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+from utils.csv.save_csv import BLENDSHAPE_NAMES, save_generated_data_as_csv
+
+SHAPES_NPZ = 'shapes.npz'
+SHAPES_CSV = 'shapes.csv'
+SHAPES_FORMATS = ('npz', 'csv', 'both')
+FORMAT_VERSION = 1
+
+def save_generated_data_as_npz(generated, output_path, fps=60, fingerprint=None, dtype='float32'):
+    """
+    Binary counterpart of save_generated_data_as_csv: an uncompressed .npz with the [frames, 68] values as 'shapes'
+    (float32, or float16 at half the size and ~1e-3 precision) and a JSON 'header' with fps, column names and the model fingerprint.
+    Written to a temporary file and renamed, so readers never see a partial file.
+    """
+    generated = np.asarray(generated).reshape(-1, len(BLENDSHAPE_NAMES)).astype(dtype, copy=False)
+    header = {'version': FORMAT_VERSION, 'fps': fps, 'frames': len(generated), 'columns': BLENDSHAPE_NAMES, 'fingerprint': fingerprint}
+
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, shapes=generated, header=np.array(json.dumps(header)))
+    os.replace(temp_path, output_path)
+
+def read_npz_header(npz_path):
+    with np.load(npz_path) as archive:
+        return json.loads(str(archive['header']))
+
+def load_shapes_npz(npz_path, mmap=False):
+    """(data, header) of a shapes .npz. With mmap the data is a read-only np.memmap straight onto the file, nothing is read up front."""
+    header = read_npz_header(npz_path)
+    if header.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f"{npz_path} has shapes format version {header['version']}, this code reads up to {FORMAT_VERSION}")
+    data = _memmap_npz_member(npz_path, 'shapes.npy') if mmap else None
+    if data is None:
+        with np.load(npz_path) as archive:
+            data = archive['shapes']
+    return data, header
+
+def _memmap_npz_member(npz_path, member):
+    # np.savez stores members uncompressed, so the .npy of a member sits contiguously in the zip after its local file header
+    with zipfile.ZipFile(npz_path) as archive:
+        info = archive.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(npz_path, 'rb') as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    return np.memmap(npz_path, dtype=dtype, mode='r', shape=shape, offset=offset, order='F' if fortran_order else 'C')
+
+def load_shapes_csv(csv_path):
+    import pandas as pd # only the CSV fallback needs pandas
+    data = pd.read_csv(csv_path)
+    data = data.drop(columns=['Timecode', 'BlendshapeCount'], errors='ignore')
+    return data.values
+
+def find_shapes(path):
+    """
+    The shapes file to read for path, a shapes .npz / .csv or an entry directory: the .npz of the same name when there is one
+    that is at least as new as the CSV (a CSV edited or regenerated by older tools wins), otherwise the CSV. None if neither exists.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, SHAPES_CSV)
+    base = os.path.splitext(path)[0]
+    npz_path, csv_path = base + '.npz', base + '.csv'
+
+    if os.path.exists(npz_path):
+        if not os.path.exists(csv_path) or os.path.getmtime(npz_path) >= os.path.getmtime(csv_path):
+            return npz_path
+    return csv_path if os.path.exists(csv_path) else None
+
+def load_shapes(path, mmap=False):
+    """[frames, 68] blendshape values of path (see find_shapes), preferring the binary file. mmap only applies to .npz files."""
+    shapes_path = find_shapes(path)
+    if shapes_path is None:
+        raise FileNotFoundError(f"No {SHAPES_NPZ} or {SHAPES_CSV} for {path}")
+    if shapes_path.endswith('.npz'):
+        return load_shapes_npz(shapes_path, mmap)[0]
+    return load_shapes_csv(shapes_path)
+
+def save_shapes(generated, output_dir, shapes_format='both', fps=60, fingerprint=None, dtype='float32'):
+    """Writes output_dir/shapes.npz, shapes.csv or both (shapes_format) and returns the path of the one to read back."""
+    if shapes_format not in SHAPES_FORMATS:
+        raise ValueError(f"Unknown shapes format '{shapes_format}', expected one of {SHAPES_FORMATS}")
+    csv_path = os.path.join(output_dir, SHAPES_CSV)
+    npz_path = os.path.join(output_dir, SHAPES_NPZ)
+
+    if shapes_format in ('csv', 'both'):
+        save_generated_data_as_csv(np.asarray(generated), csv_path + '.tmp')
+        os.replace(csv_path + '.tmp', csv_path)
+    if shapes_format in ('npz', 'both'): # written after the CSV, so find_shapes picks it
+        save_generated_data_as_npz(generated, npz_path, fps, fingerprint, dtype)
+        return npz_path
+    return csv_path
+
+def csv_to_npz(csv_path, npz_path=None, fps=60, fingerprint=None, dtype='float32'):
+    npz_path = npz_path or os.path.splitext(csv_path)[0] + '.npz'
+    save_generated_data_as_npz(load_shapes_csv(csv_path), npz_path, fps, fingerprint, dtype)
+    return npz_path
+
+def npz_to_csv(npz_path, csv_path=None):
+    """Unreal compatible CSV (Timecode, BlendshapeCount and the 68 columns) of a shapes .npz."""
+    csv_path = csv_path or os.path.splitext(npz_path)[0] + '.csv'
+    data, _ = load_shapes_npz(npz_path)
+    save_generated_data_as_csv(data.astype(np.float32), csv_path)
+    return csv_path
+
+def generated_entries(generated_dir='generated'):
+    if not os.path.isdir(generated_dir):
+        return []
+    return [os.path.join(generated_dir, d) for d in sorted(os.listdir(generated_dir)) if os.path.isdir(os.path.join(generated_dir, d))]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert shapes files between the binary .npz format and the Unreal compatible CSV.")
+    parser.add_argument('direction', choices=('to-npz', 'to-csv'))
+    parser.add_argument('paths', nargs='*', help="shapes files or entry directories, default every entry under generated/")
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--dtype', choices=('float32', 'float16'), default='float32')
+    args = parser.parse_args()
+
+    converted = 0
+    for path in args.paths or generated_entries():
+        base = os.path.splitext(os.path.join(path, SHAPES_CSV) if os.path.isdir(path) else path)[0]
+        source = base + ('.csv' if args.direction == 'to-npz' else '.npz')
+        if not os.path.exists(source):
+            continue
+        if args.direction == 'to-npz':
+            print(f"{source} -> {csv_to_npz(source, fps=args.fps, dtype=args.dtype)}")
+        else:
+            print(f"{source} -> {npz_to_csv(source)}")
+        converted += 1
+    print(f"Converted {converted} file(s).")
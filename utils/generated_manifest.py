@@ -0,0 +1,202 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# generated_manifest.py
+# python -m utils.generated_manifest rebuild|latest [N]|stale FINGERPRINT|hash AUDIO_HASH -> maintain / query generated/manifest.sqlite
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from threading import Lock
+
+import numpy as np
+
+from utils.csv.shapes_store import SHAPES_NPZ, SHAPES_CSV, find_shapes, read_npz_header
+from utils.audio.decoded_audio import source_bytes
+
+GENERATED_DIR = 'generated'
+MANIFEST_NAME = 'manifest.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id TEXT PRIMARY KEY,
+    audio_hash TEXT,
+    duration REAL,
+    frames INTEGER,
+    fingerprint TEXT,
+    format TEXT,
+    created_at REAL,
+    updated_at REAL,
+    wav_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_audio_hash ON entries (audio_hash);
+CREATE INDEX IF NOT EXISTS entries_fingerprint ON entries (fingerprint);
+CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at);
+"""
+
+COLUMNS = ('id', 'audio_hash', 'duration', 'frames', 'fingerprint', 'format', 'created_at', 'updated_at', 'wav_hash')
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class GeneratedManifest:
+    """
+    SQLite index of the generated/ corpus, one row per entry folder: id (the folder name), audio_hash (sha256 of the audio as it
+    was uploaded, the hash ResultCache.key_for uses), duration, frame count, fingerprint of the model that produced the shapes,
+    shapes format (npz, csv or both), created / updated times and wav_hash (sha256 of the audio.wav written, which regeneration
+    compares to notice a replaced file). Listing and regeneration query it instead of walking every folder.
+
+    Each record() is its own transaction. The database runs in WAL mode, so the server's writer and a regeneration run can use it at once.
+    fingerprint is the current model's, the default for stale() and for entries the server saves. Rows indexed from folders
+    by rebuild() only get a fingerprint if their shapes.npz header carries one; the rest count as stale.
+    """
+    def __init__(self, generated_dir=GENERATED_DIR, fingerprint=None):
+        self.generated_dir = generated_dir
+        self.fingerprint = fingerprint
+        self.path = os.path.join(generated_dir, MANIFEST_NAME)
+        os.makedirs(generated_dir, exist_ok=True)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(entries)")}
+            if 'wav_hash' not in columns: # manifests from before the column, their audio_hash is the hash of audio.wav
+                self._connection.execute("ALTER TABLE entries ADD COLUMN wav_hash TEXT")
+                self._connection.execute("UPDATE entries SET wav_hash = audio_hash")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def record(self, entry_id, audio_hash, duration, frames, fingerprint=None, shapes_format='npz', created_at=None, wav_hash=None):
+        """Adds or updates the entry for generated/<entry_id>, keeping its created_at. wav_hash defaults to audio_hash."""
+        now = time.time()
+        created_at = created_at or now
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO entries (id, audio_hash, duration, frames, fingerprint, format, created_at, updated_at, wav_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET audio_hash = excluded.audio_hash, duration = excluded.duration, frames = excluded.frames, "
+                "fingerprint = excluded.fingerprint, format = excluded.format, updated_at = excluded.updated_at, wav_hash = excluded.wav_hash",
+                (entry_id, audio_hash, duration, frames, fingerprint, shapes_format, created_at, now, wav_hash or audio_hash))
+
+    def record_entry(self, entry_id, fingerprint=None, fps=60):
+        """
+        Records generated/<entry_id> from its files: hashes audio.wav and reads the frame count (and fingerprint) from the shapes.
+        The uploaded bytes are gone by then, so audio_hash is the hash of audio.wav as well.
+        """
+        entry_dir = os.path.join(self.generated_dir, entry_id)
+        audio_path = os.path.join(entry_dir, 'audio.wav')
+        shapes_path = find_shapes(entry_dir)
+        if not os.path.exists(audio_path) or shapes_path is None:
+            return False
+
+        if shapes_path.endswith('.npz'):
+            header = read_npz_header(shapes_path)
+            frames, fps = header['frames'], header.get('fps', fps)
+            fingerprint = fingerprint or header.get('fingerprint')
+        else:
+            with open(shapes_path, 'rb') as f:
+                frames = max(sum(1 for _ in f) - 1, 0) # header line
+        has_csv = os.path.exists(os.path.join(entry_dir, SHAPES_CSV))
+        has_npz = os.path.exists(os.path.join(entry_dir, SHAPES_NPZ))
+        shapes_format = 'both' if has_csv and has_npz else ('npz' if has_npz else 'csv')
+
+        self.record(entry_id, file_hash(audio_path), frames / fps, frames, fingerprint, shapes_format, os.path.getmtime(audio_path))
+        return True
+
+    def remove(self, entry_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+    def get(self, entry_id):
+        rows = self._query("SELECT * FROM entries WHERE id = ?", (entry_id,))
+        return rows[0] if rows else None
+
+    def by_hash(self, audio_hash):
+        return self._query("SELECT * FROM entries WHERE audio_hash = ? ORDER BY created_at DESC", (audio_hash,))
+
+    def latest(self, n=10):
+        return self._query("SELECT * FROM entries ORDER BY created_at DESC LIMIT ?", (n,))
+
+    def stale(self, fingerprint=None):
+        """Entries not produced by the model with this fingerprint (the current one by default), oldest first."""
+        fingerprint = fingerprint or self.fingerprint
+        return self._query("SELECT * FROM entries WHERE fingerprint IS NULL OR fingerprint != ? ORDER BY created_at", (fingerprint,))
+
+    def entries(self):
+        return self._query("SELECT * FROM entries ORDER BY created_at")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def paths(self, entry):
+        """(audio path, shapes path) of an entry row, shapes.npz preferred, from the row alone without touching the disk."""
+        entry_dir = os.path.join(self.generated_dir, entry['id'])
+        return os.path.join(entry_dir, 'audio.wav'), os.path.join(entry_dir, SHAPES_CSV if entry['format'] == 'csv' else SHAPES_NPZ)
+
+    def rebuild(self, fps=60):
+        """
+        Indexes entry folders that are not in the manifest yet (corpora from before it, or copied in) and drops rows whose folder is gone.
+        The one operation that walks the whole directory, run it once to migrate and after editing generated/ by hand.
+        """
+        on_disk = {d for d in os.listdir(self.generated_dir) if os.path.isdir(os.path.join(self.generated_dir, d))}
+        indexed = {row['id'] for row in self._query("SELECT id FROM entries")}
+        added = sum(self.record_entry(entry_id, fps=fps) for entry_id in sorted(on_disk - indexed))
+        for entry_id in indexed - on_disk:
+            self.remove(entry_id)
+        return {'added': added, 'removed': len(indexed - on_disk), 'entries': len(self)}
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            cursor = self._connection.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def open_manifest(generated_dir=GENERATED_DIR, fingerprint=None):
+    """The manifest of generated_dir, indexed from the folders the first time it is created."""
+    existed = os.path.exists(os.path.join(generated_dir, MANIFEST_NAME))
+    manifest = GeneratedManifest(generated_dir, fingerprint)
+    if not existed:
+        manifest.rebuild()
+    return manifest
+
+def record_saved_entry(manifest, entry_id, audio, generated_facial_data, shapes_path, shapes_format, fps=60):
+    """
+    Manifest row for an entry save_generated_data / the result cache has just written. audio is the request's bytes or DecodedAudio,
+    audio_hash is taken from the uploaded bytes (audio.wav is re-encoded), so by_hash finds entries by the hash the result cache uses.
+    """
+    entry_dir = os.path.join(manifest.generated_dir, entry_id)
+    frames = len(np.asarray(generated_facial_data).reshape(-1, 68))
+    duration = getattr(audio, 'duration', frames / fps)
+    header_fingerprint = read_npz_header(shapes_path).get('fingerprint') if shapes_path.endswith('.npz') else None
+    manifest.record(entry_id, hashlib.sha256(source_bytes(audio)).hexdigest(), duration, frames, header_fingerprint or manifest.fingerprint,
+                    shapes_format, wav_hash=file_hash(os.path.join(entry_dir, 'audio.wav')))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain and query the generated/ manifest.")
+    parser.add_argument('command', choices=('rebuild', 'latest', 'stale', 'hash'))
+    parser.add_argument('argument', nargs='?')
+    parser.add_argument('--generated-dir', default=GENERATED_DIR)
+    args = parser.parse_args()
+
+    manifest = GeneratedManifest(args.generated_dir)
+    if args.command == 'rebuild':
+        print(manifest.rebuild())
+    else:
+        if args.command == 'latest':
+            rows = manifest.latest(int(args.argument or 10))
+        elif args.command == 'stale':
+            rows = manifest.stale(args.argument)
+        else:
+            rows = manifest.by_hash(args.argument)
+        for row in rows:
+            print("  ".join(f"{name}={row[name]}" for name in COLUMNS))
+        print(f"{len(rows)} entries")
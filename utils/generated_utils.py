@@ -3,22 +3,25 @@ import pandas as pd
 from threading import Thread, Event, Lock
 
 from utils.audio.play_audio import play_audio_from_path
+from utils.csv.shapes_store import load_shapes
+from utils.generated_manifest import open_manifest, GENERATED_DIR
 from livelink.send_to_unreal import pre_encode_facial_data, send_pre_encoded_data_to_unreal
 from livelink.animations.default_animation import default_animation_loop, stop_default_animation
 
-GENERATED_DIR = 'generated'
 queue_lock = Lock()
 
-def list_generated_files():
-    """List all the generated audio and face blend shape CSV files in the generated directory."""
-    directories = [d for d in os.listdir(GENERATED_DIR) if os.path.isdir(os.path.join(GENERATED_DIR, d))]
-    generated_files = []
-    for directory in directories:
-        audio_path = os.path.join(GENERATED_DIR, directory, 'audio.wav')
-        shapes_path = os.path.join(GENERATED_DIR, directory, 'shapes.csv')
-        if os.path.exists(audio_path) and os.path.exists(shapes_path):
-            generated_files.append((audio_path, shapes_path))
-    return generated_files
+def list_generated_files(limit=None):
+    """List the generated audio and face blend shape files (shapes.npz, else shapes.csv) from the generated/ manifest, newest first."""
+    manifest = open_manifest(GENERATED_DIR)
+    try:
+        entries = manifest.latest(limit if limit is not None else -1) # LIMIT -1 is no limit in SQLite
+        return [manifest.paths(entry) for entry in entries]
+    finally:
+        manifest.close()
+
+def load_facial_data(shapes_path):
+    """Facial data of a shapes.npz / shapes.csv, the binary file memory-mapped and preferred when both exist."""
+    return load_shapes(shapes_path, mmap=True)
 
 def load_facial_data_from_csv(csv_path):
     """Load facial data from a CSV file, excluding 'Timecode' and 'BlendshapeCount' columns."""
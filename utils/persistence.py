@@ -0,0 +1,91 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# persistence.py
+
+import time
+from threading import Thread, Lock
+from queue import Queue, Full
+
+PERSISTENCE_POLICIES = ('block', 'drop')
+
+class PersistenceWriter:
+    """
+    Runs save jobs (generated/ entries, result cache disk writes) on a background thread, so resampling the audio and writing
+    the WAV / shapes no longer sit between inference and playback. At most max_pending jobs wait; when the queue is full
+    'block' makes the caller wait for room (every result is saved, serving slows down to disk speed) and 'drop' skips the save.
+    flush() waits for the queued jobs, stop() flushes and ends the thread, call it on shutdown.
+    """
+    def __init__(self, max_pending=32, policy='block'):
+        if policy not in PERSISTENCE_POLICIES:
+            raise ValueError(f"Unknown persistence policy '{policy}', expected one of {PERSISTENCE_POLICIES}")
+        self.policy = policy
+        self._queue = Queue(maxsize=max_pending)
+        self._stats_lock = Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.write_seconds = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs), returns False if it was dropped. Without a running thread the job runs right away."""
+        if self._thread is None:
+            self._execute((fn, args, kwargs))
+            return True
+        try:
+            self._queue.put((fn, args, kwargs), block=self.policy == 'block')
+            return True
+        except Full:
+            with self._stats_lock:
+                self.dropped += 1
+            print(f"Persistence queue full, not saving this result ({self.dropped} dropped so far)")
+            return False
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None) # after every queued job
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {'policy': self.policy, 'pending': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped,
+                    'failed': self.failed, 'mean_write_ms': self.write_seconds / max(self.written, 1) * 1000.0}
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job):
+        fn, args, kwargs = job
+        started = time.perf_counter()
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed += 1
+            print(f"Error saving generated data: {e}")
+            return
+        with self._stats_lock:
+            self.written += 1
+            self.write_seconds += time.perf_counter() - started
@@ -0,0 +1,163 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# pipeline.py
+
+import time
+from threading import Thread, Lock
+from queue import Queue, Empty
+
+class Clip:
+    """One request travelling through a ClipPipeline, each stage fills in its part."""
+    def __init__(self, seq, generation, request):
+        self.seq = seq
+        self.generation = generation
+        self.request = request
+        self.audio = None
+        self.features = None
+        self.generated_facial_data = None
+        self.encoded_facial_data = None
+        self.failed = False
+
+class Stage:
+    """
+    One step of a ClipPipeline: fn(clip) run by workers threads on the clips waiting in its input queue, at most queue_size of them
+    (0 for no bound). A full queue makes the stage before it wait, so a slow stage holds the whole pipeline back instead of
+    clips piling up in front of it.
+    """
+    def __init__(self, name, fn, workers=1, queue_size=4):
+        self.name = name
+        self.fn = fn
+        self.workers = max(workers, 1)
+        self.queue = Queue(maxsize=queue_size)
+        self.threads = []
+        self._stats_lock = Lock()
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def run(self, clip):
+        started = time.perf_counter()
+        try:
+            self.fn(clip)
+        except Exception as e:
+            print(f"Error in pipeline stage {self.name}: {e}")
+            clip.failed = True
+        with self._stats_lock:
+            self.processed += 1
+            self.failed += clip.failed
+            self.busy_seconds += time.perf_counter() - started
+
+    def stats(self):
+        with self._stats_lock:
+            return {'workers': self.workers, 'queued': self.queue.qsize(), 'queue_size': self.queue.maxsize, 'processed': self.processed,
+                    'failed': self.failed, 'mean_ms': self.busy_seconds / max(self.processed, 1) * 1000.0}
+
+class ClipPipeline:
+    """
+    Requests pass through the stages in order (e.g. decode, features, inference, encode), each with its own workers, so while clip N
+    plays clip N+1 is already being encoded and N+2 inferred. Finished clips are put on output_queue as (audio, generated_facial_data,
+    encoded_facial_data, generation) in the order they were submitted, whatever order the workers finish them in; clips a stage
+    failed on are skipped. submit() raises queue.Full when the first stage's queue is full.
+
+    A clip can already be on its way onto a bounded output_queue when clear() runs, so the consumer drops items whose generation
+    is no longer current(), see process_playback_queue.
+    """
+    def __init__(self, stages, output_queue):
+        self.stages = stages
+        self.output_queue = output_queue
+        self._lock = Lock()
+        self._release_lock = Lock()
+        self._next_seq = 0 # seq of the next submitted clip
+        self._next_release = 0 # seq of the next clip due on output_queue
+        self._skip_to = 0 # clips before this seq were cleared
+        self._finished = {} # seq -> clip, finished ahead of _next_release
+        self._generation = 0
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            stage.threads = [Thread(target=self._run_stage, args=(index,), daemon=True) for _ in range(stage.workers)]
+            for thread in stage.threads:
+                thread.start()
+        return self
+
+    @property
+    def generation(self):
+        """Bumped by clear(), items put on output_queue (or next to it, e.g. streamed windows) carry the one they were made in."""
+        return self._generation
+
+    def current(self, generation):
+        return generation == self._generation
+
+    def is_running(self):
+        return bool(self.stages[0].threads) and all(thread.is_alive() for stage in self.stages for thread in stage.threads)
+
+    def submit(self, request):
+        with self._lock:
+            clip = Clip(self._next_seq, self._generation, request)
+            self.stages[0].queue.put_nowait(clip)
+            self._next_seq += 1
+        return clip.seq
+
+    def pending(self):
+        """Clips submitted and not yet on output_queue."""
+        with self._lock:
+            return self._next_seq - max(self._next_release, self._skip_to)
+
+    def empty(self):
+        return self.pending() == 0
+
+    def full(self):
+        return self.stages[0].queue.full()
+
+    def clear(self):
+        """Drops every clip not yet on output_queue, the ones a worker is busy with are dropped when they come out."""
+        with self._lock:
+            self._generation += 1
+            for stage in self.stages:
+                while True:
+                    try:
+                        stage.queue.get_nowait()
+                    except Empty:
+                        break
+            self._skip_to = self._next_seq
+
+    def stop(self):
+        """Lets the queued clips through and ends the workers, stage by stage."""
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(None)
+            for thread in stage.threads:
+                thread.join()
+
+    def stats(self):
+        return {'pending': self.pending(), 'stages': {stage.name: stage.stats() for stage in self.stages}}
+
+    def _run_stage(self, index):
+        stage = self.stages[index]
+        while True:
+            clip = stage.queue.get()
+            if clip is None:
+                break
+            if not clip.failed and clip.generation == self._generation:
+                stage.run(clip)
+            if index + 1 < len(self.stages):
+                self.stages[index + 1].queue.put(clip)
+            else:
+                self._release(clip)
+
+    def _release(self, clip):
+        with self._release_lock:
+            with self._lock:
+                if self._skip_to > self._next_release:
+                    self._next_release = self._skip_to
+                    self._finished = {seq: finished for seq, finished in self._finished.items() if seq >= self._skip_to}
+            if clip.seq < self._next_release:
+                return # cleared while in flight
+            self._finished[clip.seq] = clip
+            while self._next_release in self._finished:
+                clip = self._finished.pop(self._next_release)
+                if not clip.failed and clip.generation == self._generation:
+                    self.output_queue.put((clip.audio, clip.generated_facial_data, clip.encoded_facial_data, clip.generation))
+                with self._lock:
+                    self._next_release += 1
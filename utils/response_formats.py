@@ -0,0 +1,111 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# response_formats.py
+
+import json
+
+import numpy as np
+
+try:
+    import msgpack # optional, only the msgpack response format needs it
+except ImportError:
+    msgpack = None
+
+RESPONSE_FORMATS = ('json', 'binary', 'msgpack', 'ndjson')
+RESPONSE_DTYPES = ('float32', 'float16')
+
+MIME_TYPES = {
+    'application/json': 'json',
+    'application/octet-stream': 'binary',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/*': 'json',
+    '*/*': 'json',
+}
+
+def available_formats():
+    return tuple(name for name in RESPONSE_FORMATS if name != 'msgpack' or msgpack is not None)
+
+def negotiate_format(accept=None, requested_format=None, requested_dtype=None):
+    """
+    (format, dtype) of a blendshape response. ?format= / ?dtype= query values win over the Accept header, whose media types
+    are tried by q value; a dtype parameter on the media type (application/octet-stream; dtype=float16) picks the binary dtype.
+    Without either, or with an Accept header naming nothing known, the response is the JSON it has always been.
+    Raises ValueError for a format or dtype that was asked for explicitly and cannot be produced.
+    """
+    if requested_format is not None:
+        if requested_format not in available_formats():
+            raise ValueError(f"Unknown or unavailable response format '{requested_format}', expected one of {available_formats()}")
+        return requested_format, _check_dtype(requested_dtype or 'float32')
+
+    for media_type, params in _parse_accept(accept or ''):
+        response_format = MIME_TYPES.get(media_type)
+        if response_format in available_formats():
+            return response_format, _check_dtype(requested_dtype or params.get('dtype', 'float32'))
+    return 'json', _check_dtype(requested_dtype or 'float32')
+
+def _check_dtype(dtype):
+    if dtype not in RESPONSE_DTYPES:
+        raise ValueError(f"Unknown response dtype '{dtype}', expected one of {RESPONSE_DTYPES}")
+    return dtype
+
+def _parse_accept(accept):
+    entries = []
+    for index, part in enumerate(accept.split(',')):
+        fields = [field.strip() for field in part.split(';')]
+        if not fields[0]:
+            continue
+        params = dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+        try:
+            quality = float(params.pop('q', 1.0))
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            entries.append((-quality, index, fields[0].lower(), params))
+    return [(media_type, params) for _, _, media_type, params in sorted(entries)]
+
+def as_frames(generated_facial_data, channels=68):
+    return np.asarray(generated_facial_data, dtype=np.float32).reshape(-1, channels)
+
+def shape_headers(data, dtype, fps):
+    return {'X-Blendshape-Frames': str(data.shape[0]), 'X-Blendshape-Channels': str(data.shape[1]), 'X-Blendshape-Dtype': dtype, 'X-Blendshape-Fps': str(fps)}
+
+def encode_binary(generated_facial_data, dtype='float32', fps=60):
+    """(body, headers): the [frames, channels] values as raw little-endian float32 / float16, row after row, the shape in the headers."""
+    data = as_frames(generated_facial_data)
+    return np.ascontiguousarray(data, dtype=np.dtype(dtype).newbyteorder('<')).tobytes(), shape_headers(data, dtype, fps)
+
+def encode_msgpack(generated_facial_data, dtype='float32', fps=60):
+    """A msgpack map with frames, channels, dtype, fps and the values as one little-endian bin field, laid out like encode_binary."""
+    data = as_frames(generated_facial_data)
+    return msgpack.packb({
+        'frames': data.shape[0],
+        'channels': data.shape[1],
+        'dtype': dtype,
+        'fps': fps,
+        'blendshapes': np.ascontiguousarray(data, dtype=np.dtype(dtype).newbyteorder('<')).tobytes(),
+    })
+
+def split_blocks(generated_facial_data, block_size=256):
+    data = as_frames(generated_facial_data)
+    return (data[start:start + block_size] for start in range(0, len(data), block_size))
+
+def ndjson_lines(blocks, fps=60):
+    """
+    One JSON line per block of frames, {"start": first frame index, "blendshapes": [[...], ...]}, sent as soon as the block exists,
+    then {"done": true, "frames": total, "fps": fps}. An error part way through ends the stream with {"error": message} instead.
+    """
+    start = 0
+    try:
+        for block in blocks:
+            block = as_frames(block)
+            yield (json.dumps({'start': start, 'blendshapes': block.tolist()}) + '\n').encode()
+            start += len(block)
+    except Exception as e:
+        print(f"Error streaming blendshapes: {e}")
+        yield (json.dumps({'error': str(e), 'frames': start}) + '\n').encode()
+        return
+    yield (json.dumps({'done': True, 'frames': start, 'fps': fps}) + '\n').encode()
@@ -0,0 +1,207 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# result_cache.py
+
+import os
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+import numpy as np
+
+from utils.csv.shapes_store import find_shapes, load_shapes, save_shapes
+from utils.audio.save_audio import save_audio_file
+from utils.audio.decoded_audio import source_bytes
+from utils.generated_manifest import record_saved_entry
+
+def audio_hash(audio_bytes):
+    return hashlib.sha256(audio_bytes).hexdigest()
+
+class ResultCache:
+    """
+    Audio -> blendshape results keyed by the hash of the audio bytes and a model/config fingerprint.
+    A bounded in-memory LRU sits in front of an optional on-disk tier that uses the generated/<id>/audio.wav + shapes.npz / shapes.csv
+    layout (shapes_format, see utils/csv/shapes_store.py), with the cache key as the folder name. Concurrent requests for the same key share a single computation.
+    """
+    def __init__(self, fingerprint, max_entries=256, disk_dir=None, shapes_format='both', shapes_dtype='float32', fps=60, writer=None, manifest=None):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.shapes_format = shapes_format
+        self.shapes_dtype = shapes_dtype
+        self.fps = fps
+        self.writer = writer # a PersistenceWriter takes the disk writes off the request path
+        self.manifest = manifest # GeneratedManifest of disk_dir, disk entries are recorded in it
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, audio):
+        """audio: the request bytes or a DecodedAudio made from them, keyed by the bytes either way."""
+        return f"{audio_hash(source_bytes(audio))}_{self.fingerprint}"
+
+    def contains(self, audio):
+        key = self.key_for(audio)
+        with self._lock:
+            if key in self._entries or key in self._in_flight:
+                return True
+        return self.disk_dir is not None and find_shapes(self._entry_dir(key)) is not None
+
+    def get_or_compute(self, audio, compute_fn):
+        """
+        Returns (generated_facial_data, hit), compute_fn() only runs on a miss in both tiers. The array is shared with every later
+        hit and made read-only, copy it before changing it.
+        """
+        key = self.key_for(audio)
+
+        with self._lock:
+            generated_facial_data = self._entries.get(key)
+            if generated_facial_data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return generated_facial_data, True
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = Future()
+                self._in_flight[key] = in_flight
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            generated_facial_data = in_flight.result()
+            if generated_facial_data is None: # a claim given up before its result came, computed here instead
+                return self.get_or_compute(audio, compute_fn)
+            return generated_facial_data, True
+
+        try:
+            generated_facial_data = self._load_from_disk(key)
+            hit = generated_facial_data is not None
+            if not hit:
+                generated_facial_data = compute_fn()
+                self._persist(key, audio, generated_facial_data)
+
+            with self._lock:
+                if is_cacheable(generated_facial_data):
+                    self._store(key, generated_facial_data)
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+            in_flight.set_result(generated_facial_data)
+            return generated_facial_data, hit
+        except Exception as e:
+            in_flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def claim(self, audio):
+        """
+        For a result computed outside get_or_compute (a streamed response): registers the key as in flight, so concurrent
+        get_or_compute calls for it wait for the result instead of computing it again, and returns a ResultClaim to complete.
+        None if the result is cached or already being computed, get_or_compute returns it then.
+        """
+        key = self.key_for(audio)
+        if self.disk_dir is not None and find_shapes(self._entry_dir(key)) is not None:
+            return None
+        with self._lock:
+            if key in self._entries or key in self._in_flight:
+                return None
+            in_flight = self._in_flight[key] = Future()
+        return ResultClaim(self, key, audio, in_flight)
+
+    def _complete_claim(self, claim, generated_facial_data):
+        if claim.in_flight.done():
+            return
+        self._persist(claim.key, claim.audio, generated_facial_data)
+        with self._lock:
+            if is_cacheable(generated_facial_data):
+                self._store(claim.key, generated_facial_data)
+            self.misses += 1
+            self._in_flight.pop(claim.key, None)
+        claim.in_flight.set_result(generated_facial_data)
+
+    def _abandon_claim(self, claim):
+        if claim.in_flight.done():
+            return
+        with self._lock:
+            self._in_flight.pop(claim.key, None)
+        claim.in_flight.set_result(None) # the waiters compute it themselves
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses, 'in_flight': len(self._in_flight)}
+
+    def _persist(self, key, audio, generated_facial_data):
+        if not is_cacheable(generated_facial_data):
+            return
+        if self.writer is not None:
+            self.writer.submit(self._save_to_disk, key, audio, generated_facial_data)
+        else:
+            self._save_to_disk(key, audio, generated_facial_data)
+
+    def _store(self, key, generated_facial_data):
+        generated_facial_data.flags.writeable = False # handed to every hit, an in-place change would corrupt them
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = generated_facial_data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _load_from_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        shapes_path = find_shapes(self._entry_dir(key))
+        if shapes_path is None:
+            return None
+        try:
+            return np.asarray(load_shapes(shapes_path), dtype=np.float32)
+        except Exception as e:
+            print(f"Ignoring unreadable cache entry {shapes_path}: {e}")
+            return None
+
+    def _save_to_disk(self, key, audio, generated_facial_data):
+        if self.disk_dir is None:
+            return
+        output_dir = self._entry_dir(key)
+        os.makedirs(output_dir, exist_ok=True)
+        save_audio_file(audio, os.path.join(output_dir, 'audio.wav')) # a DecodedAudio is written without decoding the bytes again
+        # each shapes file is written to a temporary name and renamed, readers in other processes never see a half written entry
+        shapes_path = save_shapes(generated_facial_data, output_dir, self.shapes_format, self.fps, self.fingerprint, self.shapes_dtype)
+        if self.manifest is not None:
+            record_saved_entry(self.manifest, key, audio, generated_facial_data, shapes_path, self.shapes_format, self.fps)
+
+class ResultClaim:
+    """
+    A key in flight whose result the claiming request computes itself, see ResultCache.claim.
+    Ends with complete() or abandon(), whichever comes first, the other one does nothing then.
+    """
+    def __init__(self, cache, key, audio, in_flight):
+        self.cache = cache
+        self.key = key
+        self.audio = audio
+        self.in_flight = in_flight
+
+    def complete(self, generated_facial_data):
+        """Stores the result, counted as a miss, and hands it to the requests waiting for it."""
+        self.cache._complete_claim(self, generated_facial_data)
+
+    def abandon(self):
+        """The result will not come (the computation failed or the client went away), the requests waiting compute it themselves."""
+        self.cache._abandon_claim(self)
+
+def is_cacheable(generated_facial_data):
+    return isinstance(generated_facial_data, np.ndarray) and generated_facial_data.size > 0
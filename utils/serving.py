@@ -0,0 +1,293 @@
+# This code is licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# For more details, visit: https://creativecommons.org/licenses/by-nc/4.0/
+
+# serving.py
+
+import asyncio
+import json
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+
+from flask import jsonify
+
+try:
+    import uvicorn # optional, without it the APIs fall back to Flask's threaded development server
+except ImportError:
+    uvicorn = None
+
+class AdmissionController:
+    """
+    Admission for one expensive route: at most max_concurrent requests run at once and at most max_waiting wait for a slot.
+    A request that finds the waiting room full, or whose estimated wait (the requests ahead of it at the mean service time,
+    plus backlog() seconds of work queued elsewhere, e.g. audio still to be played) is over max_wait_s, is turned away with
+    429 and a Retry-After of that estimate instead of joining an ever longer queue.
+    """
+    def __init__(self, max_concurrent=4, max_waiting=16, max_wait_s=10.0, backlog=None, initial_service_s=1.0):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.max_wait_s = max_wait_s
+        self.backlog = backlog
+        self.mean_service_s = initial_service_s
+        self._condition = Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def estimated_wait(self):
+        with self._condition:
+            return self._estimated_wait()
+
+    def overloaded(self):
+        return self.estimated_wait() > self.max_wait_s
+
+    def acquire(self):
+        """Waits for a slot and returns None, or returns the Retry-After seconds of a rejection straight away."""
+        with self._condition:
+            wait = self._estimated_wait()
+            if (self.active >= self.max_concurrent and self.waiting >= self.max_waiting) or wait > self.max_wait_s:
+                self.rejected += 1
+                return max(math.ceil(wait), 1)
+            self.waiting += 1
+            while self.active >= self.max_concurrent:
+                self._condition.wait()
+            self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return None
+
+    def release(self, service_s):
+        with self._condition:
+            self.active -= 1
+            self.mean_service_s += 0.2 * (service_s - self.mean_service_s)
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {'active': self.active, 'waiting': self.waiting, 'admitted': self.admitted, 'rejected': self.rejected,
+                    'mean_service_s': self.mean_service_s, 'estimated_wait_s': self._estimated_wait(),
+                    'max_concurrent': self.max_concurrent, 'max_waiting': self.max_waiting, 'max_wait_s': self.max_wait_s}
+
+    def _estimated_wait(self):
+        ahead = self.active + self.waiting - self.max_concurrent + 1 # requests that have to finish before a new one gets a slot
+        wait = max(ahead, 0) / self.max_concurrent * self.mean_service_s
+        return wait + (self.backlog() if self.backlog is not None else 0.0)
+
+class AdmissionMiddleware:
+    """
+    WSGI middleware applying an AdmissionController to each path in limits, other paths (health, stats) are never held back.
+    The slot is released once the response has been sent, so a streamed response counts until its last chunk.
+    """
+    def __init__(self, wsgi_app, limits):
+        self.wsgi_app = wsgi_app
+        self.limits = limits
+
+    def threads_needed(self):
+        return sum(controller.max_concurrent + controller.max_waiting for controller in self.limits.values())
+
+    def __call__(self, environ, start_response):
+        controller = self.limits.get(environ.get('PATH_INFO'))
+        if controller is None:
+            return self.wsgi_app(environ, start_response)
+
+        retry_after = controller.acquire()
+        if retry_after is not None:
+            body = json.dumps({'status': 'overloaded', 'retry_after': retry_after}).encode()
+            start_response('429 Too Many Requests', [('Content-Type', 'application/json'), ('Content-Length', str(len(body))), ('Retry-After', str(retry_after))])
+            return [body]
+
+        started = time.monotonic()
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except Exception:
+            controller.release(time.monotonic() - started)
+            raise
+        return ReleasingResponse(response, lambda: controller.release(time.monotonic() - started))
+
+class ReleasingResponse:
+    """A WSGI response iterable that calls release once, after its last chunk or when the server closes it, whichever comes first."""
+    def __init__(self, response, release):
+        self.response = response
+        self._release = release
+        self._lock = Lock()
+
+    def __iter__(self):
+        yield from self.response
+        self._release_once()
+
+    def close(self):
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self._release_once()
+
+    def _release_once(self):
+        with self._lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release()
+
+def overloaded_response(retry_after):
+    """429 for a route that rejects on its own (e.g. a full queue), shaped like the AdmissionMiddleware one."""
+    retry_after = max(math.ceil(retry_after), 1)
+    return jsonify({'status': 'overloaded', 'retry_after': retry_after}), 429, {'Retry-After': str(retry_after)}
+
+def add_health_routes(app, checks):
+    """
+    /health answers 200 while the process is serving (liveness). /ready answers 200 only while every readiness check is true,
+    otherwise 503 with the results, so a load balancer stops sending requests to a replica that is overloaded or lost a worker.
+    checks maps names to callables returning a bool.
+    """
+    @app.route('/health', methods=['GET'])
+    def health_route():
+        return jsonify({'status': 'ok'})
+
+    @app.route('/ready', methods=['GET'])
+    def ready_route():
+        results = {name: bool(check()) for name, check in checks.items()}
+        ready = all(results.values())
+        return jsonify({'ready': ready, 'checks': results}), 200 if ready else 503
+
+class RequestBody:
+    """wsgi.input of an ASGI request, read on an executor thread: each read pulls further body messages from the event loop as needed."""
+    def __init__(self, receive_message):
+        self._receive_message = receive_message
+        self._buffer = bytearray()
+        self._more = True
+
+    def read(self, size=-1):
+        while self._more and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        return self._take(len(self._buffer) if size is None or size < 0 else size)
+
+    def readline(self, size=-1):
+        while self._more and b'\n' not in self._buffer and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        return self._take(end if size is None or size < 0 else min(end, size))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def _fill(self):
+        message = self._receive_message()
+        if message['type'] == 'http.disconnect':
+            self._more = False
+            return
+        self._buffer += message.get('body', b'')
+        self._more = message.get('more_body', False)
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+class AsgiAdapter:
+    """
+    ASGI front for the Flask apps: the event loop owns the connections and each request runs its WSGI view on an executor thread,
+    so feature extraction, inference and playback queueing never block the loop. Request bodies are handed over as they
+    arrive (chunked uploads to /audio_to_face_stream keep streaming) and responses are sent chunk by chunk.
+    """
+    def __init__(self, wsgi_app, threads=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-view')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait=False)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run_wsgi, scope, receive, send, loop)
+
+    def _run_wsgi(self, scope, receive, send, loop):
+        def call(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response_start.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start.update(status=int(status.split(' ', 1)[0]), headers=[(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers])
+            return write
+
+        def write(data):
+            if not response_start.get('sent'):
+                call(send({'type': 'http.response.start', 'status': response_start['status'], 'headers': response_start['headers']}))
+                response_start['sent'] = True
+            if data:
+                call(send({'type': 'http.response.body', 'body': data, 'more_body': True}))
+
+        try:
+            response = self.wsgi_app(build_environ(scope, RequestBody(lambda: call(receive()))), start_response)
+            try:
+                for chunk in response:
+                    write(chunk)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+            write(b'')
+        except Exception as e:
+            print(f"Error serving {scope['method']} {scope['path']}: {e}")
+            if response_start.get('sent'):
+                return # the client sees the response end early
+            response_start.update(status=500, headers=[(b'content-type', b'text/plain')])
+            write(b'Internal Server Error')
+        call(send({'type': 'http.response.body', 'body': b'', 'more_body': False}))
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True, # the body ends when the ASGI messages do, chunked uploads have no Content-Length
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin1').upper().replace('-', '_')
+        key = key if key in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + key
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def run_app(app, config, host='0.0.0.0', port=7777):
+    """
+    Serves a Flask app. With config['server'] 'asgi' (the default) and uvicorn installed it runs behind AsgiAdapter, with at least
+    enough view threads for every request its AdmissionMiddleware can admit plus a few for health and stats, and uvicorn
+    answering 503 past serving_max_connections open connections. Otherwise Flask's threaded development server is used.
+    """
+    server = config.get('server', 'asgi')
+    if server == 'asgi' and uvicorn is not None:
+        threads_needed = app.wsgi_app.threads_needed() + 4 if isinstance(app.wsgi_app, AdmissionMiddleware) else 0
+        threads = max(config.get('serving_threads', 32), threads_needed)
+        uvicorn.run(AsgiAdapter(app, threads), host=host, port=port, limit_concurrency=config.get('serving_max_connections'), log_level='warning')
+        return
+    if server == 'asgi':
+        print("uvicorn is not installed, serving with Flask's development server")
+    app.run(host=host, port=port, threaded=True)